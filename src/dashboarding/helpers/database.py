@@ -18,6 +18,11 @@ class Database(object):
 
         try:
             self.cxn = sqlite3.connect(self.cxn_str)
+            if self.cxn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'c_shards'").fetchone():
+                # Sharded output, the catalog attaches the shards behind views named after the tables
+                from schoolsim.helpers.database import ShardCatalog
+                self.cxn.close()
+                self.cxn = ShardCatalog(self.cxn_str).connect()
         except:
             logger.error("Could not connect to dashboarding database")
             self.cxn = None
@@ -1,6 +1,13 @@
 import datetime
 import dateutil.easter
 import logging
+import os
+import tempfile
+import zipfile
+import numpy as np
+
+from collections import OrderedDict
+from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
@@ -15,14 +22,140 @@ SATURDAY = 'sa'
 SUNDAY = 'su'
 SCHOOL_CLOSED = 'school_closed'
 CURRENT_YEAR = 2021
+WEEKDAYS = ['mo', 'tu', 'we', 'th', 'fr', 'sa', 'su']
+WORKWEEK = '1111100'
+SCHOOL_DAYS = 180  # Number of school days in a school year
+SCHEDULE_DAYS = 10  # Number of days in the schedule cycle
+SCHEDULE_PERIODS = 6  # Number of one hour periods in a school day
+WEEK_DAYS = 5  # Number of school days in a week, topic durations are hours by week
+TERM_WINDOWS = ((10, 60), (70, 120), (130, 180))  # School day ranges of the evaluation terms
+ORDINAL_EPOCH = datetime.date(1970, 1, 1).toordinal()  # Ordinal of the datetime64 epoch
 
 
 class SchoolSchedule(object):
-    """Stub: Définit un horaire des cours sur cycle de 5 ou 10 jours.
+    """Définit l'horaire des cours d'une année scolaire à l'école sur un cycle de 5 ou 10 jours. Chaque groupe,
+    personne enseignante et local partagé (ex. gymnase, local de musique) a un ensemble de bits sur les périodes
+    (jour, période) du cycle; une période est libre pour un cours si elle est libre dans les trois ensembles.
 
     """
-    # TODO Design SchoolSchedule class
-    pass
+
+    def __init__(self, schedule_days=SCHEDULE_DAYS, periods=SCHEDULE_PERIODS):
+        """Initialise l'horaire des cours vide.
+
+        :param schedule_days: le nombre de jours du cycle.
+        :param periods: le nombre de périodes d'un jour de classe.
+        """
+        self.schedule_days = schedule_days
+        self.periods = periods
+        self.full = (1 << (schedule_days * periods)) - 1
+        self.day_masks = [((1 << periods) - 1) << (day * periods) for day in range(schedule_days)]
+        self.group_slots = {}  # Busy periods by group id
+        self.teacher_slots = {}  # Busy periods by teacher uid
+        self.room_slots = {}  # Busy periods by shared room
+        self.topic_slots = {}  # Periods by (group id, topic id)
+        self.conflicts = 0  # Number of periods that could not be placed
+
+    def __len__(self):
+        return len(self.topic_slots)
+
+    def required_periods(self, duration):
+        """Retourne le nombre de périodes d'une matière sur le cycle.
+
+        :param duration: le nombre d'heures de la matière par semaine.
+        :return: le nombre de périodes de la matière sur le cycle.
+        """
+        return int(round(duration * self.schedule_days / WEEK_DAYS))
+
+    def build(self, groups):
+        """Place les matières de tous les groupes d'une année scolaire à l'horaire. Les matières enseignées dans un
+        local partagé sont placées en premier, puis celles des spécialistes et enfin celles des titulaires.
+
+        :param groups: la liste des groupes de l'année scolaire, dont les matières ont leur personne enseignante.
+        :return:
+        """
+        courses = []
+        for (rank, group) in enumerate(groups):
+            for topic in group.get_topics():
+                priority = 0 if topic.sharesRoom else 1 if topic.isSpeciality else 2
+                courses.append((priority, rank, group, topic))
+        courses.sort(key=lambda course: course[0:2])
+        for (priority, rank, group, topic) in courses:
+            teacher_uid = topic.teacher.uid if topic.teacher is not None else None
+            room = topic.name if topic.sharesRoom else None
+            placed = self.place(group.id, topic.id, teacher_uid, room, self.required_periods(topic.duration),
+                                first_day=rank % self.schedule_days)
+            if placed < self.required_periods(topic.duration):
+                logger.warning("Schedule, placed {} of {} periods of topic {} for group {}".format(
+                    placed, self.required_periods(topic.duration), topic.id, group.id))
+
+    def place(self, group_id, topic_id, teacher_uid, room, number_periods, first_day=0):
+        """Place les périodes d'une matière d'un groupe à l'horaire, en les répartissant sur le plus de jours
+        possible, là où le groupe, la personne enseignante et le local sont libres.
+
+        :param group_id: l'identifiant du groupe.
+        :param topic_id: l'identifiant de la matière scolaire.
+        :param teacher_uid: l'identifiant de la personne enseignante, None si aucune.
+        :param room: le local partagé, None si la matière se donne dans le local du groupe.
+        :param number_periods: le nombre de périodes à placer.
+        :param first_day: le premier jour du cycle à considérer, pour répartir les groupes.
+        :return: le nombre de périodes placées.
+        """
+        busy = self.group_slots.get(group_id, 0) | self.room_slots.get(room, 0)
+        if teacher_uid is not None:
+            busy |= self.teacher_slots.get(teacher_uid, 0)
+        free = ~busy & self.full
+        slots = self.topic_slots.get((group_id, topic_id), 0)
+        placed = 0
+        while placed < number_periods and free:
+            # Least loaded day for the topic, then closest to the first day
+            day = min((day for day in range(self.schedule_days) if free & self.day_masks[day]),
+                      key=lambda day: (bin(slots & self.day_masks[day]).count('1'),
+                                       (day - first_day) % self.schedule_days))
+            day_free = free & self.day_masks[day]
+            slot = day_free & -day_free  # Lowest free period of the day
+            slots |= slot
+            free &= ~slot
+            placed += 1
+        self.topic_slots[(group_id, topic_id)] = slots
+        self.group_slots[group_id] = self.group_slots.get(group_id, 0) | slots
+        if teacher_uid is not None:
+            self.teacher_slots[teacher_uid] = self.teacher_slots.get(teacher_uid, 0) | slots
+        if room is not None:
+            self.room_slots[room] = self.room_slots.get(room, 0) | slots
+        self.conflicts += number_periods - placed
+        return placed
+
+    def get_periods(self, group_id, topic_id):
+        """Retourne les périodes d'une matière d'un groupe.
+
+        :param group_id: l'identifiant du groupe.
+        :param topic_id: l'identifiant de la matière scolaire.
+        :return: la liste des (jour, période) du cycle, numérotés à partir de 1.
+        """
+        slots = self.topic_slots.get((group_id, topic_id), 0)
+        return [(slot // self.periods + 1, slot % self.periods + 1) for slot in range(slots.bit_length())
+                if slots >> slot & 1]
+
+    def get_days(self, group_id, topic_id):
+        """Retourne les jours du cycle où une matière d'un groupe est enseignée.
+
+        :param group_id: l'identifiant du groupe.
+        :param topic_id: l'identifiant de la matière scolaire.
+        :return: la liste triée des jours du cycle, numérotés à partir de 1.
+        """
+        slots = self.topic_slots.get((group_id, topic_id), 0)
+        return [day + 1 for day in range(self.schedule_days) if slots & self.day_masks[day]]
+
+    def get_calendar_days(self, group_id, topic_id):
+        """Retourne les jours du cycle du calendrier scolaire (10 jours) où une matière d'un groupe est enseignée.
+        Un horaire sur 5 jours se répète deux fois dans le cycle du calendrier.
+
+        :param group_id: l'identifiant du groupe.
+        :param topic_id: l'identifiant de la matière scolaire.
+        :return: la liste triée des jours du cycle du calendrier, numérotés à partir de 1.
+        """
+        days = self.get_days(group_id, topic_id)
+        return [day for day in range(1, SCHEDULE_DAYS + 1) if (day - 1) % self.schedule_days + 1 in days]
 
 
 class SchoolCalendar(object):
@@ -30,12 +163,13 @@ class SchoolCalendar(object):
 
     """
 
-    def __init__(self, year_start, level='primary'):
+    def __init__(self, year_start, level='primary', setup_school_days=True):
         """Initialise le calendrier scolaire annuel à partir de l'année du début du calendrier scolaire.
         Ainsi l'année correspondante au calendrier scolaire 2029-2030 est 2029.
 
         :param year_start: Année de début du calendrier scolaire.
         :param level: Type de calendrier, la valeur par défaut est 'primary'.
+        :param setup_school_days: Faux pour différer le calcul des jours de classe, voir build_many.
         """
         self.year_start = year_start
         self.year_end = year_start + 1
@@ -63,10 +197,31 @@ class SchoolCalendar(object):
         self.holidays = []  # Days that are considered holidays (cnt: 20)
         self.pedagogicals = []  # Days that are pedagogical (cnt: 20)
         self.schooldays = []  # Days of school (cnt: 180)
+        self.schoolday_dates = None  # Days of school as datetime64[D] array
+        self.schedule_days = None  # Schedule day of each day of school
+        self.schedule_weeks = None  # Schedule week of each day of school
+        self.schoolday_ordinals = None  # Date ordinal of each day of school
+        self.term_index = None  # School day indices of each evaluation term
+        self.schedule_index = None  # School day indices of each schedule day
 
-        self.__setup_school_days()
-        logger.debug(
-            "Instantiating calendar for year {} with {} school days".format(self.school_year, len(self.schooldays)))
+        self.__setup_holidays()
+        self.__setup_pedagogicals()
+        if setup_school_days:
+            SchoolCalendar.setup_school_days([self])
+            logger.debug(
+                "Instantiating calendar for year {} with {} school days".format(self.school_year, len(self.schooldays)))
+
+    @staticmethod
+    def build_many(years_start, level='primary'):
+        """Construit en un seul appel les calendriers scolaires de plusieurs années.
+
+        :param years_start: les années de début des calendriers scolaires.
+        :param level: Type de calendrier, la valeur par défaut est 'primary'.
+        :return: la liste des calendriers scolaires, dans l'ordre des années fournies.
+        """
+        calendars = [SchoolCalendar(year_start, level, setup_school_days=False) for year_start in years_start]
+        SchoolCalendar.setup_school_days(calendars)
+        return calendars
 
     def get_schooldays(self):
         """Retourne la liste des jours de classe.
@@ -138,28 +293,103 @@ class SchoolCalendar(object):
             SchoolCalendar.weekday_before(self.dt_labour, FRIDAY))  # Friday before Labour Day
         # All days after August 24th to sum up 180 school days done in setup_school_days
 
-    def __setup_school_days(self):
-        self.__setup_holidays()
-        self.__setup_pedagogicals()
-        offdays = self.holidays + self.pedagogicals
-        current_day = SchoolCalendar.workday_before(self.dt_sjb)
-        current_school_day = 10
-        current_school_week = 18 if current_school_day == 10 else 36  # 18 cycle of 10 days or 36 of 5 days
+    @staticmethod
+    def setup_school_days(calendars):
+        """Calcule les jours de classe de plusieurs calendriers au moyen de l'arithmétique des jours ouvrables de
+        NumPy. Les jours de classe sont comptés à rebours à partir du jour ouvrable précédant la Fête nationale, en
+        excluant les jours fériés et pédagogiques; les jours ouvrables restants après le 24 août sont des congés.
+
+        :param calendars: les calendriers scolaires dont les congés et journées pédagogiques sont établis.
+        :return:
+        """
+        if not calendars:
+            return
+        # School years do not overlap: one business day calendar holds the days off of every year
+        offdays = np.array([day for calendar in calendars for day in calendar.holidays + calendar.pedagogicals],
+                           dtype='datetime64[D]')
+        busdaycal = np.busdaycalendar(weekmask=WORKWEEK, holidays=offdays)
+        last_days = np.array([SchoolCalendar.workday_before(calendar.dt_sjb) for calendar in calendars],
+                             dtype='datetime64[D]')
         # Create school days from the end of the semester to the beginning
-        while len(self.schooldays) < 180:
-            if current_day not in offdays:
-                self.schooldays.append(SchoolDay(current_day, current_school_day, current_school_week))
-                # Decrease school name_day
-                current_school_day = current_school_day - 1 if current_school_day > 1 else 10
-                # Decrease school week
-                current_school_week = current_school_week - 1 if current_school_day == 10 else current_school_week
-            current_day = SchoolCalendar.workday_before(current_day)
-        # Complete pedagogical: prepend school days prior to the 24th
-        while current_day > datetime.date(self.year_start, 8, 24):
-            self.holidays.append(current_day)
-            current_day = SchoolCalendar.workday_before(current_day)
-        self.pedagogicals = self.pedagogicals[::-1]
-        self.schooldays = self.schooldays[::-1]
+        countdown = np.arange(SCHOOL_DAYS)
+        schooldays = np.busday_offset(last_days[:, None], -countdown[None, :], roll='backward', busdaycal=busdaycal)
+        schedule_days = (SCHEDULE_DAYS - countdown % SCHEDULE_DAYS)[::-1]
+        schedule_weeks = (SCHOOL_DAYS // SCHEDULE_DAYS - countdown // SCHEDULE_DAYS)[::-1]
+        for (calendar, dates) in zip(calendars, schooldays[:, ::-1]):
+            calendar.set_school_days(dates, schedule_days, schedule_weeks)
+            # Complete pedagogical: prepend school days prior to the 24th
+            first_day = np.busday_offset(dates[0], -1, roll='backward', weekmask=WORKWEEK)
+            leftover = np.arange(np.datetime64(datetime.date(calendar.year_start, 8, 25)), first_day + 1)
+            calendar.holidays.extend(leftover[np.is_busday(leftover, weekmask=WORKWEEK)][::-1].tolist())
+            calendar.pedagogicals = calendar.pedagogicals[::-1]
+
+    def set_school_days(self, dates, schedule_days, schedule_weeks):
+        """Définit les jours de classe du calendrier.
+
+        :param dates: les dates des jours de classe (datetime64[D]).
+        :param schedule_days: le jour de l'horaire de cours de chaque jour de classe.
+        :param schedule_weeks: la semaine de l'horaire de cours de chaque jour de classe.
+        :return:
+        """
+        self.schoolday_dates = dates
+        self.schedule_days = schedule_days
+        self.schedule_weeks = schedule_weeks
+        self.schoolday_ordinals = (dates.astype(np.int32) + ORDINAL_EPOCH).astype(np.int32)
+        self.term_index = [np.arange(start, stop) for (start, stop) in TERM_WINDOWS]
+        self.schedule_index = [np.flatnonzero(schedule_days == day) for day in range(1, SCHEDULE_DAYS + 1)]
+        self.schooldays = [SchoolDay(date, schedule_day_no, schedule_week_no) for
+                           (date, schedule_day_no, schedule_week_no) in
+                           zip(dates.tolist(), schedule_days.tolist(), schedule_weeks.tolist())]
+
+    def get_term_index(self, schedule_days=None):
+        """Retourne les indices des jours de classe de chaque étape d'évaluation, limités au besoin à certains jours
+        du cycle de l'horaire.
+
+        :param schedule_days: les jours du cycle de l'horaire retenus, tous les jours si None.
+        :return: la liste des tableaux triés d'indices des jours de classe, un par étape.
+        """
+        if schedule_days is None:
+            return self.term_index
+        selected = np.zeros(len(self.schoolday_dates), np.bool_)
+        for day in schedule_days:
+            selected[self.schedule_index[day - 1]] = True
+        return [start + np.flatnonzero(selected[start:stop]) for (start, stop) in TERM_WINDOWS]
+
+    def save(self, filepath):
+        """Sauvegarde les jours de classe, congés et journées pédagogiques calculés du calendrier (format .npz).
+
+        :param filepath: le chemin vers le fichier.
+        :return:
+        """
+        # Written aside then replaced, other processes may be reading the previous file
+        filepath = Path(filepath)
+        (fd, tmp_path) = tempfile.mkstemp(prefix=filepath.stem + ".", suffix=".tmp.npz", dir=filepath.parent)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                np.savez(fh, schoolday_dates=self.schoolday_dates, schedule_days=self.schedule_days,
+                         schedule_weeks=self.schedule_weeks, holidays=np.array(self.holidays, dtype='datetime64[D]'),
+                         pedagogicals=np.array(self.pedagogicals, dtype='datetime64[D]'))
+            os.chmod(tmp_path, 0o644)  # mkstemp creates owner-only files
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def load(filepath, year_start, level='primary'):
+        """Charge un calendrier scolaire à partir des jours calculés sauvegardés par save.
+
+        :param filepath: le chemin vers le fichier.
+        :param year_start: Année de début du calendrier scolaire.
+        :param level: Type de calendrier, la valeur par défaut est 'primary'.
+        :return: le calendrier scolaire.
+        """
+        with np.load(filepath, allow_pickle=False) as arrays:
+            calendar = SchoolCalendar(year_start, level, setup_school_days=False)
+            calendar.holidays = arrays["holidays"].tolist()
+            calendar.pedagogicals = arrays["pedagogicals"].tolist()
+            calendar.set_school_days(arrays["schoolday_dates"], arrays["schedule_days"], arrays["schedule_weeks"])
+        return calendar
 
     @staticmethod
     def workday_before(date):
@@ -188,22 +418,11 @@ class SchoolCalendar(object):
         :param offset: le nombre de jours de classe précédant ou suivant la date.
         :return: le nième jour de classe précédant ou suivant la date.
         """
-
-        if date.weekday() > 4:
-            if direction == AFTER:
-                date = date + datetime.timedelta(days=1)
-            else:
-                date = date - datetime.timedelta(days=1)
-            return SchoolCalendar.workday_offset(date, direction, offset)
-        if offset <= 0:
-            # print('Return {}'.format(date))
-            return date
+        if direction == AFTER:
+            day = np.busday_offset(date, max(offset, 0), roll='forward', weekmask=WORKWEEK)
         else:
-            if direction == AFTER:
-                date = date + datetime.timedelta(days=1)
-            else:
-                date = date - datetime.timedelta(days=1)
-            return SchoolCalendar.workday_offset(date, direction, offset - 1)
+            day = np.busday_offset(date, -max(offset, 0), roll='backward', weekmask=WORKWEEK)
+        return day.item()
 
     @staticmethod
     def weekday_before(date, name_day):
@@ -235,16 +454,13 @@ class SchoolCalendar(object):
         :param name_day: le nom du jour de la semaine, prend la valeur 'mo', 'tu', 'we, 'th, 'fr', 'sa', 'su'
         :return: la date du jour précédant ou suivant les conditions
         """
-        days = ['mo', 'tu', 'we', 'th', 'fr', 'sa', 'su']
+        weekmask = ['0'] * 7
+        weekmask[WEEKDAYS.index(name_day[0:2].lower())] = '1'
         if direction == BEFORE:
-            date = date - datetime.timedelta(days=1)
-        else:
-            date = date + datetime.timedelta(days=1)
-
-        if date.weekday() == days.index(name_day[0:2].lower()):
-            return date
+            day = np.busday_offset(date - datetime.timedelta(days=1), 0, roll='backward', weekmask=''.join(weekmask))
         else:
-            return SchoolCalendar.weekday_offset(date, direction, name_day)
+            day = np.busday_offset(date + datetime.timedelta(days=1), 0, roll='forward', weekmask=''.join(weekmask))
+        return day.item()
 
     def describe(self):
         """Retourne la description textuelle de l'état du calendrier scolaire.
@@ -256,10 +472,102 @@ class SchoolCalendar(object):
         return details
 
 
+class CalendarRegistry(object):
+    """Définit le registre des calendriers scolaires partagé par les centres de services scolaires et les
+    simulations d'un processus. Un calendrier ne dépend que de l'année de début et du niveau : il est calculé une
+    seule fois, conservé selon une politique LRU bornée et, au besoin, mis en cache sur disque.
+
+    """
+
+    def __init__(self, maxsize=64, cache_dir=None):
+        """Initialise le registre des calendriers scolaires.
+
+        :param maxsize: le nombre maximal de calendriers conservés en mémoire.
+        :param cache_dir: le répertoire du cache sur disque, aucun cache sur disque si None.
+        """
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.calendars = OrderedDict()
+
+    def __len__(self):
+        return len(self.calendars)
+
+    def clear(self):
+        """Vide le registre en mémoire.
+
+        :return:
+        """
+        self.calendars.clear()
+
+    def get(self, year_start, level='primary'):
+        """Retourne le calendrier scolaire d'une année.
+
+        :param year_start: Année de début du calendrier scolaire.
+        :param level: Type de calendrier, la valeur par défaut est 'primary'.
+        :return: le calendrier scolaire.
+        """
+        return self.get_many([year_start], level)[0]
+
+    def get_many(self, years_start, level='primary'):
+        """Retourne les calendriers scolaires de plusieurs années; les calendriers manquants sont lus du cache sur
+        disque ou construits en un seul appel.
+
+        :param years_start: les années de début des calendriers scolaires.
+        :param level: Type de calendrier, la valeur par défaut est 'primary'.
+        :return: la liste des calendriers scolaires, dans l'ordre des années fournies.
+        """
+        missing = []
+        for year_start in years_start:
+            key = (year_start, level)
+            if key in self.calendars:
+                self.calendars.move_to_end(key)
+            elif year_start not in missing and not self.__load(year_start, level):
+                missing.append(year_start)
+        for calendar in SchoolCalendar.build_many(missing, level):
+            self.__store(calendar)
+            if self.cache_dir:
+                try:
+                    calendar.save(self.__filepath(calendar.year_start, level))
+                except OSError:
+                    logger.warning("Could not cache calendar {} to disk".format(calendar.school_year))
+        calendars = [self.calendars[(year_start, level)] for year_start in years_start]
+        while len(self.calendars) > self.maxsize:
+            self.calendars.popitem(last=False)
+        return calendars
+
+    def __filepath(self, year_start, level):
+        return Path(self.cache_dir).joinpath("calendar-{}-{}.npz".format(level, year_start))
+
+    def __load(self, year_start, level):
+        if not self.cache_dir:
+            return False
+        try:
+            self.__store(SchoolCalendar.load(self.__filepath(year_start, level), year_start, level))
+            return True
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            return False  # missing or unreadable cache, the calendar is rebuilt
+
+    def __store(self, calendar):
+        self.calendars[(calendar.year_start, calendar.level)] = calendar
+
+
+_calendar_registry = CalendarRegistry()
+
+
+def get_calendar_registry():
+    """Retourne le registre des calendriers scolaires du processus. Son cache sur disque (cache_dir) est désactivé
+    par défaut; voir le paramètre calendar_cache du simulateur.
+
+    :return: le registre des calendriers scolaires.
+    """
+    return _calendar_registry
+
+
 class SchoolDay(object):
-    """Définit un jour de classe.
+    """Définit un jour de classe. La date est conservée sous forme de numéro de jour (ordinal).
 
     """
+    __slots__ = ('ordinal', 'schedule_day_no', 'schedule_week_no')
 
     def __init__(self, date, schedule_day_no, schedule_week_no):
         """Initialise la journée de classe
@@ -268,10 +576,18 @@ class SchoolDay(object):
         :param schedule_day_no: le jour de l'horaire de cours
         :param schedule_week_no: le numéro de la semaine du calendrier scolaire
         """
-        self.date = date
+        self.ordinal = date.toordinal()
         self.schedule_day_no = schedule_day_no
         self.schedule_week_no = schedule_week_no
 
+    @property
+    def date(self):
+        """Retourne la date du jour de classe.
+
+        :return: la date au format datetime.date.
+        """
+        return datetime.date.fromordinal(self.ordinal)
+
     def __str__(self):
         return "{} {} {}".format(self.date, self.schedule_day_no, self.schedule_week_no)
 
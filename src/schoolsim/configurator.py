@@ -24,6 +24,7 @@ class Configurator(object):
         self.simulation_start_year = None
         self.simulation_duration = None
         self.css_definition_list = []
+        self.topic_catalog = []
 
     def __str__(self):
         return self
@@ -43,7 +44,7 @@ class Configurator(object):
                 "sim_scenario": self.simulation_scenario,
                 "sim_year_start": self.simulation_start_year,
                 "sim_year_duration": self.simulation_duration,
-                "system_parameters": {"css_list": self.css_definition_list}
+                "system_parameters": {"css_list": self.css_definition_list, "topic_catalog": self.topic_catalog}
             }
         }
         try:
@@ -128,6 +129,15 @@ class Configurator(object):
                                  (5, 1, 9), (5, 2, 5), (5, 3, 2), (5, 4, 2), (5, 5, 2), (5, 6, 2), (5, 7, 1), (5, 8, 2),
                                  (5, 9, 2), (6, 1, 9), (6, 2, 5), (6, 3, 2), (6, 4, 2), (6, 5, 2), (6, 6, 2), (6, 7, 1),
                                  (6, 8, 2), (6, 9, 2)]
+        # Topic definitions are emitted once by (grade, topic id), groups only refer to them
+        self.topic_catalog = []
+        for year_topic_tuple in year_topic_parameters:
+            (topic_grade, topic_id, topic_duration) = year_topic_tuple
+            (topic_id, topic_name, topic_sf, topic_sv) = [topic for topic in topic_parameters if
+                                                          topic[0] == topic_id][0]
+            self.topic_catalog.append(
+                {"id": topic_id, "name": topic_name, "grade": topic_grade, "duration": topic_duration,
+                 "success_factor": topic_sf, "success_variability": topic_sv})
         for css_dict in self.css_definition_list:
             for school_dict in css_dict['school_list']:
                 school_year_parameters = []
@@ -138,16 +148,9 @@ class Configurator(object):
                     for group_tuple in group_parameters:
                         topic_list = []
                         (group_id, group_grade, group_size, group_sf, group_sv) = group_tuple
-                        for year_topic_tuple in year_topic_parameters:
-                            (topic_grade, topic_id, topic_duration) = year_topic_tuple
-                            (topic_id, topic_name, topic_sf, topic_sv) = [topic for topic in topic_parameters if
-                                                                          topic[0] == topic_id][0]
-
+                        for (topic_grade, topic_id, topic_duration) in year_topic_parameters:
                             if group_grade == topic_grade:
-                                topic_list.append(
-                                    {"id": topic_id, "name": topic_name, "grade": topic_grade,
-                                     "duration": topic_duration, "success_factor": topic_sf,
-                                     "success_variability": topic_sv})
+                                topic_list.append({"id": topic_id})
                         group_list.append(
                             {"id": group_id, "grade": group_grade, "size": group_size, "success_factor": group_sf,
                              "success_variability": group_sv, "topic_list": topic_list})
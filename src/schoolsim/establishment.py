@@ -1,7 +1,8 @@
 import datetime
 import logging
+import sys
 
-from .agenda import SchoolCalendar
+from .agenda import get_calendar_registry
 
 LANGUAGE_1ST = 'Langue principale'
 LANGUAGE_1ST_ENGLISH = 'Anglais'
@@ -43,33 +44,129 @@ GROUP_SIZE_DEFAULT = 'group_size_default'
 logger = logging.getLogger(__name__)
 
 
-class Topic(object):
-    """Définit la matière scolaire.
+TOPIC_FIELDS = ('id', 'name', 'grade', 'duration', 'success_factor', 'success_variability')
+
+_topic_templates = {}  # Shared topic templates by definition
+
+
+class TopicTemplate(object):
+    """Définit la définition partagée et immuable d'une matière scolaire pour un niveau. Une seule instance existe
+    par définition dans un processus; les groupes y font référence plutôt que d'en porter une copie.
 
     """
+    __slots__ = TOPIC_FIELDS + ('workload', 'isSpeciality', 'sharesRoom')
 
     def __init__(self, **kwargs):
-        """Initialise la matière scolaire.
+        """Initialise la définition de la matière scolaire.
 
         :param kwargs: les paramètres de définition de la matière scolaire.
         """
-        self.id = kwargs.get("id", "N/A")
-        self.name = kwargs.get("name", "N/A")
-        self.grade = kwargs.get("grade", "N/A")
-        self.duration = kwargs.get("duration", "N/A")
-        self.success_factor = kwargs.get("success_factor", 0)
-        self.success_variability = kwargs.get("success_variability", 0)
-        self.workload = self.duration / 25.0
+        name = sys.intern(kwargs.get("name", "N/A"))
+        duration = kwargs.get("duration", "N/A")
+        values = {"id": kwargs.get("id", "N/A"), "name": name, "grade": kwargs.get("grade", "N/A"),
+                  "duration": duration, "success_factor": kwargs.get("success_factor", 0),
+                  "success_variability": kwargs.get("success_variability", 0), "workload": duration / 25.0,
+                  "isSpeciality": name in [PHYSICAL_EDUCATION, LANGUAGE_2ND_ENGLISH, LANGUAGE_2ND_FRENCH,
+                                           LANGUAGE_ELECTIVE_SPANISH, MUSIC],
+                  "sharesRoom": 1 if name in [PHYSICAL_EDUCATION, MUSIC] else 0}
+        for (field, value) in values.items():
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Topic templates are immutable")
+
+    def __reduce__(self):
+        # Unpickled templates resolve to the shared instance of the receiving process
+        return _topic_template, tuple(getattr(self, field) for field in TOPIC_FIELDS)
+
+    @staticmethod
+    def get(**kwargs):
+        """Retourne la définition partagée d'une matière scolaire, en la créant à la première demande. Les
+        définitions sont partagées selon l'ensemble de leurs paramètres, une définition modifiée en produit une
+        nouvelle.
+
+        :param kwargs: les paramètres de définition de la matière scolaire.
+        :return: la définition partagée de la matière scolaire.
+        """
+        template = TopicTemplate(**kwargs)
+        return _topic_templates.setdefault(tuple(getattr(template, field) for field in TOPIC_FIELDS), template)
+
+
+def _topic_template(*values):
+    return TopicTemplate.get(**dict(zip(TOPIC_FIELDS, values)))
+
+
+class TopicCatalog(object):
+    """Définit le catalogue des matières scolaires d'une simulation : la définition de chaque matière par niveau,
+    à laquelle les groupes font référence par l'identifiant de la matière.
+
+    """
+
+    def __init__(self, topic_catalog=()):
+        """Initialise le catalogue des matières scolaires.
+
+        :param topic_catalog: la liste des paramètres de définition des matières scolaires par niveau.
+        """
+        self.templates = {}
+        for topic_parameters in topic_catalog:
+            template = TopicTemplate.get(**topic_parameters)
+            self.templates[(template.grade, template.id)] = template
+
+    def get(self, **kwargs):
+        """Retourne la définition d'une matière scolaire pour un niveau, ou une définition construite à partir des
+        paramètres fournis si la matière n'est pas au catalogue.
+
+        :param kwargs: les paramètres de définition de la matière scolaire, dont le niveau (grade) et l'identifiant.
+        :return: la définition partagée de la matière scolaire.
+        """
+        template = self.templates.get((kwargs.get("grade", "N/A"), kwargs.get("id", "N/A")))
+        if template is None:
+            template = TopicTemplate.get(**kwargs)
+        return template
+
+
+def _topic_property(field):
+    def getter(self):
+        overrides = self.overrides
+        if overrides and field in overrides:
+            return overrides[field]
+        return getattr(self.template, field)
+    return property(getter, doc="Retourne l'attribut {} de la matière scolaire.".format(field))
+
+
+class Topic(object):
+    """Définit la matière scolaire d'un groupe : une affectation légère (personne enseignante, valeurs propres au
+    groupe) qui fait référence à la définition partagée de la matière pour le niveau.
+
+    """
+    __slots__ = ('template', 'overrides', 'teacher')
+
+    id = _topic_property('id')
+    name = _topic_property('name')
+    grade = _topic_property('grade')
+    duration = _topic_property('duration')
+    success_factor = _topic_property('success_factor')
+    success_variability = _topic_property('success_variability')
+    workload = _topic_property('workload')
+    isSpeciality = _topic_property('isSpeciality')
+    sharesRoom = _topic_property('sharesRoom')
+
+    def __init__(self, catalog=None, **kwargs):
+        """Initialise la matière scolaire. Seuls le niveau et l'identifiant sont requis lorsque la définition de la
+        matière est au catalogue; les autres paramètres fournis qui diffèrent du catalogue sont conservés comme
+        valeurs propres au groupe.
+
+        :param catalog: le catalogue des matières scolaires de la simulation (voir TopicCatalog).
+        :param kwargs: les paramètres de définition de la matière scolaire.
+        """
+        self.template = catalog.get(**kwargs) if catalog is not None else TopicTemplate.get(**kwargs)
+        overrides = {field: value for (field, value) in kwargs.items() if
+                     field in ('duration', 'success_factor', 'success_variability') and
+                     value != getattr(self.template, field)}
+        if 'duration' in overrides:
+            overrides['workload'] = overrides['duration'] / 25.0
+        self.overrides = overrides or None
         self.teacher = None
-        if self.name in [PHYSICAL_EDUCATION, LANGUAGE_2ND_ENGLISH, LANGUAGE_2ND_FRENCH, LANGUAGE_ELECTIVE_SPANISH,
-                         MUSIC]:
-            self.isSpeciality = True
-        else:
-            self.isSpeciality = False
-        if self.name in [PHYSICAL_EDUCATION, MUSIC]:
-            self.sharesRoom = 1
-        else:
-            self.sharesRoom = 0
 
     def __str__(self):
         return self.describe()
@@ -114,6 +211,8 @@ class Group(object):
     """Définit le groupe scolaire.
 
     """
+    __slots__ = ('id', 'grade', 'success_factor', 'success_variability', 'cycle', 'size', 'titulaire', 'students',
+                 'enrolment', 'results', 'topics')
 
     def __init__(self, **kwargs):
         """Initialise le groupe scolaire.
@@ -136,9 +235,10 @@ class Group(object):
         self.titulaire = None
         self.students = []
         self.enrolment = len(self.students)
+        self.results = None  # Index range (start, stop) in the result store
         self.topics = []
         for topics in kwargs.get("topic_list", []):
-            self.topics.append(Topic(**topics))
+            self.topics.append(Topic(kwargs.get("catalog"), **dict({"grade": self.grade}, **topics)))
 
     def __str__(self):
         return self.describe()
@@ -212,7 +312,7 @@ class SchoolYear(object):
         self.school_year = kwargs.get("school_year", None)
         self.groups = []
         for group in kwargs.get("group_list", []):
-            self.groups.append(Group(**group))
+            self.groups.append(Group(**dict(group, catalog=kwargs.get("catalog"))))
         self.schedule = None
 
     def __str__(self):
@@ -225,6 +325,21 @@ class SchoolYear(object):
         """
         return self.groups
 
+    def set_schedule(self, schedule):
+        """Définit l'horaire des cours de l'année scolaire.
+
+        :param schedule: l'horaire des cours.
+        :return:
+        """
+        self.schedule = schedule
+
+    def get_schedule(self):
+        """Retourne l'horaire des cours de l'année scolaire.
+
+        :return: l'horaire des cours, None s'il n'est pas encore construit.
+        """
+        return self.schedule
+
     def describe(self, offset=0):
         """Retourne la description textuelle de l'état de l'année scolaire.
 
@@ -262,7 +377,7 @@ class School(object):
         self.success_variability = kwargs.get("success_variability", 0)
         self.school_years = []
         for school_year_parameters in kwargs.get("school_year_list", []):
-            self.add_schoolyear(**school_year_parameters)
+            self.add_schoolyear(**dict(school_year_parameters, catalog=kwargs.get("catalog")))
 
     def __str__(self):
         return self.describe()
@@ -326,13 +441,11 @@ class Css(object):
         self.success_variability = kwargs.get("success_variability", 0)
         self.calendars = {}
         self.schools = []
-        for idx in range(0, kwargs.get("duration", 1)):
-            start_year = kwargs.get("start_year", datetime.date.today().year) + idx
-            end_year = start_year + 1
-            school_year = "{}-{}".format(start_year, end_year)
-            self.add_calendar(school_year)
+        start_year = kwargs.get("start_year", datetime.date.today().year)
+        for calendar in get_calendar_registry().get_many(range(start_year, start_year + kwargs.get("duration", 1))):
+            self.calendars[calendar.school_year] = calendar
         for school_parameters in kwargs.get("school_list", []):
-            self.add_school(**school_parameters)
+            self.add_school(**dict(school_parameters, catalog=kwargs.get("catalog")))
 
     def __str__(self):
         return self.describe()
@@ -358,7 +471,7 @@ class Css(object):
         :param school_year: les paramètres du calendrier scolaire.
         :return:
         """
-        self.calendars[school_year] = SchoolCalendar(int(school_year[0:4]))
+        self.calendars[school_year] = get_calendar_registry().get(int(school_year[0:4]))
 
     def get_school(self, school_id):
         """Retourne l'école à partir de son identifiant unique.
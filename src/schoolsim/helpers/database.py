@@ -1,172 +1,624 @@
+import datetime
+import itertools
+import numpy as np
+import queue
 import sqlite3
+import threading
 import time
 import traceback
 
+from pathlib import Path
 from sqlalchemy import create_engine
 import logging
 
-from . sqlscripters import SqliteScripter
+from . sqlscripters import SqliteScripter, SCHEMA_COMPACT, SCHEMA_STANDARD
+from .. results import ResultBatch
 
 logger = logging.getLogger(__name__)
 
+LOAD_DEFAULT = 'default'  # Commit after each statement with the default journal and synchronization
+LOAD_BULK = 'bulk'  # Single transaction, in-memory journal and no synchronization
+LOAD_MEMORY = 'memory'  # Bulk load of an in-memory database copied to the file once complete
+
+QUEUE_SIZE = 2  # Batches waiting to be written while the next one is simulated
+SHARD_KEY_SPAN = 1 << 32  # Surrogate keys reserved for each shard of a sharded database
+
+
 class DatabaseWriter(object):
     """Définit l'interface de génération de la base de données décisionnelle issue du système scolaire.
 
     """
 
-    def __init__(self, db_filepath, system, model_type='olap'):
+    def __init__(self, db_filepath, system, model_type='olap', results=None, load_mode=LOAD_DEFAULT,
+                 schema=SCHEMA_STANDARD, create_indexes=True, batches=None, release_results=False,
+                 key_offset=0, registry=None, append=False):
         """Initialise l'interface de génération de la base de données décisionnelle issue du système scolaire.
 
         :param db_filepath: le chemin vers la base de données sqlite.
         :param system: le système scolaire.
         :param model_type: le type de modèle de données, seul olap est pris en charge présentement.
+        :param results: le registre columnaire des résultats d'évaluation du moteur de simulation.
+        :param load_mode: le mode de chargement, LOAD_DEFAULT, LOAD_BULK (une seule transaction, sans synchronisation
+            du disque) ou LOAD_MEMORY (chargement en mémoire puis copie vers le fichier).
+        :param schema: la variante du schéma, SCHEMA_STANDARD ou SCHEMA_COMPACT, voir SqliteScripter.
+        :param create_indexes: vrai pour créer les index des requêtes des tableaux de bord après le chargement.
+        :param batches: un itérateur de lots de résultats (voir SimulatorEngine.iter_batches) à écrire au fil de l'eau,
+            les lots du système scolaire et du registre des résultats si None.
+        :param release_results: vrai pour libérer les résultats de chaque lot une fois écrit.
+        :param key_offset: le décalage des clés de substitution, distinct pour chaque fragment d'une base de données
+            répartie (voir ShardCatalog).
+        :param registry: les registres de la simulation, pour sauvegarder leur état avec les lots du système scolaire.
+        :param append: vrai pour ajouter les lots à une base de données existante : les clés des dimensions y sont
+            lues, les nouvelles lignes des dimensions et les faits sont ajoutés dans une seule transaction, annulée si
+            l'écriture échoue. Le schéma de la base de données existante est conservé.
         """
         logger.debug("Database, writing to database {}".format(db_filepath))
+        self.load_mode = load_mode
+        self.schema = schema
+        self.create_indexes = create_indexes
+        self.release_results = release_results
+        self.key_offset = key_offset
+        self.append = append
+        if append:
+            existing_schema = DatabaseWriter.read_schema(db_filepath)
+            if existing_schema != schema:
+                logger.warning("Database, appending with the {} schema of the existing database".format(
+                    existing_schema))
+                self.schema = existing_schema
+        if batches is None:
+            batches = ResultBatch.iter_system(system, results, registry)
         if model_type == 'olap':
-            self.__save_to_olap(db_filepath, system)
+            self.__save_to_olap(db_filepath, batches)
         else:
             raise NotImplementedError
 
-    def __save_to_olap(self, db, system):
+    def __save_to_olap(self, db, batches):
         logger.debug("Saving simulation data to database")
         start_time = time.time()
 
         # Create database
-        scripter = SqliteScripter()
-        cxn = sqlite3.connect(db)
+        scripter = SqliteScripter(self.schema)
+        cxn = self.__connect(db, scripter)
 
         # Create tables
-        for key in sorted(scripter.ddl.keys()):
-            for stmt in scripter.ddl[key].split(";"):
-                cxn.execute(stmt)
-                cxn.commit()
+        if not self.append:
+            for key in sorted(scripter.ddl.keys()):
+                for stmt in scripter.ddl[key].split(";"):
+                    cxn.execute(stmt)
+                    self.__commit(cxn)
+        for key in sorted(scripter.ddl_state.keys()):
+            cxn.execute(scripter.ddl_state[key])
+        self.__commit(cxn)
 
         # Fill database
         # Hierarchy css -> school -> school year -> group
         # -> topics -> teachers
         # -> students -> results
-        for css in system.get_csss():
-            logger.debug("Database, processing css {}".format(css.id))
-            css_id = css.id
-            css_name = css.name
-            for calendar in css.get_calendars():
-                try:
-                    logger.debug("Database, processing calendar dates")
-                    values_date = []
-                    for school_day in calendar.get_schooldays():
-                        school_date = school_day.get_date()
-                        values_date.append(
-                            (school_date, school_date.year, school_date.month,
-                             school_date.day, school_date.weekday(), calendar.school_year,
-                             school_day.get_school_day(), school_day.get_school_week()))
-                    cursor = cxn.cursor()
-                    stmt = scripter.dml["insert_dates"]
-                    cursor.executemany(stmt, values_date)
-                    cxn.commit()
-                except:
-                    logger.error("Database, could not insert dates")
-                finally:
-                    cursor.close()
-                    logger.debug("Database, inserted {} calendar dates to database".format(len(values_date)))
-
-            for school in css.get_schools():
-                logger.debug("Database, processing school {}".format(school.id))
-                school_id = school.id
-                school_name = school.name
-                school_milieu = school.milieu
-                for school_year in school.get_schoolyears():
-                    logger.debug("Database, processing school year {}".format(school_year.school_year))
-                    school_year_name = school_year.school_year
-                    try:
-                        logger.debug("Database, processing groups")
-                        values_groups = []
-                        for group in school_year.get_groups():
-                            values_groups.append((group.id, css_id, css_name, school_id, school_name, school_milieu,
-                                                  school_year_name, group.grade, group.size, group.enrolment))
-                        cursor = cxn.cursor()
-                        stmt = scripter.dml["insert_groups"]
-                        cursor.executemany(stmt, values_groups)
-                        cxn.commit()
-                    except:
-                        logger.error("Database, could not insert groups")
-                    finally:
-                        cursor.close()
-                        logger.debug("Database, inserted {} groups to database".format(len(values_groups)))
-
-                    for group in school_year.get_groups():
-                        try:
-                            logger.debug("Database, processing topics and teachers")
-                            values_teachers = []
-                            values_topics = []
-                            for topic in group.get_topics():
-                                teacher = topic.get_staff()
-                                try:
-                                    values_teachers.append((teacher.uid, teacher.uid + "@css.qc.ca", teacher.firstname,
-                                                            teacher.lastname, teacher.dob, teacher.gender))
-                                    values_topics.append((topic.id, topic.name, topic.isSpeciality))
-                                except:
-                                    logger.error("Database, could not insert teacher or topic to list")
-                            cursor = cxn.cursor()
-                            stmt = scripter.dml["insert_teachers"]
-                            cursor.executemany(stmt, values_teachers)
-                            cxn.commit()
-                            logger.debug("Database, inserted {} teachers to database".format(len(values_teachers)))
-                            stmt = scripter.dml["insert_topics"]
-                            cursor.executemany(stmt, values_topics)
-                            cxn.commit()
-                            logger.debug("Database, inserted {} topics to database".format(len(values_topics)))
-                        except:
-                            logger.error("Database, could not insert teacher or topic to database")
-                        finally:
-                            cursor.close()
-
-                        try:
-                            logger.debug("Database, processing students and results")
-                            values_students = []
-                            values_results = []
-                            for student in group.get_students():
-                                try:
-                                    values_students.append(
-                                        (student.uid, student.uid + "@css.qc.ca", student.firstname, student.lastname,
-                                         student.dob, student.gender, student.status))
-                                    context = (css_id, school_id, school_year.school_year, group.id, student.uid)
-                                    for result in student.results:
-                                        # (topic_id, evaluation_id, evaluation_type, evaluation_date, evaluation_score,
-                                        #  evaluation_total, evaluation_pct, evaluation_weight, evaluation_duration,
-                                        #  evaluation_is_retake) = result
-                                        values_results.append(context + result)
-                                except:
-                                    logger.error("Database, could not insert student in list")
-                            cursor = cxn.cursor()
-                            stmt = scripter.dml["insert_students"]
-                            cursor.executemany(stmt, values_students)
-                            cxn.commit()
-                            stmt = scripter.dml["insert_s_results"]
-                            cursor.executemany(stmt, values_results)
-                            cxn.commit()
-                        except:
-                            traceback.print_exc()
-                            logger.error("Database, could not insert students or results in database")
-                        finally:
-                            cursor.close()
-                            logger.debug("Database, inserted {} student to database".format(len(values_students)))
-                            logger.debug("Database, inserted {} results to database".format(len(values_results)))
+        # Surrogate keys are assigned here so that facts are written directly, without a staging table
+        # Batches are written one (school, school year) at a time and can be released once committed
+        keys = DimensionKeys(self.key_offset)
+        loaded = False
         try:
-            cursor = cxn.cursor()
-            stmt = scripter.dml["insert_into_d_evaluations"]
-            cursor.execute(stmt)
-            cxn.commit()
-            stmt = scripter.dml["insert_into_f_results"]
-            cursor.execute(stmt)
+            if self.append:
+                self.__load_keys(cxn, scripter, keys)
+            for batch in batches:
+                logger.debug("Database, processing css {}, school {}".format(batch.css.id, batch.school.id))
+                self.__insert_dates(cxn, scripter, keys, batch.get_calendar())
+                if self.__insert_batch(cxn, scripter, keys, batch):
+                    self.__insert_state(cxn, scripter, batch)  # Only the state of school years with their facts
+                if self.release_results:
+                    batch.release()
+            if self.create_indexes:
+                self.__index(cxn, scripter)
+            loaded = True
+        finally:
+            if self.append and not loaded:
+                # The existing database is left unchanged so that the append can be retried
+                logger.error("Database, append rolled back")
+                cxn.rollback()
+                cxn.close()
+            else:
+                self.__close(cxn, db)
+
+        logger.info("SchoolSim database created in {} sec.".format(time.time() - start_time))
+
+    @staticmethod
+    def read_schema(db_filepath):
+        """Retourne la variante du schéma d'une base de données décisionnelle existante.
+
+        :param db_filepath: le chemin vers la base de données sqlite.
+        :return: SCHEMA_STANDARD ou SCHEMA_COMPACT.
+        """
+        cxn = sqlite3.connect(db_filepath)
+        try:
+            columns = [row[1] for row in cxn.execute("PRAGMA table_info(f_results)")]
+        finally:
+            cxn.close()
+        if not columns:
+            raise ValueError("Database {} has no fact table to append to".format(db_filepath))
+        return SCHEMA_COMPACT if "school_year" in columns else SCHEMA_STANDARD
+
+    def __index(self, cxn, scripter):
+        # Indexes are built once the data is loaded, then the planner statistics are gathered
+        start_time = time.time()
+        try:
+            for key in sorted(scripter.indexes.keys()):
+                for stmt in scripter.indexes[key].split(";"):
+                    cxn.execute(stmt)
+            cxn.execute("ANALYZE")
+            self.__commit(cxn)
+            logger.debug("Database, indexes created in {} sec.".format(time.time() - start_time))
+        except:
+            traceback.print_exc()
+            logger.error("Database, could not create indexes")
+
+    @staticmethod
+    def __load_keys(cxn, scripter, keys):
+        # Surrogate keys already in the database, by the natural keys used while loading
+        dql = scripter.dql_state
+        keys.load("dates", ((datetime.date.fromisoformat(date).toordinal(), surrogate)
+                            for (date, surrogate) in cxn.execute(dql["select_dates"])))
+        keys.school_years.update(row[0] for row in cxn.execute(dql["select_school_years"]))
+        keys.load("evaluations", (((evaluation_type, duration, bool(is_retake)), surrogate)
+                                  for (evaluation_type, duration, is_retake, surrogate) in
+                                  cxn.execute(dql["select_evaluations"])))
+        keys.load("groups", ((row[0:4], row[4]) for row in cxn.execute(dql["select_groups"])))
+        for dimension in ("students", "teachers", "topics"):
+            keys.load(dimension, cxn.execute(dql["select_" + dimension]))
+        logger.debug("Database, loaded keys of {} students and {} school years".format(
+            len(keys.keys.get("students", {})), len(keys.school_years)))
+
+    def __insert_state(self, cxn, scripter, batch):
+        if not batch.state:
+            return
+        try:
+            cxn.executemany(scripter.dml_state["insert_pools"], batch.state["pools"])
+            cxn.executemany(scripter.dml_state["insert_staff"], batch.state["staff"])
+            cxn.executemany(scripter.dml_state["insert_students"], batch.state["students"])
+            self.__commit(cxn)
+        except:
+            traceback.print_exc()
+            logger.error("Database, could not insert registry state")
+            if self.append:
+                raise
+
+    def __insert_dates(self, cxn, scripter, keys, calendar):
+        if calendar.school_year in keys.school_years:
+            return  # calendars are shared between css, insert their dates once
+        keys.school_years.add(calendar.school_year)
+        logger.debug("Database, processing calendar dates")
+        values_date = []
+        for (ordinal, school_day) in zip(calendar.schoolday_ordinals.tolist(), calendar.get_schooldays()):
+            school_date = school_day.get_date()
+            date_key = None
+            if scripter.schema == SCHEMA_COMPACT:
+                date_key = school_date.year * 10000 + school_date.month * 100 + school_date.day  # YYYYMMDD
+            values_date.append(
+                (keys.add("dates", ordinal, date_key)[0], school_date, school_date.year, school_date.month, school_date.day,
+                 school_date.weekday(), calendar.school_year, school_day.get_school_day(),
+                 school_day.get_school_week()))
+        try:
+            cxn.executemany(scripter.dml["insert_dates"], values_date)
+            self.__commit(cxn)
+            logger.debug("Database, inserted {} calendar dates to database".format(len(values_date)))
+        except:
+            logger.error("Database, could not insert dates")
+            if self.append:
+                raise
+
+    def __insert_batch(self, cxn, scripter, keys, batch):
+        logger.debug("Database, processing school year {}".format(batch.school_year.school_year))
+        try:
+            values_groups = keys.add_rows("groups", batch.get_group_rows(), lambda row: (row[1], row[3], row[6], row[0]))
+            cxn.executemany(scripter.dml["insert_groups"], values_groups)
+            values_teachers = keys.add_rows("teachers", batch.get_teacher_rows(), lambda row: row[0])
+            cxn.executemany(scripter.dml["insert_teachers"], values_teachers)
+            values_topics = keys.add_rows("topics", batch.get_topic_rows(), lambda row: row[0])
+            cxn.executemany(scripter.dml["insert_topics"], values_topics)
+            values_students = keys.add_rows("students", batch.get_student_rows(), lambda row: row[0])
+            cxn.executemany(scripter.dml["insert_students"], values_students)
+            self.__commit(cxn)
+            logger.debug("Database, inserted {} groups, {} teachers, {} topics and {} students to database".format(
+                len(values_groups), len(values_teachers), len(values_topics), len(values_students)))
+        except:
+            traceback.print_exc()
+            logger.error("Database, could not insert groups, teachers, topics or students in database")
+            if self.append:
+                raise
+            return False
+
+        results = batch.results
+        values_results = 0
+        try:
+            for group in batch.school_year.get_groups():
+                if not group.results:
+                    continue
+                (start, stop) = group.results
+                if scripter.schema == SCHEMA_COMPACT:
+                    self.__insert_compact_results(cxn, scripter, keys, batch, group)
+                    values_results += stop - start
+                    continue
+                fk_evaluations = self.__evaluation_keys(cxn, scripter, keys, results, start, stop)
+                fk_group = keys.get("groups", (batch.css.id, batch.school.id, batch.school_year.school_year, group.id))
+                fk_dates = keys.map("dates", results.column("evaluation_date", start, stop))
+                fk_topics = keys.map("topics", results.column("topic_id", start, stop))
+                fk_students = keys.map("students", results.column("student", start, stop), results.students)
+                fk_teachers = keys.map("teachers", results.column("teacher", start, stop), results.teachers)
+                cxn.executemany(scripter.dml["insert_results"],
+                                zip(fk_dates.tolist(), fk_evaluations.tolist(), itertools.repeat(fk_group),
+                                    fk_students.tolist(), fk_teachers.tolist(), fk_topics.tolist(),
+                                    results.column("evaluation_score", start, stop).tolist(),
+                                    results.column("evaluation_total", start, stop).tolist(),
+                                    results.column("evaluation_pct", start, stop).tolist(),
+                                    results.column("evaluation_weight", start, stop).tolist()))
+                values_results += stop - start
+            self.__commit(cxn)
+        except:
+            traceback.print_exc()
+            logger.error("Database, could not insert results in database")
+            if self.append:
+                raise
+            return False
+        finally:
+            logger.debug("Database, inserted {} results to database".format(values_results))
+        return True
+
+    def __insert_compact_results(self, cxn, scripter, keys, batch, group):
+        results = batch.results
+        (start, stop) = group.results
+        # Rows are written in the clustering order of the fact table: topic, student, evaluation
+        order = np.lexsort((results.column("evaluation_id", start, stop), results.column("student", start, stop),
+                            results.column("topic_id", start, stop)))
+        fk_evaluations = self.__evaluation_keys(cxn, scripter, keys, results, start, stop)[order]
+        fk_group = keys.get("groups", (batch.css.id, batch.school.id, batch.school_year.school_year, group.id))
+        cxn.executemany(scripter.dml["insert_results"],
+                        zip(itertools.repeat(int(batch.school_year.school_year[0:4])), itertools.repeat(fk_group),
+                            keys.map("topics", results.column("topic_id", start, stop))[order].tolist(),
+                            keys.map("students", results.column("student", start, stop),
+                                     results.students)[order].tolist(),
+                            results.column("evaluation_id", start, stop)[order].tolist(),
+                            keys.map("dates", results.column("evaluation_date", start, stop))[order].tolist(),
+                            fk_evaluations.tolist(),
+                            keys.map("teachers", results.column("teacher", start, stop),
+                                     results.teachers)[order].tolist(),
+                            results.column("evaluation_score", start, stop)[order].tolist(),
+                            results.column("evaluation_total", start, stop)[order].tolist(),
+                            results.column("evaluation_pct", start, stop)[order].tolist(),
+                            results.column("evaluation_weight", start, stop)[order].tolist()))
+
+    @staticmethod
+    def __evaluation_keys(cxn, scripter, keys, results, start, stop):
+        # (type, duration, retake) combined in a single integer to find the distinct evaluations of the slice
+        combined = (results.column("evaluation_type", start, stop).astype(np.int64) << 32) | \
+                   (results.column("evaluation_duration", start, stop).astype(np.int64) << 1) | \
+                   results.column("evaluation_is_retake", start, stop)
+        (distinct, inverse) = np.unique(combined, return_inverse=True)
+        values_evaluations = []
+        surrogates = []
+        for value in distinct.tolist():
+            evaluation = (results.evaluation_types.values[value >> 32], (value & 0xFFFFFFFF) >> 1, bool(value & 1))
+            (surrogate, is_new) = keys.add("evaluations", evaluation)
+            if is_new:
+                values_evaluations.append((surrogate,) + evaluation)
+            surrogates.append(surrogate)
+        cxn.executemany(scripter.dml["insert_evaluations"], values_evaluations)
+        return np.asarray(surrogates, dtype=np.int64)[inverse]
+
+    def __connect(self, db, scripter):
+        if self.append:
+            # The existing file is updated in a single transaction, with its rollback journal
+            cxn = sqlite3.connect(db)
+            cxn.execute("BEGIN")
+            return cxn
+        if self.load_mode == LOAD_DEFAULT:
+            return sqlite3.connect(db)
+        cxn = sqlite3.connect(":memory:" if self.load_mode == LOAD_MEMORY else db)
+        for stmt in scripter.pragmas["bulk"]:
+            cxn.execute(stmt)
+        cxn.execute("BEGIN")  # Tables and data are loaded in a single transaction
+        return cxn
+
+    def __commit(self, cxn):
+        if self.load_mode == LOAD_DEFAULT and not self.append:
             cxn.commit()
-            stmt = scripter.dml["drop_s_results"]  # drop staging table
-            cursor.execute(stmt)
+
+    def __close(self, cxn, db):
+        cxn.commit()
+        if self.load_mode == LOAD_MEMORY and not self.append:
+            logger.debug("Database, copying in-memory database to {}".format(db))
+            target = sqlite3.connect(db)
+            try:
+                cxn.backup(target)
+            finally:
+                target.close()
+        cxn.close()
+
+
+class DimensionKeys(object):
+    """Définit les clés de substitution des dimensions de la base de données décisionnelle, attribuées en mémoire à
+    partir des clés naturelles (ex. identifiant de l'élève, ordinal de la date) lors du chargement.
+
+    """
+
+    def __init__(self, offset=0):
+        """Initialise les dictionnaires vides des clés de substitution.
+
+        :param offset: le décalage des clés de substitution attribuées, 0 pour une base de données non répartie.
+        """
+        self.offset = offset
+        self.last = {}  # Last surrogate key attributed or loaded, by dimension
+        self.keys = {}  # Surrogate keys by natural key, by dimension
+        self.school_years = set()  # School years of the calendars already loaded
+
+    def add(self, dimension, natural_key, surrogate=None):
+        """Retourne la clé de substitution d'une clé naturelle, en l'attribuant au besoin.
+
+        :param dimension: le nom de la dimension.
+        :param natural_key: la clé naturelle.
+        :param surrogate: la clé de substitution à attribuer, la suivante de la dimension si None.
+        :return: la clé de substitution et vrai si elle vient d'être attribuée.
+        """
+        keys = self.keys.setdefault(dimension, {})
+        if natural_key in keys:
+            return keys[natural_key], False
+        if surrogate is None:
+            surrogate = self.last.get(dimension, self.offset) + 1
+            self.last[dimension] = surrogate
+        keys[natural_key] = surrogate
+        return surrogate, True
+
+    def add_rows(self, dimension, rows, natural_key):
+        """Attribue les clés de substitution des lignes d'une dimension.
+
+        :param dimension: le nom de la dimension.
+        :param rows: les lignes de la dimension.
+        :param natural_key: la fonction qui retourne la clé naturelle d'une ligne.
+        :return: les nouvelles lignes, précédées de leur clé de substitution.
+        """
+        values = []
+        for row in rows:
+            (surrogate, is_new) = self.add(dimension, natural_key(row))
+            if is_new:
+                values.append((surrogate,) + row)
+        return values
+
+    def load(self, dimension, items):
+        """Charge les clés de substitution déjà attribuées d'une dimension (ex. lues dans une base de données
+        existante).
+
+        :param dimension: le nom de la dimension.
+        :param items: les paires (clé naturelle, clé de substitution).
+        :return:
+        """
+        keys = self.keys.setdefault(dimension, {})
+        keys.update(items)
+        self.last[dimension] = max(keys.values(), default=self.offset)
+
+    def get(self, dimension, natural_key):
+        """Retourne la clé de substitution d'une clé naturelle déjà attribuée.
+
+        :param dimension: le nom de la dimension.
+        :param natural_key: la clé naturelle.
+        :return: la clé de substitution.
+        """
+        return self.keys[dimension][natural_key]
+
+    def map(self, dimension, natural_keys, codebook=None):
+        """Retourne les clés de substitution d'un tableau de clés naturelles déjà attribuées.
+
+        :param dimension: le nom de la dimension.
+        :param natural_keys: le tableau des clés naturelles, ou de leurs codes si un dictionnaire de codes est fourni.
+        :param codebook: le dictionnaire de codes du registre des résultats, None si les clés ne sont pas codées.
+        :return: le tableau des clés de substitution.
+        """
+        (distinct, inverse) = np.unique(natural_keys, return_inverse=True)
+        distinct = distinct.tolist() if codebook is None else codebook.decode_all(distinct.tolist())
+        keys = self.keys[dimension]
+        return np.fromiter((keys[key] for key in distinct), np.int64, len(distinct))[inverse]
+
+
+class RegistryState(object):
+    """Définit l'état des registres de la simulation lu dans une base de données décisionnelle existante : l'état de
+    la dernière année scolaire sauvegardée de chaque école et les années scolaires déjà présentes.
+
+    """
+
+    def __init__(self, pools=(), staff=(), students=(), simulated=()):
+        """Initialise l'état des registres.
+
+        :param pools: les lignes d'état des bassins.
+        :param staff: les lignes des affectations du personnel.
+        :param students: les lignes des élèves inscrits.
+        :param simulated: les années scolaires déjà simulées, par (centre de services scolaires, école, année).
+        """
+        self.pools = list(pools)
+        self.staff = list(staff)
+        self.students = list(students)
+        self.simulated = set(simulated)
+
+    def is_simulated(self, css_id, school_id, school_year):
+        """Indique si l'année scolaire d'une école est déjà dans la base de données.
+
+        :param css_id: l'identifiant unique du centre de services scolaires.
+        :param school_id: l'identifiant unique de l'école.
+        :param school_year: l'année scolaire.
+        :return: vrai si l'année scolaire est déjà simulée.
+        """
+        return (css_id, school_id, school_year) in self.simulated
+
+    @staticmethod
+    def read(db_filepath):
+        """Lit l'état des registres dans une base de données décisionnelle. L'état de la dernière année scolaire de
+        chaque école doit y être sauvegardé.
+
+        :param db_filepath: le chemin vers la base de données sqlite.
+        :return: l'état des registres.
+        """
+        dql = SqliteScripter.dql_state
+        cxn = sqlite3.connect(db_filepath)
+        try:
+            state = RegistryState(cxn.execute(dql["select_pools"]), cxn.execute(dql["select_staff"]),
+                                  cxn.execute(dql["select_students_state"]), cxn.execute(dql["select_simulated"]))
+        except sqlite3.OperationalError:
+            raise ValueError("Database {} has no registry state to append to".format(db_filepath))
+        finally:
+            cxn.close()
+        latest = {}
+        for (css_id, school_id, school_year) in state.simulated:
+            latest[(css_id, school_id)] = max(school_year, latest.get((css_id, school_id), school_year))
+        saved = {(css_id, school_id): school_year for (css_id, school_id, school_year, *pool) in state.pools}
+        missing = [key for (key, school_year) in latest.items() if saved.get(key) != school_year]
+        if missing:
+            raise ValueError("Database {} has no registry state for the last school year of {} schools".format(
+                db_filepath, len(missing)))
+        logger.debug("Database, read registry state of {} school years".format(len(state.simulated)))
+        return state
+
+
+class BatchQueue(object):
+    """Définit la file bornée des lots de résultats entre la simulation (producteur) et un fil d'exécution dédié à
+    l'écriture de la base de données (consommateur). La simulation du lot suivant se poursuit pendant l'écriture
+    du lot courant et est suspendue lorsque la file est pleine, de sorte que la mémoire requise reste bornée.
+
+    """
+    __closed = object()  # End of stream marker
+
+    def __init__(self, maxsize=QUEUE_SIZE):
+        """Initialise la file des lots de résultats.
+
+        :param maxsize: le nombre maximal de lots en attente d'écriture.
+        """
+        self.queue = queue.Queue(maxsize)
+        self.stopped = threading.Event()  # Set when the consumer no longer reads the queue
+        self.thread = None
+
+    def start(self, consumer):
+        """Démarre le fil d'exécution du consommateur.
+
+        :param consumer: la fonction recevant l'itérateur des lots de la file (ex. création d'un DatabaseWriter).
+        :return:
+        """
+        def run():
+            try:
+                consumer(iter(self))
+            except:
+                traceback.print_exc()
+                logger.error("Database, writer thread stopped")
+            finally:
+                self.stopped.set()
+
+        self.thread = threading.Thread(target=run, name="schoolsim-writer", daemon=True)
+        self.thread.start()
+
+    def put(self, batch):
+        """Ajoute un lot de résultats à la file, en attendant qu'une place se libère.
+
+        :param batch: le lot de résultats.
+        :return:
+        """
+        while True:
+            if self.stopped.is_set():
+                raise RuntimeError("Database writer stopped before the end of the simulation")
+            try:
+                self.queue.put(batch, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def close(self):
+        """Signale la fin des lots au consommateur et attend la fin de l'écriture.
+
+        :return:
+        """
+        if not self.stopped.is_set():
+            self.put(BatchQueue.__closed)
+        self.thread.join()
+
+    def __iter__(self):
+        while True:
+            batch = self.queue.get()
+            if batch is BatchQueue.__closed:
+                return
+            yield batch
+
+
+class ShardCatalog(object):
+    """Définit le catalogue d'une base de données décisionnelle répartie en fragments, un fichier sqlite par groupe
+    d'écoles écrit par son propre processus. Le catalogue liste les fragments et leurs écoles; une connexion au
+    catalogue attache les fragments et expose des vues temporaires UNION ALL portant le nom des tables d'une base
+    de données non répartie (f_results, d_*), de sorte que les requêtes des tableaux de bord restent inchangées.
+    Les vues n'existent que dans la connexion retournée par connect(), que les tableaux de bord obtiennent lorsque
+    leur base de données contient la table c_shards. Les clés de substitution de chaque fragment sont décalées de
+    SHARD_KEY_SPAN pour rester uniques.
+
+    """
+
+    def __init__(self, catalog_filepath):
+        """Initialise le catalogue.
+
+        :param catalog_filepath: le chemin vers la base de données du catalogue.
+        """
+        self.filepath = Path(catalog_filepath)
+
+    def get_shard_filepath(self, shard):
+        """Retourne le chemin vers le fichier d'un fragment, à côté du catalogue.
+
+        :param shard: le numéro du fragment.
+        :return: le chemin vers le fichier du fragment.
+        """
+        return self.filepath.with_name("{}-shard{:03d}{}".format(self.filepath.stem, shard, self.filepath.suffix))
+
+    @staticmethod
+    def get_key_offset(shard):
+        """Retourne le décalage des clés de substitution d'un fragment.
+
+        :param shard: le numéro du fragment.
+        :return: le décalage des clés de substitution.
+        """
+        return shard * SHARD_KEY_SPAN
+
+    def create(self, shards):
+        """Crée la base de données du catalogue à partir des fragments écrits.
+
+        :param shards: les identifiants (centre de services scolaires, école) des écoles de chaque fragment, par
+            numéro de fragment.
+        :return:
+        """
+        cxn = sqlite3.connect(self.filepath)
+        try:
+            cxn.execute("DROP TABLE IF EXISTS c_shards")
+            cxn.execute("CREATE TABLE c_shards (shard INTEGER, filename TEXT, key_offset INTEGER, css_id INTEGER, "
+                        "school_id INTEGER, PRIMARY KEY (shard, css_id, school_id))")
+            cxn.executemany("INSERT INTO c_shards VALUES (?, ?, ?, ?, ?)",
+                            [(shard, self.get_shard_filepath(shard).name, self.get_key_offset(shard), css_id,
+                              school_id)
+                             for (shard, schools) in sorted(shards.items()) for (css_id, school_id) in schools])
             cxn.commit()
-            cursor.close()
-        except:
-            logger.error("Could not load d_evaluations")
+            logger.debug("Database, catalog {} created with {} shards".format(self.filepath, len(shards)))
         finally:
-            cursor.close()
             cxn.close()
 
-        logger.info("SchoolSim database created in {} sec.".format(time.time() - start_time))
+    def connect(self):
+        """Retourne une connexion au catalogue, les fragments attachés et les vues temporaires créées.
+
+        :return: la connexion au catalogue.
+        """
+        cxn = sqlite3.connect(self.filepath)
+        filenames = [row[0] for row in
+                     cxn.execute("SELECT DISTINCT filename FROM c_shards ORDER BY shard").fetchall()]
+        limit = cxn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        if not filenames or len(filenames) > limit:
+            cxn.close()
+            raise ValueError("Catalog has {} shards, sqlite can attach 1 to {} databases".format(len(filenames), limit))
+        aliases = []
+        for (idx, filename) in enumerate(filenames):
+            aliases.append("shard{}".format(idx))
+            cxn.execute("ATTACH DATABASE ? AS {}".format(aliases[-1]), (str(self.filepath.with_name(filename)),))
+        tables = [row[0] for row in cxn.execute(
+            "SELECT name FROM {}.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite%'".format(aliases[0]))]
+        for table in tables:
+            # Dates are shared by the shards and keep their natural key in the compact schema, hence UNION
+            union = " UNION " if table == "d_dates" else " UNION ALL "
+            cxn.execute("CREATE TEMP VIEW {} AS {}".format(
+                table, union.join("SELECT * FROM {}.{}".format(alias, table) for alias in aliases)))
+        return cxn
@@ -4,17 +4,27 @@ FORMATTER = '%(asctime)s - %(levelname)s - %(message)s'
 logging.basicConfig(format=FORMATTER, level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SCHEMA_STANDARD = 'standard'
+SCHEMA_COMPACT = 'compact'
+
 
 class SqliteScripter(object):
     """Définit les scripts SQL pour sqlite.
 
     """
 
-    def __init__(self):
+    def __init__(self, schema=SCHEMA_STANDARD):
         """Initialise la classe.
 
+        :param schema: la variante du schéma, SCHEMA_STANDARD ou SCHEMA_COMPACT (clés de dates AAAAMMJJ, colonnes
+            entières et réelles, table de faits WITHOUT ROWID).
         """
         logger.info("Database, instantiating sqlite scripter")
+        self.schema = schema
+        if schema == SCHEMA_COMPACT:
+            self.ddl = SqliteScripter.ddl_compact
+            self.dml = SqliteScripter.dml_compact
+            self.indexes = SqliteScripter.indexes_compact
 
     ddl = {
         "d_dates": '''CREATE TABLE d_dates
@@ -120,69 +130,266 @@ class SqliteScripter(object):
                             evaluation_pct     DOUBLE  NOT NULL,
                             evaluation_weight  DOUBLE NOT NULL,
                             comments       TEXT
+                        );'''
+    }
+
+    dml = {
+        "insert_dates": '''INSERT INTO
+            d_dates (id, "date", "year", "month", "day", weekday, school_year, schedule_day, schedule_week)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);''',
+        "insert_evaluations": '''INSERT INTO
+            d_evaluations (id, type, duration, isRetake)
+                VALUES (?, ?, ?, ?);''',
+        "insert_groups": '''INSERT INTO
+            d_groups (id, group_id, css_id, css_name, school_id, school_name, school_milieu, school_year, grade, group_size, enrolment)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);''',
+        "insert_students": '''INSERT INTO
+            d_students (id, uid, email, firstname, lastname, dob, gender, "status")
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?);''',
+        "insert_teachers": '''INSERT INTO
+            d_teachers (id, uid, email, firstname, lastname, dob, gender)
+                VALUES (?, ?, ?, ?, ?, ?, ?);''',
+        "insert_topics": '''INSERT INTO
+            d_topics (id, topic_id, name, isSpeciality)
+                VALUES (?, ?, ?, ?);''',
+        "insert_results": '''INSERT INTO
+            f_results (fk_dates, fk_evaluations, fk_groups, fk_students, fk_teachers, fk_topics, evaluation_type, evaluation_value, evaluation_score, evaluation_total, evaluation_pct, evaluation_weight)
+                VALUES (?, ?, ?, ?, ?, ?, 'quantitative', 'NA', ?, ?, ?, ?);'''
+    }
+
+    pragmas = {
+        "bulk": ['''PRAGMA journal_mode = MEMORY''',
+                 '''PRAGMA synchronous = OFF''',
+                 '''PRAGMA cache_size = -262144''',  # 256 MiB page cache
+                 '''PRAGMA temp_store = MEMORY''']
+    }
+
+    # Compact variant: integer keys (YYYYMMDD dates), integer-coded and REAL columns, facts clustered on
+    # (school year, group, topic, student) in a WITHOUT ROWID table
+    ddl_compact = {
+        "d_dates": '''CREATE TABLE d_dates
+                        (
+                            id         INTEGER NOT NULL
+                                CONSTRAINT dates_pk
+                                    PRIMARY KEY,
+                            date     TEXT NOT NULL,
+                            year     INTEGER NOT NULL,
+                            month     INTEGER NOT NULL,
+                            day     INTEGER NOT NULL,
+                            weekday     INTEGER NOT NULL,
+                            school_year TEXT NOT NULL,
+                            schedule_day   INTEGER NOT NULL,
+                            schedule_week   INTEGER NOT NULL
+                        );''',
+        "d_evaluations": '''CREATE TABLE d_evaluations
+                        (
+                            id         INTEGER NOT NULL
+                                CONSTRAINT evaluations_pk
+                                    PRIMARY KEY,
+                            type     TEXT NOT NULL,
+                            duration     INTEGER NOT NULL,
+                            isRetake     INTEGER NOT NULL
+                        );''',
+        "d_groups": '''CREATE TABLE d_groups
+                        (
+                            id         INTEGER NOT NULL
+                                CONSTRAINT groups_pk
+                                    PRIMARY KEY,
+                            group_id     INTEGER NOT NULL,
+                            css_id     INTEGER NOT NULL,
+                            css_name     TEXT NOT NULL,
+                            school_id      INTEGER NOT NULL,
+                            school_name      TEXT NOT NULL,
+                            school_milieu   TEXT NOT NULL,
+                            school_year TEXT NOT NULL,
+                            grade   INTEGER NOT NULL,
+                            group_size      INTEGER NOT NULL,
+                            enrolment  INTEGER NOT NULL
+                        );
+                        CREATE UNIQUE INDEX d_groups_css_id_school_id_group_id_uindex
+                            ON d_groups (css_id, school_id, group_id, school_year);''',
+        "d_students": '''CREATE TABLE d_students
+                        (
+                            id              INTEGER NOT NULL
+                                CONSTRAINT students_pk
+                                    PRIMARY KEY,
+                            uid TEXT    NOT NULL,
+                            email TEXT    NOT NULL,
+                            firstname       TEXT    NOT NULL,
+                            lastname        TEXT    NOT NULL,
+                            dob             TEXT    NOT NULL,
+                            gender          TEXT    NOT NULL,
+                            "status"        TEXT    NOT NULL
+                        );
+                        CREATE UNIQUE INDEX d_students_uid_uindex
+                            ON d_students (uid);''',
+        "d_teachers": '''CREATE TABLE d_teachers
+                        (
+                            id              INTEGER NOT NULL
+                                CONSTRAINT teachers_pk
+                                    PRIMARY KEY,
+                            uid TEXT    NOT NULL,
+                            email     TEXT NOT NULL,
+                            firstname       TEXT    NOT NULL,
+                            lastname        TEXT    NOT NULL,
+                            dob             TEXT    NOT NULL,
+                            gender          TEXT    NOT NULL
+                        );
+                        CREATE UNIQUE INDEX d_teachers_uid_uindex
+                            ON d_teachers (uid);''',
+        "d_topics": '''CREATE TABLE d_topics
+                        (
+                            id         INTEGER NOT NULL
+                                CONSTRAINT topics_pk
+                                    PRIMARY KEY,
+                            topic_id INTEGER NOT NULL,
+                            name     TEXT NOT NULL,
+                            isSpeciality      INTEGER NOT NULL
+                        );
+                        CREATE UNIQUE INDEX d_topics_topic_isSpeciality_uindex
+                            ON d_topics (topic_id, name, isSpeciality);''',
+        "f_results": '''CREATE TABLE f_results
+                        (
+                            school_year    INTEGER NOT NULL,
+                            fk_groups      INTEGER NOT NULL
+                                REFERENCES d_groups,
+                            fk_topics      INTEGER NOT NULL
+                                REFERENCES d_topics,
+                            fk_students    INTEGER NOT NULL
+                                REFERENCES d_students,
+                            evaluation_id  INTEGER NOT NULL,
+                            fk_dates       INTEGER NOT NULL
+                                REFERENCES d_dates,
+                            fk_evaluations INTEGER NOT NULL
+                                REFERENCES d_evaluations,
+                            fk_teachers    INTEGER NOT NULL
+                                REFERENCES d_teachers,
+                            evaluation_score   REAL NOT NULL,
+                            evaluation_total   INTEGER NOT NULL,
+                            evaluation_pct     REAL NOT NULL,
+                            evaluation_weight  REAL NOT NULL,
+                            CONSTRAINT results_pk
+                                PRIMARY KEY (school_year, fk_groups, fk_topics, fk_students, evaluation_id)
+                        ) WITHOUT ROWID;'''
+    }
+
+    dml_compact = dict(dml, **{
+        "insert_results": '''INSERT INTO
+            f_results (school_year, fk_groups, fk_topics, fk_students, evaluation_id, fk_dates, fk_evaluations, fk_teachers, evaluation_score, evaluation_total, evaluation_pct, evaluation_weight)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);'''
+    })
+
+    # Post-load indexes matching the dashboard queries (filters on school year, grade or topic name through the
+    # dimensions, distinct students and score sums from the facts)
+    indexes = {
+        "d_dates": '''CREATE INDEX IF NOT EXISTS d_dates_school_year_index
+                        ON d_dates (school_year, id);''',
+        "d_groups": '''CREATE INDEX IF NOT EXISTS d_groups_grade_index
+                        ON d_groups (grade, id);''',
+        "d_topics": '''CREATE INDEX IF NOT EXISTS d_topics_name_index
+                        ON d_topics (name, id);''',
+        "f_results": '''CREATE INDEX IF NOT EXISTS f_results_fk_dates_fk_students_index
+                        ON f_results (fk_dates, fk_students, fk_groups, fk_topics, evaluation_score, evaluation_total);
+                        CREATE INDEX IF NOT EXISTS f_results_fk_groups_fk_dates_index
+                        ON f_results (fk_groups, fk_dates, fk_students, evaluation_score, evaluation_total);
+                        CREATE INDEX IF NOT EXISTS f_results_fk_topics_fk_dates_index
+                        ON f_results (fk_topics, fk_dates, fk_students, evaluation_score, evaluation_total);'''
+    }
+
+    # Compact variant: the indexes of a WITHOUT ROWID table carry the primary key (school year, group, topic,
+    # student, evaluation), so a single index on dates and scores covers the group and topic joins; lookups by
+    # group use the clustered primary key
+    indexes_compact = dict(indexes, **{
+        "f_results": '''CREATE INDEX IF NOT EXISTS f_results_fk_dates_fk_students_index
+                        ON f_results (fk_dates, fk_students, evaluation_score, evaluation_total);'''
+    })
+
+    # Registry state of each school year (pools, staff assignments, enrolled students with their simulation
+    # attributes), so that a school year can be appended to an existing database
+    ddl_state = {
+        "s_pools": '''CREATE TABLE IF NOT EXISTS s_pools
+                        (
+                            css_id     INTEGER NOT NULL,
+                            school_id     INTEGER NOT NULL,
+                            school_year     TEXT NOT NULL,
+                            pool     TEXT NOT NULL,
+                            seed     TEXT NOT NULL,
+                            pool_size     INTEGER NOT NULL,
+                            popped     INTEGER NOT NULL,
+                            CONSTRAINT pools_pk
+                                PRIMARY KEY (css_id, school_id, school_year, pool)
+                        );''',
+        "s_staff": '''CREATE TABLE IF NOT EXISTS s_staff
+                        (
+                            css_id     INTEGER NOT NULL,
+                            school_id     INTEGER NOT NULL,
+                            school_year     TEXT NOT NULL,
+                            role     TEXT NOT NULL,
+                            grade     INTEGER,
+                            topic_name     TEXT,
+                            workload     REAL NOT NULL,
+                            uid     TEXT NOT NULL,
+                            firstname     TEXT NOT NULL,
+                            lastname     TEXT NOT NULL,
+                            dob     TEXT NOT NULL,
+                            gender     TEXT NOT NULL,
+                            experience     INTEGER NOT NULL,
+                            success_factor     REAL NOT NULL
                         );''',
-        "s_results": '''CREATE TABLE s_results
+        "s_students": '''CREATE TABLE IF NOT EXISTS s_students
                         (
-                            css_id          INTEGER NOT NULL,
-                            school_id       INTEGER NOT NULL,
+                            css_id     INTEGER NOT NULL,
+                            school_id     INTEGER NOT NULL,
                             school_year     TEXT NOT NULL,
-                            group_id        INTEGER NOT NULL,
-                            student_uid     TEXT NOT NULL,
-                            teacher_uid     TEXT NOT NULL,
-                            topic_id        INTEGER NOT NULL,
-                            evaluation_id   INTEGER NOT NULL,
-                            evaluation_type    TEXT NOT NULL,
-                            evaluation_date    TEXT  NOT NULL,
-                            evaluation_score  FLOAT  NOT NULL,
-                            evaluation_total  INTEGER NOT NULL,
-                            evaluation_pct  FLOAT NOT NULL,
-                            evaluation_weight  FLOAT NOT NULL,
-                            evaluation_duration  INTEGER NOT NULL,
-                            isRetake  INTEGER NOT NULL,
-                            comments        TEXT NULL
+                            grade     INTEGER NOT NULL,
+                            uid     TEXT NOT NULL,
+                            firstname     TEXT NOT NULL,
+                            lastname     TEXT NOT NULL,
+                            dob     TEXT NOT NULL,
+                            gender     TEXT NOT NULL,
+                            caseweight     INTEGER NOT NULL,
+                            success_factor     REAL NOT NULL,
+                            success_variability     REAL NOT NULL,
+                            success_year_trend     REAL NOT NULL
                         );'''
     }
 
-    dml = {
-        "insert_dates": '''INSERT OR IGNORE INTO
-            d_dates ("date", "year", "month", "day", weekday, school_year, schedule_day, schedule_week)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?);''',
-        "insert_groups": '''INSERT OR IGNORE INTO
-            d_groups (group_id, css_id, css_name, school_id, school_name, school_milieu, school_year, grade, group_size, enrolment)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);''',
-        "insert_students": '''INSERT OR IGNORE INTO
-            d_students (uid, email, firstname, lastname, dob, gender, "status")
+    dml_state = {
+        "insert_pools": '''INSERT OR REPLACE INTO
+            s_pools (css_id, school_id, school_year, pool, seed, pool_size, popped)
                 VALUES (?, ?, ?, ?, ?, ?, ?);''',
-        "insert_teachers": '''INSERT OR IGNORE INTO
-            d_teachers (uid, email, firstname, lastname, dob, gender)
-                VALUES (?, ?, ?, ?, ?, ?);''',
-        "insert_topics": '''INSERT OR IGNORE INTO
-            d_topics (topic_id, name, isSpeciality)
-                VALUES (?, ?, ?);''',
-        "insert_s_results": '''INSERT INTO
-            s_results (css_id, school_id, school_year, group_id, student_uid, topic_id, teacher_uid, evaluation_id, evaluation_type, evaluation_date, evaluation_score, evaluation_total, evaluation_pct, evaluation_weight, evaluation_duration, isRetake)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);''',
-        "insert_into_d_evaluations": '''INSERT INTO d_evaluations (type, duration, isRetake) 
-                SELECT DISTINCT evaluation_type, evaluation_duration, isRetake FROM s_results ORDER BY evaluation_type, evaluation_duration, isRetake;''',
-        "insert_into_f_results": '''INSERT INTO
-                        f_results (fk_dates, fk_evaluations, fk_groups, fk_students, fk_teachers, fk_topics, evaluation_type, evaluation_value, evaluation_score, evaluation_total, evaluation_pct, evaluation_weight)
-                    SELECT
-                        d_dates.id, d_evaluations.id, d_groups.id, d_students.id, d_teachers.id, d_topics.id, 'quantitative', 'NA', evaluation_score,
-                        evaluation_total, evaluation_pct, evaluation_weight
-                    FROM
-                        s_results,
-                        d_dates,
-                        d_evaluations,
-                        d_groups,
-                        d_students,
-                        d_teachers,
-                        d_topics
-                    WHERE
-                          s_results.evaluation_date = d_dates.date
-                      AND s_results.evaluation_type = d_evaluations.type AND s_results.evaluation_duration = d_evaluations.duration AND s_results.isRetake = d_evaluations.isRetake
-                      AND s_results.css_id = d_groups.css_id AND s_results.school_id = d_groups.school_id AND s_results.school_year = d_groups.school_year AND s_results.group_id = d_groups.group_id
-                      AND s_results.student_uid = d_students.uid
-                      AND s_results.teacher_uid = d_teachers.uid
-                      AND s_results.topic_id = d_topics.topic_id;''',
-        "drop_s_results": '''DROP TABLE s_results;'''
+        "insert_staff": '''INSERT INTO
+            s_staff (css_id, school_id, school_year, role, grade, topic_name, workload, uid, firstname, lastname, dob, gender, experience, success_factor)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);''',
+        "insert_students": '''INSERT INTO
+            s_students (css_id, school_id, school_year, grade, uid, firstname, lastname, dob, gender, caseweight, success_factor, success_variability, success_year_trend)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);'''
+    }
+
+    # Natural and surrogate keys of the dimensions, and latest registry state of each school, read before an append
+    dql_state = {
+        "select_dates": '''SELECT "date", id FROM d_dates;''',
+        "select_school_years": '''SELECT DISTINCT school_year FROM d_dates;''',
+        "select_evaluations": '''SELECT type, CAST(duration AS INTEGER), isRetake, id FROM d_evaluations;''',
+        "select_groups": '''SELECT css_id, school_id, school_year, group_id, id FROM d_groups;''',
+        "select_students": '''SELECT uid, id FROM d_students;''',
+        "select_teachers": '''SELECT uid, id FROM d_teachers;''',
+        "select_topics": '''SELECT CAST(topic_id AS INTEGER), id FROM d_topics;''',
+        "select_simulated": '''SELECT DISTINCT css_id, school_id, school_year FROM d_groups;''',
+        "select_pools": '''SELECT p.css_id, p.school_id, p.school_year, p.pool, p.seed, p.pool_size, p.popped
+            FROM s_pools p
+            WHERE p.school_year = (SELECT MAX(school_year) FROM s_pools
+                                   WHERE css_id = p.css_id AND school_id = p.school_id);''',
+        "select_staff": '''SELECT s.css_id, s.school_id, s.school_year, s.role, s.grade, s.topic_name, s.workload, s.uid,
+                s.firstname, s.lastname, s.dob, s.gender, s.experience, s.success_factor
+            FROM s_staff s
+            WHERE s.school_year = (SELECT MAX(school_year) FROM s_pools
+                                   WHERE css_id = s.css_id AND school_id = s.school_id)
+            ORDER BY s.rowid;''',
+        "select_students_state": '''SELECT s.css_id, s.school_id, s.school_year, s.grade, s.uid, s.firstname, s.lastname,
+                s.dob, s.gender, s.caseweight, s.success_factor, s.success_variability, s.success_year_trend
+            FROM s_students s
+            WHERE s.school_year = (SELECT MAX(school_year) FROM s_pools
+                                   WHERE css_id = s.css_id AND school_id = s.school_id)
+            ORDER BY s.rowid;'''
     }
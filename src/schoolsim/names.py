@@ -0,0 +1,209 @@
+import csv
+import logging
+import os
+import re
+import tempfile
+import numpy as np
+import unidecode as unidecode
+
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DATA_PATH = Path(__file__).parent.joinpath("data")
+NAME_TABLES = ("firstname_f", "firstname_m", "lastname")
+
+_sampler = None
+
+
+def uid_prefix(lastname):
+    """Retourne le préfixe d'identifiant tiré du nom de famille, sans accents.
+
+    :param lastname: le nom de famille.
+    :return: le préfixe d'identifiant.
+    """
+    return unidecode.unidecode(re.sub('[- .]', 'x', lastname[0:3].lower()))  # Remove accents
+
+
+def uid_initial(firstname):
+    """Retourne l'initiale du prénom utilisée dans l'identifiant, sans accents.
+
+    :param firstname: le prénom.
+    :return: l'initiale du prénom.
+    """
+    return unidecode.unidecode(firstname[0:1].lower())  # Remove accents
+
+
+class AliasTable(object):
+    """Définit une table d'alias (méthode de Vose) pour le tirage pondéré en temps constant par tirage.
+
+    """
+
+    def __init__(self, prob, alias):
+        """Initialise la table d'alias.
+
+        :param prob: les probabilités d'acceptation de chaque case.
+        :param alias: l'alias de chaque case.
+        """
+        self.prob = prob
+        self.alias = alias
+
+    def __len__(self):
+        return len(self.prob)
+
+    @staticmethod
+    def build(weights):
+        """Construit la table d'alias à partir des poids.
+
+        :param weights: les poids (ex. nombre d'occurrences).
+        :return: les tableaux des probabilités d'acceptation et des alias.
+        """
+        size = len(weights)
+        scaled = np.asarray(weights, dtype=np.float64) * size / np.sum(weights)
+        prob = np.ones(size, dtype=np.float64)
+        alias = np.arange(size, dtype=np.int32)
+        small = [idx for idx in range(size) if scaled[idx] < 1.0]
+        large = [idx for idx in range(size) if scaled[idx] >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            prob[less] = scaled[less]
+            alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        return prob, alias
+
+    def sample(self, size, rng):
+        """Tire des indices selon les poids de la table.
+
+        :param size: le nombre de tirages.
+        :param rng: le générateur pseudo-aléatoire.
+        :return: les indices tirés.
+        """
+        idx = rng.integers(0, len(self.prob), size)
+        return np.where(rng.random(size) < self.prob[idx], idx, self.alias[idx])
+
+
+class NameTable(object):
+    """Définit une table de noms (prénoms ou noms de famille) prête au tirage pondéré, avec le préfixe
+    d'identifiant précalculé de chaque nom.
+
+    """
+
+    def __init__(self, records):
+        """Initialise la table de noms.
+
+        :param records: le tableau structuré des noms (name, uid, prob, alias).
+        """
+        self.names = records["name"].astype(object)
+        self.uids = records["uid"].astype(object)
+        self.aliases = AliasTable(records["prob"], records["alias"])
+
+    def sample(self, size, rng):
+        """Tire des noms selon leur nombre d'occurrences.
+
+        :param size: le nombre de tirages.
+        :param rng: le générateur pseudo-aléatoire.
+        :return: les indices des noms tirés.
+        """
+        return self.aliases.sample(size, rng)
+
+
+class NameSampler(object):
+    """Définit l'échantillonneur de noms partagé par les bassins de personnes d'un processus. Les tables TSV ne sont
+    lues qu'une fois puis mises en cache sous forme binaire (.npy) à côté des fichiers source; les processus de
+    travail chargent ce cache en mémoire partagée (mmap).
+
+    """
+
+    def __init__(self, data_path=DATA_PATH):
+        """Initialise l'échantillonneur de noms.
+
+        :param data_path: le répertoire des tables de noms.
+        """
+        self.tables = {name: NameTable(NameSampler.load(data_path, name)) for name in NAME_TABLES}
+
+    def firstnames(self, gender):
+        """Retourne la table des prénoms d'un genre.
+
+        :param gender: le genre, 'f' ou 'm'.
+        :return: la table des prénoms.
+        """
+        return self.tables["firstname_" + gender]
+
+    def lastnames(self):
+        """Retourne la table des noms de famille.
+
+        :return: la table des noms de famille.
+        """
+        return self.tables["lastname"]
+
+    @staticmethod
+    def load(data_path, name):
+        """Retourne le tableau structuré d'une table de noms, depuis le cache binaire s'il est à jour.
+
+        :param data_path: le répertoire des tables de noms.
+        :param name: le nom de la table.
+        :return: le tableau structuré (name, uid, prob, alias).
+        """
+        tsv_path = Path(data_path).joinpath(name + ".tsv")
+        npy_path = Path(data_path).joinpath(name + ".npy")
+        try:
+            if npy_path.stat().st_mtime >= tsv_path.stat().st_mtime:
+                return np.load(npy_path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass  # ignore if cache is missing or unreadable
+        records = NameSampler.parse(tsv_path)
+        try:
+            # write aside then replace, other processes may have the previous cache mapped
+            (fd, tmp_path) = tempfile.mkstemp(prefix=name + ".", suffix=".tmp.npy", dir=npy_path.parent)
+            try:
+                with os.fdopen(fd, 'wb') as fh:
+                    np.save(fh, records)
+                os.chmod(tmp_path, 0o644)  # mkstemp creates owner-only files
+                os.replace(tmp_path, npy_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            logger.debug("Names, cached table {} to {}".format(name, npy_path))
+        except OSError:
+            logger.debug("Names, could not cache table {}".format(name))
+        return records
+
+    @staticmethod
+    def parse(tsv_path):
+        """Lit une table de noms TSV (nom, [genre], occurrences) et précalcule ses tables d'alias et ses préfixes
+        d'identifiant.
+
+        :param tsv_path: le chemin vers la table TSV.
+        :return: le tableau structuré (name, uid, prob, alias).
+        """
+        with open(tsv_path, encoding='utf8', newline='') as fh:
+            reader = csv.reader(fh, delimiter='\t')
+            next(reader)  # header
+            rows = [(row[0], int(row[-1])) for row in reader if row]
+        names = [name for (name, occurrences) in rows]
+        uids = [uid_prefix(name) if tsv_path.stem == "lastname" else uid_initial(name) for name in names]
+        (prob, alias) = AliasTable.build([occurrences for (name, occurrences) in rows])
+        records = np.empty(len(rows), dtype=[("name", "U{}".format(max(map(len, names)))),
+                                             ("uid", "U{}".format(max(map(len, uids)))),
+                                             ("prob", np.float64), ("alias", np.int32)])
+        records["name"] = names
+        records["uid"] = uids
+        records["prob"] = prob
+        records["alias"] = alias
+        return records
+
+
+def get_name_sampler():
+    """Retourne l'échantillonneur de noms du processus, chargé au premier appel.
+
+    :return: l'échantillonneur de noms.
+    """
+    global _sampler
+    if _sampler is None:
+        _sampler = NameSampler()
+    return _sampler
@@ -1,24 +1,35 @@
 import datetime
-import math
-import random
-import re
 import logging
+import sys
 import numpy as np
-import pandas as pd
-import unidecode as unidecode
 
-from pathlib import Path
 from abc import abstractmethod, ABC
 
+from .names import get_name_sampler, uid_initial, uid_prefix
+
 PEOPLE_ALL = 'people_all'
 
 logger = logging.getLogger(__name__)
 
 
+def person_uid(firstname, lastname, dob):
+    """Retourne l'identifiant d'une personne formé du nom, de l'initiale du prénom, du jour et du mois de naissance.
+
+    :param firstname: le prénom.
+    :param lastname: le nom de famille.
+    :param dob: la date de naissance.
+    :return: l'identifiant de la personne.
+    """
+    return uid_prefix(lastname) + uid_initial(firstname) + str(dob.day).zfill(2) + str(dob.month).zfill(2)
+
+
 class Person(ABC):
-    """Définit une personne.
+    """Définit une personne. Les personnes sont nombreuses dans une simulation : les attributs sont déclarés dans
+    __slots__, les chaînes répétées (noms, genre) sont internées et la date de naissance est conservée sous forme
+    de numéro de jour (ordinal).
 
     """
+    __slots__ = ('firstname', 'lastname', '_dob', 'gender', 'profile')
 
     def __init__(self, firstname, lastname, dob, gender):
         """Initialise une personne.
@@ -28,20 +39,41 @@ class Person(ABC):
         :param dob: la date de naissance.
         :param gender: le genre.
         """
-        self.id = (lastname[0:3] + firstname[0:1] + str(dob.year)).lower()
-        self.firstname = firstname
-        self.lastname = lastname
+        self.firstname = sys.intern(str(firstname))
+        self.lastname = sys.intern(str(lastname))
         self.dob = dob
-        self.gender = gender
+        self.gender = sys.intern(str(gender))
         self.profile = None
 
+    @property
+    def id(self):
+        """Retourne l'identifiant de la personne formé du nom, de l'initiale du prénom et de l'année de naissance.
+
+        :return: l'identifiant de la personne.
+        """
+        return (self.lastname[0:3] + self.firstname[0:1] + str(self.dob.year)).lower()
+
+    @property
+    def dob(self):
+        """Retourne la date de naissance.
+
+        :return: la date de naissance au format datetime.date.
+        """
+        return datetime.date.fromordinal(self._dob)
+
+    @dob.setter
+    def dob(self, dob):
+        self._dob = dob.toordinal()
+
 
 class Student(Person):
     """Initialise un élève.
 
     """
+    __slots__ = ('status', 'uid', 'caseweight', 'success_factor', 'success_variability', 'success_year_trend',
+                 'results')
 
-    def __init__(self, firstname, lastname, dob, gender, caseweight=1):
+    def __init__(self, firstname, lastname, dob, gender, caseweight=1, rng=None, **kwargs):
         """Initialise un élève.
 
         :param firstname: le prénom.
@@ -49,19 +81,25 @@ class Student(Person):
         :param dob: la date de naissance.
         :param gender: le genre.
         :param caseweight: la charge correspondante (ex. TDAH, TSA).
+        :param rng: le générateur pseudo-aléatoire propre à l'élève.
+        :param kwargs: les attributs déjà générés par la fabrique de personnes (uid, success_factor,
+            success_variability, success_year_trend).
         """
+        rng = rng if rng is not None else np.random.default_rng()
         super().__init__(firstname, lastname, dob, gender)
         self.profile = 'student'
         self.status = 'normal'  # TODO provide profile + headcount + success_factor penality
-        self.uid = re.sub('[- .]', 'x', lastname[0:3].lower()) + firstname[0:1].lower() + str(dob.day).zfill(2) + str(
-            dob.month).zfill(2)
-        self.uid = unidecode.unidecode(self.uid)  # Remove accents
+        self.uid = kwargs.get("uid") or person_uid(firstname, lastname, dob)
         self.caseweight = caseweight
-        self.success_factor = np.random.normal(0.78, 0.08, 1)[0] if self.gender == 'f' else \
-        np.random.normal(0.68, 0.08, 1)[0]
-        self.success_variability = abs(np.random.normal(0, 0.05, 1)[0])
-        self.success_year_trend = np.random.normal(0, 0.01, 1)[0]
-        self.results = []
+        if "success_factor" in kwargs:
+            self.success_factor = kwargs["success_factor"]
+            self.success_variability = kwargs["success_variability"]
+            self.success_year_trend = kwargs["success_year_trend"]
+        else:
+            self.success_factor = rng.normal(0.78, 0.08) if self.gender == 'f' else rng.normal(0.68, 0.08)
+            self.success_variability = abs(rng.normal(0, 0.05))
+            self.success_year_trend = rng.normal(0, 0.01)
+        self.results = {}  # Index range (start, stop) in the result store, by school year
 
     def __str__(self):
         return self.descibe()
@@ -91,24 +129,30 @@ class Teacher(Person):
     """Définit une personne enseignante.
 
     """
+    __slots__ = ('uid', 'experience', 'success_factor', 'success_variability', 'workload')
 
-    def __init__(self, firstname, lastname, dob, gender):
+    def __init__(self, firstname, lastname, dob, gender, rng=None, **kwargs):
         """Initialise une personne enseignante.
 
         :param firstname: le prénom.
         :param lastname: le nom de famille.
         :param dob: la date de naissance.
         :param gender: le genre.
+        :param rng: le générateur pseudo-aléatoire propre à la personne enseignante.
+        :param kwargs: les attributs déjà générés par la fabrique de personnes (uid, experience, success_factor).
         """
+        rng = rng if rng is not None else np.random.default_rng()
         today = datetime.date.today()
         super().__init__(firstname, lastname, dob, gender)
         self.profile = 'teacher'
-        self.uid = re.sub('[- .]', 'x', lastname[0:3].lower()) + firstname[0:1].lower() + str(dob.day).zfill(2) + str(
-            dob.month).zfill(2)
-        self.uid = unidecode.unidecode(self.uid)  # Remove accents
-        self.experience = today.year - dob.year - (
-                (today.month, today.day) < (dob.month, dob.day)) - 23 + random.randint(-5, 0)
-        self.success_factor = np.random.normal(self.experience / 3000, 0.005, 1)[0]
+        self.uid = kwargs.get("uid") or person_uid(firstname, lastname, dob)
+        if "experience" in kwargs:
+            self.experience = kwargs["experience"]
+            self.success_factor = kwargs["success_factor"]
+        else:
+            self.experience = today.year - dob.year - (
+                    (today.month, today.day) < (dob.month, dob.day)) - 23 + int(rng.integers(-5, 0, endpoint=True))
+            self.success_factor = rng.normal(self.experience / 3000, 0.005)
         self.success_variability = 0.005
         self.workload = 0
 
@@ -140,8 +184,9 @@ class Specialist(Teacher):
     """Définit une personne enseignante spécialiste (ex. musique, éducation physique).
 
     """
+    __slots__ = ('topic',)
 
-    def __init__(self, firstname, lastname, dob, gender, topic):
+    def __init__(self, firstname, lastname, dob, gender, topic, rng=None):
         """Initialiste une personne enseignante spécialiste.
 
         :param firstname: le prénom.
@@ -149,36 +194,173 @@ class Specialist(Teacher):
         :param dob: la date de naissance.
         :param gender: le genre.
         :param topic: la matière scolaire.
+        :param rng: le générateur pseudo-aléatoire propre à la personne enseignante.
         """
-        super().__init__(firstname, lastname, dob, gender)
+        super().__init__(firstname, lastname, dob, gender, rng=rng)
         today = datetime.date.today()
         self.profile = 'specialist'
         self.topic = topic
         self.workload = 0
 
 
-class Pool(ABC):
-    """Définit la classe abstraite de bassin pour la génération de listes cohérentes de personnes.
+class PersonFactory(object):
+    """Définit la fabrique columnaire de personnes. Un seul appel génère les attributs de N personnes sous forme de
+    tableaux (noms, date de naissance, genre, facteurs de réussite, expérience, identifiant); les objets Person ne
+    sont construits qu'au besoin à partir d'une rangée.
 
     """
 
     def __init__(self):
+        """Initialise la fabrique de personnes à partir de l'échantillonneur de noms partagé du processus.
+
+        """
+        self.names = get_name_sampler()
+
+    def people(self, size, rng, gender_f_pct):
+        """Génère les noms, genres et préfixes d'identifiant de N personnes.
+
+        :param size: le nombre de personnes.
+        :param rng: le générateur pseudo-aléatoire.
+        :param gender_f_pct: la proportion de personnes de genre féminin.
+        :return: les colonnes firstname, lastname, gender et uid (préfixe sans date de naissance).
+        """
+        gender = np.where(rng.binomial(1, gender_f_pct, size) == 1, 'f', 'm')
+        lastnames = self.names.lastnames()
+        idx_lastname = lastnames.sample(size, rng)
+        firstnames_f = self.names.firstnames('f')
+        firstnames_m = self.names.firstnames('m')
+        idx_firstname_f = firstnames_f.sample(size, rng)
+        idx_firstname_m = firstnames_m.sample(size, rng)
+        is_f = gender == 'f'
+        return {"firstname": np.where(is_f, firstnames_f.names[idx_firstname_f], firstnames_m.names[idx_firstname_m]),
+                "lastname": lastnames.names[idx_lastname], "gender": gender,
+                "uid": lastnames.uids[idx_lastname] + np.where(is_f, firstnames_f.uids[idx_firstname_f],
+                                                                firstnames_m.uids[idx_firstname_m])}
+
+    @staticmethod
+    def uids(prefixes, dobs):
+        """Retourne les identifiants de N personnes à partir de leur préfixe et de leur date de naissance.
+
+        :param prefixes: les préfixes d'identifiant (nom et initiale du prénom).
+        :param dobs: les dates de naissance (datetime64[D]).
+        :return: les identifiants.
+        """
+        months = dobs.astype('datetime64[M]')
+        days = (dobs - months).astype(int) + 1
+        months = months.astype(int) % 12 + 1
+        return np.array(["{}{:02d}{:02d}".format(prefix, day, month) for (prefix, day, month) in
+                         zip(prefixes, days.tolist(), months.tolist())], dtype=object)
+
+    def students(self, size, rng, gender_f_pct=0.53543):
+        """Génère les attributs de N élèves.
+
+        :param size: le nombre d'élèves.
+        :param rng: le générateur pseudo-aléatoire.
+        :param gender_f_pct: la proportion d'élèves de genre féminin.
+        :return: les colonnes des attributs des élèves.
+        """
+        # Students are born within a school year, the year of birth is corrected at enrolment
+        start_date = np.datetime64('2009-10-01')
+        end_date = np.datetime64('2010-09-30')
+        columns = self.people(size, rng, gender_f_pct)
+        columns["dob"] = start_date + rng.integers(0, (end_date - start_date).astype(int), size)
+        columns["uid"] = self.uids(columns["uid"], columns["dob"])
+        columns["success_factor"] = np.where(columns["gender"] == 'f', rng.normal(0.78, 0.08, size),
+                                             rng.normal(0.68, 0.08, size))
+        columns["success_variability"] = np.abs(rng.normal(0, 0.05, size))
+        columns["success_year_trend"] = rng.normal(0, 0.01, size)
+        return columns
+
+    def teachers(self, size, rng, gender_f_pct=0.85, age_mean=45, age_stddev=10, reference_date=None):
+        """Génère les attributs de N personnes enseignantes.
+
+        :param size: le nombre de personnes enseignantes.
+        :param rng: le générateur pseudo-aléatoire.
+        :param gender_f_pct: la proportion de personnes de genre féminin.
+        :param age_mean: l'âge moyen.
+        :param age_stddev: l'écart type de l'âge.
+        :param reference_date: la date à laquelle l'âge est atteint, aujourd'hui par défaut; une date fixe (ex. début
+            de la simulation) rend les dates de naissance reproductibles.
+        :return: les colonnes des attributs des personnes enseignantes.
+        """
+        today = np.datetime64(reference_date or datetime.date.today(), 'D')
+        this_year = today.astype('datetime64[Y]')
+        columns = self.people(size, rng, gender_f_pct)
+        ages = rng.normal(age_mean, age_stddev, size)
+        years = np.clip(np.floor(ages), 23, 67).astype(int)  # enforcing age bounds
+        days = ((ages - np.floor(ages)) * 365).astype(int)
+        # Born in the year of the age, or the year before when the birthday is not yet reached
+        birth_years = this_year - years - (days > (today - this_year.astype('datetime64[D]')).astype(int))
+        columns["dob"] = birth_years.astype('datetime64[D]') + days
+        columns["uid"] = self.uids(columns["uid"], columns["dob"])
+        columns["experience"] = years - 23 + rng.integers(-5, 0, size, endpoint=True)
+        columns["success_factor"] = rng.normal(columns["experience"] / 3000, 0.005)
+        return columns
+
+
+class Pool(ABC):
+    """Définit la classe abstraite de bassin pour la génération de listes cohérentes de personnes. Le bassin
+    conserve les attributs des personnes sous forme columnaire et ne construit une personne qu'au moment de la
+    retourner.
+
+    """
+
+    def __init__(self, seed_sequence=None, pool_size=30):
         """Initialise le bassin.
 
+        :param seed_sequence: la séquence de germes du bassin.
+        :param pool_size: le nombre de personnes générées à chaque réapprovisionnement, selon la demande prévue.
         """
-        pass
+        self.seed_sequence = seed_sequence if seed_sequence is not None else np.random.SeedSequence()
+        self.rng = np.random.default_rng(self.seed_sequence)
+        self.pool_size = max(1, pool_size)
+        self.factory = PersonFactory()
+        self.pool = {}
+        self.cursor = 0
+        self.popped = 0  # People returned since the creation of the pool
+
+    def __len__(self):
+        return len(self.pool.get("uid", ())) - self.cursor
 
     @abstractmethod
     def __replenish_pool(self):
         raise NotImplementedError
 
     @abstractmethod
+    def _build(self, idx):
+        """Construit la personne d'une rangée du bassin.
+
+        :param idx: l'indice de la rangée.
+        :return: la personne.
+        """
+        raise NotImplementedError
+
     def pop(self):
         """Retourne une personne dans le bassin.
 
         :return: une personne dans le bassin.
         """
-        raise NotImplementedError
+        if len(self) == 0:
+            self._Pool__replenish_pool()
+        person = self._build(self.cursor)
+        self.cursor += 1
+        self.popped += 1
+        return person
+
+    def skip(self, count):
+        """Avance le bassin d'un nombre de personnes sans les construire, pour reprendre un bassin déjà entamé
+        (ex. ajout d'une année scolaire à une simulation sauvegardée).
+
+        :param count: le nombre de personnes déjà retournées par le bassin.
+        :return:
+        """
+        while count > 0:
+            if len(self) == 0:
+                self._Pool__replenish_pool()
+            step = min(count, len(self))
+            self.cursor += step
+            self.popped += step
+            count -= step
 
 
 class SpecialistPool(Pool):
@@ -199,85 +381,27 @@ class TeacherPool(Pool):
     """
     db = None
 
-    def __init__(self):
+    def __init__(self, seed_sequence=None, pool_size=30, reference_date=None):
         """Initialise le bassin de personnes enseignantes non-spécialistes.
 
+        :param seed_sequence: la séquence de germes du bassin.
+        :param pool_size: le nombre de personnes enseignantes générées à chaque réapprovisionnement.
+        :param reference_date: la date à laquelle l'âge des personnes enseignantes est atteint, voir
+            PersonFactory.teachers.
         """
-        super(Pool, self).__init__()
-        self.pool = []
-        self.df_firstname_f = pd.read_csv(Path(__file__).parent.joinpath("data/firstname_f.tsv"), delimiter='\t', header=0,
-                                          names=['firstname', 'gender', 'occurrences'])
-        self.df_firstname_m = pd.read_csv(Path(__file__).parent.joinpath("data/firstname_m.tsv"), delimiter='\t', header=0,
-                                          names=['firstname', 'gender', 'occurrences'])
-        self.df_lastname = pd.read_csv(Path(__file__).parent.joinpath("data/lastname.tsv"), delimiter='\t', header=0,
-                                       names=['lastname', 'occurrences'])
+        super().__init__(seed_sequence, pool_size)
+        self.reference_date = reference_date
 
     def _Pool__replenish_pool(self):
         # logger.info("Replenishing teacher pool")
+        self.pool = self.factory.teachers(self.pool_size, self.rng, reference_date=self.reference_date)
+        self.cursor = 0
 
-        def age_to_date(age):
-            (d, i) = math.modf(age)
-            age = int(i)
-            if not (23 <= age <= 67):  # enforcing age bounds
-                if age < 23:
-                    age = age + (23 - age)
-                else:
-                    age = age - (age - 67)
-            days = int(365 * d)
-            today = datetime.datetime.today()
-            birthyear = today.year - age
-            dob = datetime.datetime(birthyear, 1, 1) + datetime.timedelta(days=days)
-            if (today.month, today.day) < (dob.month, dob.day):
-                try:
-                    dob = dob.replace(year=dob.year - 1)
-                except:
-                    # In the case of bisextile year
-                    logger.error("Date out of bound: {}".format(dob))
-                    dob = dob.replace(day=28)
-                    dob = dob.replace(year=dob.year - 1)
-            return dob
-
-        # Set simulation parameters
-        pool_size = 30
-        gender_f_pct = 0.85
-        age_mean = 45
-        age_stddev = 10
-
-        # Simulate staff
-        # logger.info("Creating teacher dob pool array")
-        s_age = np.random.normal(age_mean, age_stddev, pool_size)
-        s_dob = np.array(list(map(age_to_date, s_age)))
-
-        # logger.info("Creating teacher gender pool array")
-        s_gender_binomial = np.random.binomial(1, gender_f_pct, pool_size)
-        s_gender = np.where(s_gender_binomial == 1, 'f', 'm')
-
-        # logger.info("Creating teacher lastname pool array")
-        s_lastname = self.df_lastname.sample(n=pool_size, replace=True, weights='occurrences', ignore_index=True)
-        lastnames = s_lastname['lastname'].to_numpy()
-
-        # logger.info("Creating teacher firstname pool array")
-        s_firstname_f = self.df_firstname_f.sample(n=pool_size, replace=True, weights='occurrences', ignore_index=False)
-        s_firstname_m = self.df_firstname_m.sample(n=pool_size, replace=True, weights='occurrences', ignore_index=False)
-        firstnames_m = s_firstname_m['firstname'].to_numpy()
-        firstnames_f = s_firstname_f['firstname'].to_numpy()
-
-        firstnames = np.where(s_gender == 'f', firstnames_f, firstnames_m)
-
-        np_people = list(zip(firstnames, lastnames, s_gender, s_dob))
-
-        # logger.info("Creating teacher pool")
-        for row in np_people:
-            self.pool.append(Teacher(firstname=row[0], lastname=row[1], dob=row[3], gender=row[2]))
-
-    def pop(self):
-        """Retourne une personne enseignante non-spécialiste dans le bassin.
-
-        :return: une personne enseignante non-spécialiste dans le bassin.
-        """
-        if len(self.pool) == 0:
-            self._Pool__replenish_pool()
-        return self.pool.pop()
+    def _build(self, idx):
+        pool = self.pool
+        return Teacher(firstname=pool["firstname"][idx], lastname=pool["lastname"][idx],
+                       dob=pool["dob"][idx].item(), gender=str(pool["gender"][idx]), uid=pool["uid"][idx],
+                       experience=int(pool["experience"][idx]), success_factor=float(pool["success_factor"][idx]))
 
 
 class StudentPool(Pool):
@@ -286,61 +410,23 @@ class StudentPool(Pool):
     """
     db = None
 
-    def __init__(self):
+    def __init__(self, seed_sequence=None, pool_size=50):
         """Initialise le bassin d'élèves.
 
+        :param seed_sequence: la séquence de germes du bassin.
+        :param pool_size: le nombre d'élèves générés à chaque réapprovisionnement.
         """
-        super(Pool, self).__init__()
-        self.pool = []
-        self.df_firstname_f = pd.read_csv(Path(__file__).parent.joinpath("data/firstname_f.tsv"), delimiter='\t', header=0,
-                                          names=['firstname', 'gender', 'occurrences'])
-        self.df_firstname_m = pd.read_csv(Path(__file__).parent.joinpath("data/firstname_m.tsv"), delimiter='\t', header=0,
-                                          names=['firstname', 'gender', 'occurrences'])
-        self.df_lastname = pd.read_csv(Path(__file__).parent.joinpath("data/lastname.tsv"), delimiter='\t', header=0,
-                                       names=['lastname', 'occurrences'])
-
-    def _Pool__replenish_pool(self, age=None, pool_size=50, gender_f_pct=0.53543):
-        # logger.info("Replenishing student pool")
+        super().__init__(seed_sequence, pool_size)
 
-        # Simulate staff
-        # logger.info("Creating student dob pool array with age in 6th grade")
-        start_date = datetime.date(2009, 10, 1)
-        end_date = datetime.date(2010, 9, 30)
-        days_span = (end_date - start_date).days
-
-        def to_dob(days_offset):
-            return start_date + datetime.timedelta(days=days_offset)
-
-        s_dob = random.sample(range(0, days_span), 30)
-        s_dob = list(map(to_dob, s_dob))
-
-        # logger.info("Creating student gender pool array")
-        s_gender_binomial = np.random.binomial(1, gender_f_pct, pool_size)
-        s_gender = np.where(s_gender_binomial == 1, 'f', 'm')
-
-        # logger.info("Creating student lastname pool array")
-        s_lastname = self.df_lastname.sample(n=pool_size, replace=True, weights='occurrences', ignore_index=True)
-        lastnames = s_lastname['lastname'].to_numpy()
-
-        # logger.info("Creating student firstname pool array")
-        s_firstname_f = self.df_firstname_f.sample(n=pool_size, replace=True, weights='occurrences', ignore_index=False)
-        s_firstname_m = self.df_firstname_m.sample(n=pool_size, replace=True, weights='occurrences', ignore_index=False)
-        firstnames_m = s_firstname_m['firstname'].to_numpy()
-        firstnames_f = s_firstname_f['firstname'].to_numpy()
-
-        firstnames = np.where(s_gender == 'f', firstnames_f, firstnames_m)
-
-        np_people = list(zip(firstnames, lastnames, s_gender, s_dob))
-
-        # logger.info("Creating student pool")
-        for (firsname, lastname, gender, dob) in np_people:
-            self.pool.append(Student(firstname=firsname, lastname=lastname, dob=dob, gender=gender))
-
-    def pop(self):
-        """Retourne un élève
-
-        :return: un élève
-        """
-        if len(self.pool) == 0:
-            self._Pool__replenish_pool()
-        return self.pool.pop()
+    def _Pool__replenish_pool(self):
+        # logger.info("Replenishing student pool")
+        self.pool = self.factory.students(self.pool_size, self.rng)
+        self.cursor = 0
+
+    def _build(self, idx):
+        pool = self.pool
+        return Student(firstname=pool["firstname"][idx], lastname=pool["lastname"][idx],
+                       dob=pool["dob"][idx].item(), gender=str(pool["gender"][idx]), uid=pool["uid"][idx],
+                       success_factor=float(pool["success_factor"][idx]),
+                       success_variability=float(pool["success_variability"][idx]),
+                       success_year_trend=float(pool["success_year_trend"][idx]))
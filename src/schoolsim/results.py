@@ -0,0 +1,324 @@
+import datetime
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EVALUATION_TYPES = ('exercices', 'devoir', 'quiz', 'examen')
+
+
+class Codebook(object):
+    """Définit un dictionnaire de codes entiers pour une colonne catégorielle (ex. personne enseignante, date).
+
+    """
+
+    def __init__(self, values=()):
+        """Initialise le dictionnaire de codes.
+
+        :param values: les valeurs initiales, codées dans l'ordre.
+        """
+        self.values = []
+        self.codes = {}
+        for value in values:
+            self.encode(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        """Retourne le code entier d'une valeur, en l'ajoutant au besoin.
+
+        :param value: la valeur à coder.
+        :return: le code entier de la valeur.
+        """
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def encode_all(self, values):
+        """Retourne les codes entiers d'une séquence de valeurs.
+
+        :param values: les valeurs à coder.
+        :return: le tableau des codes entiers.
+        """
+        return np.fromiter((self.encode(value) for value in values), np.int32)
+
+    def decode_all(self, codes):
+        """Retourne les valeurs correspondant à une séquence de codes entiers.
+
+        :param codes: les codes entiers.
+        :return: la liste des valeurs.
+        """
+        values = self.values
+        return [values[code] for code in codes]
+
+
+class ResultStore(object):
+    """Définit le registre columnaire des résultats d'évaluation de la simulation. Chaque évaluation d'un élève
+    occupe une rangée; les colonnes numériques sont des tableaux NumPy préalloués, les colonnes catégorielles
+    (type d'évaluation, personne enseignante, élève) sont des codes entiers et les dates sont des ordinaux.
+
+    """
+
+    def __init__(self, capacity=0):
+        """Initialise le registre des résultats.
+
+        :param capacity: le nombre de rangées à préallouer.
+        """
+        self.size = 0
+        self.capacity = 0
+        self.evaluation_types = Codebook(EVALUATION_TYPES)
+        self.teachers = Codebook()
+        self.students = Codebook()
+        self.columns = {
+            "student": np.empty(0, np.int32),
+            "topic_id": np.empty(0, np.int16),
+            "teacher": np.empty(0, np.int32),
+            "evaluation_id": np.empty(0, np.int16),
+            "evaluation_type": np.empty(0, np.int8),
+            "evaluation_date": np.empty(0, np.int32),
+            "evaluation_score": np.empty(0, np.float64),
+            "evaluation_total": np.empty(0, np.int16),
+            "evaluation_pct": np.empty(0, np.float64),
+            "evaluation_weight": np.empty(0, np.float64),
+            "evaluation_duration": np.empty(0, np.int16),
+            "evaluation_is_retake": np.empty(0, np.bool_),
+        }
+        self.reserve(capacity)
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, capacity):
+        """Assure que le registre peut contenir au moins le nombre de rangées demandé.
+
+        :param capacity: le nombre total de rangées requis.
+        :return:
+        """
+        if capacity <= self.capacity:
+            return
+        logger.debug("Results, reserving {} rows".format(capacity))
+        for name, column in self.columns.items():
+            resized = np.empty(capacity, column.dtype)
+            resized[:self.size] = column[:self.size]
+            self.columns[name] = resized
+        self.capacity = capacity
+
+    def allocate(self, rows):
+        """Réserve un intervalle contigu de rangées à la fin du registre.
+
+        :param rows: le nombre de rangées à réserver.
+        :return: l'indice de la première rangée réservée.
+        """
+        start = self.size
+        if start + rows > self.capacity:
+            logger.debug("Results, capacity of {} rows exceeded".format(self.capacity))
+            self.reserve(max(start + rows, 2 * self.capacity))
+        self.size = start + rows
+        return start
+
+    def write_block(self, index, student_uids, topic_id, teacher_uid, evaluation_ids, evaluation_types,
+                    evaluation_dates, evaluation_scores, evaluation_totals, evaluation_pct, evaluation_weights,
+                    evaluation_durations, evaluation_is_retake):
+        """Écrit un bloc élèves × évaluations de résultats aux rangées désignées.
+
+        :param index: la matrice (élèves × évaluations) des indices de rangées.
+        :param student_uids: les identifiants des élèves, un par ligne du bloc.
+        :param topic_id: l'identifiant de la matière scolaire.
+        :param teacher_uid: l'identifiant de la personne enseignante.
+        :param evaluation_ids: les numéros des évaluations, un par colonne du bloc.
+        :param evaluation_types: les types d'évaluation, un par colonne du bloc.
+        :param evaluation_dates: les ordinaux des dates d'évaluation, un par colonne du bloc.
+        :param evaluation_scores: la matrice des notes.
+        :param evaluation_totals: les totaux des évaluations, un par colonne du bloc.
+        :param evaluation_pct: la matrice des pourcentages.
+        :param evaluation_weights: les pondérations, une par colonne du bloc.
+        :param evaluation_durations: les durées, une par colonne du bloc.
+        :param evaluation_is_retake: les indicateurs de reprise, un par colonne du bloc.
+        :return:
+        """
+        columns = self.columns
+        number_evaluations = len(evaluation_ids)
+        columns["student"][index] = self.students.encode_all(student_uids)[:, None]
+        columns["topic_id"][index] = topic_id
+        columns["teacher"][index] = self.teachers.encode(teacher_uid)
+        columns["evaluation_id"][index] = evaluation_ids
+        columns["evaluation_type"][index] = self.evaluation_types.encode_all(evaluation_types)
+        columns["evaluation_date"][index] = evaluation_dates
+        columns["evaluation_score"][index] = evaluation_scores
+        columns["evaluation_total"][index] = evaluation_totals
+        columns["evaluation_pct"][index] = evaluation_pct
+        columns["evaluation_weight"][index] = evaluation_weights
+        columns["evaluation_duration"][index] = evaluation_durations
+        columns["evaluation_is_retake"][index] = evaluation_is_retake[:number_evaluations]
+
+    def extend(self, other):
+        """Ajoute à la fin du registre les rangées d'un autre registre, en recodant ses colonnes catégorielles.
+
+        :param other: le registre des résultats à ajouter.
+        :return: le décalage des indices des rangées ajoutées.
+        """
+        offset = self.allocate(len(other))
+        codebooks = {"student": (self.students, other.students),
+                     "teacher": (self.teachers, other.teachers),
+                     "evaluation_type": (self.evaluation_types, other.evaluation_types)}
+        for name, column in self.columns.items():
+            values = other.column(name)
+            if name in codebooks:
+                (codebook, other_codebook) = codebooks[name]
+                values = codebook.encode_all(other_codebook.values)[values]
+            column[offset:self.size] = values
+        return offset
+
+    def column(self, name, start=0, stop=None):
+        """Retourne une tranche d'une colonne du registre, sans copie.
+
+        :param name: le nom de la colonne.
+        :param start: l'indice de la première rangée.
+        :param stop: l'indice suivant la dernière rangée.
+        :return: la tranche de la colonne.
+        """
+        return self.columns[name][start:self.size if stop is None else stop]
+
+    def rows(self, start, stop):
+        """Retourne les résultats décodés d'un intervalle de rangées sous forme de tuples
+        (élève, matière, personne enseignante, évaluation, type, date, note, total, pourcentage, pondération,
+        durée, reprise).
+
+        :param start: l'indice de la première rangée.
+        :param stop: l'indice suivant la dernière rangée.
+        :return: la liste des résultats.
+        """
+        columns = self.columns
+        return list(zip(self.students.decode_all(columns["student"][start:stop].tolist()),
+                        columns["topic_id"][start:stop].tolist(),
+                        self.teachers.decode_all(columns["teacher"][start:stop].tolist()),
+                        columns["evaluation_id"][start:stop].tolist(),
+                        self.evaluation_types.decode_all(columns["evaluation_type"][start:stop].tolist()),
+                        map(datetime.date.fromordinal, columns["evaluation_date"][start:stop].tolist()),
+                        columns["evaluation_score"][start:stop].tolist(),
+                        columns["evaluation_total"][start:stop].tolist(),
+                        columns["evaluation_pct"][start:stop].tolist(),
+                        columns["evaluation_weight"][start:stop].tolist(),
+                        columns["evaluation_duration"][start:stop].tolist(),
+                        columns["evaluation_is_retake"][start:stop].tolist()))
+
+    def nbytes(self):
+        """Retourne l'espace mémoire occupé par les colonnes du registre.
+
+        :return: le nombre d'octets des colonnes.
+        """
+        return sum(column.nbytes for column in self.columns.values())
+
+
+class ResultBatch(object):
+    """Définit un lot de la simulation en continu : les résultats d'évaluation d'une année scolaire d'une école,
+    avec les lignes des dimensions (groupes, matières, personnes enseignantes, élèves) qui s'y rapportent.
+
+    """
+
+    def __init__(self, css, school, school_year, results, state=None):
+        """Initialise le lot de résultats.
+
+        :param css: le centre de services scolaires.
+        :param school: l'école.
+        :param school_year: l'année scolaire.
+        :param results: le registre des résultats de l'année scolaire, les intervalles des groupes y font référence.
+        :param state: l'état des registres de l'école pour l'année scolaire (voir SimulatorRegistry.get_state), None
+            s'il n'est pas disponible.
+        """
+        self.css = css
+        self.school = school
+        self.school_year = school_year
+        self.results = results
+        self.state = state
+
+    def __len__(self):
+        return len(self.results) if self.results is not None else 0
+
+    @staticmethod
+    def iter_system(system, results, registry=None):
+        """Produit les lots de résultats d'un système scolaire déjà simulé, un par (école, année scolaire).
+
+        :param system: le système scolaire.
+        :param results: le registre des résultats auquel les intervalles des groupes font référence.
+        :param registry: les registres de la simulation, pour joindre leur état aux lots.
+        :return: un itérateur de lots de résultats.
+        """
+        for css in system.get_csss():
+            for school in css.get_schools():
+                for school_year in school.get_schoolyears():
+                    state = None
+                    if registry is not None:
+                        state = registry.get_state(css.id, school.id, school_year.school_year)
+                    yield ResultBatch(css, school, school_year, results, state)
+
+    def release(self):
+        """Libère les résultats du lot : les intervalles des groupes et des élèves de l'année scolaire sont effacés
+        et le registre des résultats n'est plus référencé par le lot.
+
+        :return:
+        """
+        for group in self.school_year.get_groups():
+            group.results = None
+            for student in group.get_students():
+                student.results.pop(self.school_year.school_year, None)
+        self.results = None
+
+    def get_calendar(self):
+        """Retourne le calendrier scolaire de l'année scolaire du lot.
+
+        :return: le calendrier scolaire.
+        """
+        return self.css.calendars[self.school_year.school_year]
+
+    def get_group_rows(self):
+        """Retourne les lignes de la dimension des groupes.
+
+        :return: la liste des tuples (groupe, css, nom du css, école, nom de l'école, milieu, année scolaire, niveau,
+            taille, effectif).
+        """
+        return [(group.id, self.css.id, self.css.name, self.school.id, self.school.name, self.school.milieu,
+                 self.school_year.school_year, group.grade, group.size, group.enrolment)
+                for group in self.school_year.get_groups()]
+
+    def get_teacher_rows(self):
+        """Retourne les lignes de la dimension des personnes enseignantes, une par matière de chaque groupe.
+
+        :return: la liste des tuples (identifiant, courriel, prénom, nom, date de naissance, genre).
+        """
+        return [(topic.teacher.uid, topic.teacher.uid + "@css.qc.ca", topic.teacher.firstname,
+                 topic.teacher.lastname, topic.teacher.dob, topic.teacher.gender)
+                for group in self.school_year.get_groups() for topic in group.get_topics()]
+
+    def get_topic_rows(self):
+        """Retourne les lignes de la dimension des matières, une par matière de chaque groupe.
+
+        :return: la liste des tuples (matière, nom, spécialité).
+        """
+        return [(topic.id, topic.name, topic.isSpeciality)
+                for group in self.school_year.get_groups() for topic in group.get_topics()]
+
+    def get_student_rows(self):
+        """Retourne les lignes de la dimension des élèves.
+
+        :return: la liste des tuples (identifiant, courriel, prénom, nom, date de naissance, genre, statut).
+        """
+        return [(student.uid, student.uid + "@css.qc.ca", student.firstname, student.lastname, student.dob,
+                 student.gender, student.status)
+                for group in self.school_year.get_groups() for student in group.get_students()]
+
+    def get_result_rows(self):
+        """Retourne les lignes des résultats décodés, précédées de leur contexte (css, école, année scolaire, groupe).
+
+        :return: la liste des tuples de résultats.
+        """
+        rows = []
+        for group in self.school_year.get_groups():
+            if group.results:
+                context = (self.css.id, self.school.id, self.school_year.school_year, group.id)
+                rows.extend(context + result for result in self.results.rows(*group.results))
+        return rows
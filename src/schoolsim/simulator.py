@@ -1,21 +1,44 @@
 import datetime
+import json
 import logging
 import random
+import shutil
 import traceback
 import time
 import numpy as np
 
-from operator import attrgetter
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-from . person import TeacherPool, StudentPool
-from . establishment import SchoolSystem
-from . helpers.database import DatabaseWriter
+from . agenda import get_calendar_registry, SchoolSchedule, SCHEDULE_DAYS
+from . person import Student, StudentPool, Teacher, TeacherPool
+from . establishment import School, SchoolSystem, TopicCatalog
+from . results import Codebook, ResultBatch, ResultStore
+from . streams import spawn, RandomStreams, STREAM_GROUPS, STREAM_STAFF, STREAM_STUDENTS
+from . helpers.database import BatchQueue, DatabaseWriter, RegistryState, ShardCatalog, LOAD_BULK, QUEUE_SIZE
+from . helpers.sqlscripters import SCHEMA_STANDARD
 
 FORMATTER = '%(asctime)s - %(levelname)s - %(message)s'
 logging.basicConfig(format=FORMATTER, level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+EVALUATIONS_BY_TOPIC = [25, 25, 10, 15, 12, 12, 12, 15, 15]  # Base number of evaluations by topic id
+STUDENT_TREND_MALE = -0.03 / 7.0  # minus 3% over 5 years
+STUDENT_TREND_FEMALE = 0.07 / 7.0  # plus 2% over 5 years
+ROLE_TITULAIRE = 'titulaire'
+ROLE_SPECIALIST = 'specialist'
+FULL_WORKLOAD = 1.0  # Full-time teaching task, see Topic.workload
+PHASE_STAFF = 'staff'
+PHASE_ENROLMENT = 'enrolment'
+PHASE_EVALUATIONS = 'evaluations'
+SIMULATION_PHASES = (PHASE_STAFF, PHASE_ENROLMENT, PHASE_EVALUATIONS)
+POOL_STAFF = 'staff'
+POOL_STUDENTS = 'students'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_MANIFEST = "manifest.json"
+SNAPSHOT_FILES = ("people", "system", "registry", "results")
+
 
 class Simulator(object):
     """
@@ -26,7 +49,12 @@ class Simulator(object):
     def __init__(self, **kwargs):
         """Initialise le simulateur à partir des paramètres de simulation
 
-        :param kwargs: level, nom, description, auteur, année de début et durée en années.
+        :param kwargs: level, nom, description, auteur, année de début, durée en années, nombre de processus
+            (workers), germe pseudo-aléatoire (seed) et mode en continu (streaming) : la simulation est alors
+            différée à la sauvegarde et les résultats sont écrits et libérés école par école. Un instantané est
+            écrit après chaque phase complétée si un répertoire d'instantané (checkpoint) est fourni, ou une fois les
+            écoles fusionnées si elles sont simulées en parallèle; voir resume. Les calendriers scolaires calculés
+            sont mis en cache dans le répertoire calendar_cache, s'il est fourni, pour les simulations suivantes.
         """
         logger.info("Simulation, initiating SchoolSim")
         self.id = random.getrandbits(128)
@@ -39,9 +67,22 @@ class Simulator(object):
         self.date = datetime.date.today()
         self.start_year = kwargs.get("sim_year_start", datetime.date.today().year)
         self.duration = kwargs.get("sim_year_duration", 1)
-        self.engine = SimulatorEngine()
-        self.system = self.engine.simulate(
-            **dict(kwargs.get("system_parameters", {}), start_year=self.start_year, duration=self.duration))
+        self.workers = kwargs.get("workers", 1)
+        if kwargs.get("calendar_cache"):
+            Path(kwargs.get("calendar_cache")).mkdir(parents=True, exist_ok=True)
+            get_calendar_registry().cache_dir = kwargs.get("calendar_cache")
+        self.engine = SimulatorEngine(workers=self.workers, seed=kwargs.get("seed"), start_year=self.start_year)
+        self.seed = self.engine.streams.seed
+        self.streaming = kwargs.get("streaming", False)
+        self.parameters = dict(kwargs.get("system_parameters", {}), start_year=self.start_year,
+                               duration=self.duration)
+        self.system = self.engine.system
+        if kwargs.get("checkpoint") and not self.streaming:
+            self.engine.checkpoint_handler = lambda: self.checkpoint(kwargs.get("checkpoint"))
+            if self.workers > 1 and kwargs.get("snapshot") is None:
+                logger.warning("Simulation, schools simulated by workers are checkpointed once all are merged")
+        if not self.streaming:
+            self.system = self.engine.simulate(snapshot=kwargs.get("snapshot"), **self.parameters)
 
 
     def __str__(self):
@@ -66,6 +107,34 @@ class Simulator(object):
         # TODO make this portable
         pass
 
+    def checkpoint(self, path):
+        """Écrit l'instantané binaire de la simulation (système scolaire, registres, résultats et avancement des
+        phases), voir SimulationSnapshot.
+
+        :param path: le chemin vers le répertoire de l'instantané.
+        :return:
+        """
+        if self.streaming:
+            logger.error("Could not checkpoint a streaming simulation, its results are not kept")
+            return
+        SimulationSnapshot.write(self, path)
+
+    @staticmethod
+    def resume(path, **kwargs):
+        """Reprend une simulation à partir de son instantané : les phases complétées sont restaurées et les phases
+        restantes sont simulées. Un instantané complet permet de recharger une simulation sans la refaire.
+
+        :param path: le chemin vers le répertoire de l'instantané.
+        :param kwargs: les paramètres du simulateur à remplacer (ex. nombre de processus, checkpoint).
+        :return: le simulateur.
+        """
+        logger.info("Simulation, resuming from snapshot {}".format(path))
+        snapshot = SimulationSnapshot.read(path)
+        simulator = Simulator(**dict(snapshot.manifest["simulator"], snapshot=snapshot, **kwargs))
+        simulator.id = int(snapshot.manifest["id"])
+        simulator.ts = snapshot.manifest["ts"]
+        return simulator
+
     def save_to_txt(self, filepath=None):
         """Sauvegarde sous une forme textuelle la simulation du système scolaire.
 
@@ -96,33 +165,120 @@ class Simulator(object):
             Path(filepath).unlink()  # Delete if db exists
         except:
             try:
-                database = DatabaseWriter(filepath, self.system, 'olap')
+                database = DatabaseWriter(filepath, self.system, 'olap', results=self.engine.results)
             except:
                 logger.error("Could not save OLAP data model to database")
 
 
 
-    def save_to_sqlite(self, filepath=None):
+    def save_to_sqlite(self, filepath=None, load_mode=LOAD_BULK, schema=SCHEMA_STANDARD, pipelined=False,
+                       queue_size=QUEUE_SIZE, shards=0, append=False):
         """Stub: Sauvegarde les données de simulation dans une base de données au format OLAP.
 
         :param filepath: le chemin vers le fichier de la base de données.
+        :param load_mode: le mode de chargement de la base de données, voir DatabaseWriter.
+        :param schema: la variante du schéma de la base de données, voir SqliteScripter.
+        :param pipelined: vrai pour écrire la base de données dans un fil d'exécution dédié pendant la simulation
+            des écoles suivantes (mode en continu seulement).
+        :param queue_size: le nombre maximal de lots en attente d'écriture en mode pipeline.
+        :param shards: le nombre de fragments de la base de données, 0 pour un seul fichier; le fichier est alors le
+            catalogue des fragments, voir ShardCatalog.
+        :param append: vrai pour ajouter à une base de données existante les années scolaires qui n'y sont pas encore
+            (mode en continu seulement); l'état des registres y est lu de sorte que seules les nouvelles années soient
+            simulées. Le germe de la simulation d'origine doit être fourni pour reproduire ses évaluations. Le schéma
+            de la base de données existante est conservé et un ajout qui échoue la laisse inchangée.
         :return:
         """
         if not filepath:
             filepath = "~/simulation" + self.ts +  ".sqlite"
             logger.debug("Creating default database {}".format(filepath))
 
-        try:
-            Path(filepath).unlink()  # Delete if db exists
-        except:
-            pass # ignore if file is present
+        if append and not self.streaming:
+            logger.error("Appending to a database requires a streaming simulation")
+            return
+        append = append and Path(filepath).exists()
+        if not append:
+            try:
+                Path(filepath).unlink()  # Delete if db exists
+            except:
+                pass # ignore if file is present
 
         try:
-            database = DatabaseWriter(filepath, self.system, model_type='olap')
+            if append:
+                # Only the school years missing from the database are simulated, from its registry state
+                database = DatabaseWriter(filepath, None, model_type='olap', load_mode=load_mode, schema=schema,
+                                          batches=self.engine.iter_batches(state=RegistryState.read(filepath),
+                                                                           **self.parameters),
+                                          append=True)
+            elif shards:
+                self.__save_shards(filepath, load_mode, schema, shards)
+            elif self.streaming and pipelined:
+                # Simulation in this thread, writes in the writer thread; put() blocks while the queue is full
+                batches = BatchQueue(queue_size)
+                batches.start(lambda queued: DatabaseWriter(filepath, None, model_type='olap', load_mode=load_mode,
+                                                            schema=schema, batches=queued, release_results=True))
+                try:
+                    for batch in self.engine.iter_batches(release=False, **self.parameters):
+                        batches.put(batch)
+                finally:
+                    batches.close()
+            elif self.streaming:
+                # Schools are simulated while the database is written, each batch is released once written
+                database = DatabaseWriter(filepath, None, model_type='olap', load_mode=load_mode, schema=schema,
+                                          batches=self.engine.iter_batches(**self.parameters))
+            else:
+                database = DatabaseWriter(filepath, self.system, model_type='olap', results=self.engine.results,
+                                          load_mode=load_mode, schema=schema, registry=self.engine.registry)
         except:
             logger.error("Could not save OLAP data model to database")
             traceback.print_exc()
 
+    def __save_shards(self, filepath, load_mode, schema, shards):
+        """Sauvegarde les données de simulation dans une base de données répartie en fragments, les écoles étant
+        réparties à tour de rôle entre les fragments. En mode continu, chaque fragment est simulé et écrit par son
+        propre processus; sinon, les fragments sont écrits à partir de la simulation en mémoire.
+
+        :param filepath: le chemin vers la base de données du catalogue.
+        :param load_mode: le mode de chargement de la base de données, voir DatabaseWriter.
+        :param schema: la variante du schéma de la base de données, voir SqliteScripter.
+        :param shards: le nombre de fragments.
+        :return:
+        """
+        catalog = ShardCatalog(filepath)
+        schools = {}
+        css_lists = {}
+        school_list = [(css_parameters, school_parameters) for css_parameters in self.parameters.get("css_list", [])
+                       for school_parameters in css_parameters.get("school_list", [])]
+        for (idx, (css_parameters, school_parameters)) in enumerate(school_list):
+            shard = idx % shards
+            schools.setdefault(shard, []).append((css_parameters.get("id"), school_parameters.get("id")))
+            shard_css = css_lists.setdefault(shard, {})
+            if css_parameters.get("id") not in shard_css:
+                shard_css[css_parameters.get("id")] = dict(css_parameters, school_list=[])
+            shard_css[css_parameters.get("id")]["school_list"].append(school_parameters)
+        for shard in schools.keys():
+            try:
+                catalog.get_shard_filepath(shard).unlink()  # Delete if db exists
+            except:
+                pass  # ignore if file is absent
+        if self.streaming:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(write_shard, str(catalog.get_shard_filepath(shard)),
+                                           dict(self.parameters, css_list=list(css_lists[shard].values())),
+                                           self.seed, catalog.get_key_offset(shard), load_mode, schema,
+                                           get_calendar_registry().cache_dir)
+                           for shard in sorted(schools.keys())]
+                for future in futures:
+                    future.result()
+        else:
+            for (shard, shard_schools) in sorted(schools.items()):
+                batches = (batch for batch in ResultBatch.iter_system(self.system, self.engine.results,
+                                                                      self.engine.registry)
+                           if (batch.css.id, batch.school.id) in shard_schools)
+                DatabaseWriter(str(catalog.get_shard_filepath(shard)), None, model_type='olap', load_mode=load_mode,
+                               schema=schema, batches=batches, key_offset=catalog.get_key_offset(shard))
+        catalog.create(schools)
+
 
 class SimulatorEngine(object):
     """Définit le moteur de simulation.
@@ -131,216 +287,755 @@ class SimulatorEngine(object):
     cnx = None
     """Connexion à la base de données."""
 
-    def __init__(self):
+    def __init__(self, workers=1, seed=None, start_year=None):
         """Initialise le moteur de simulation.
 
+        :param workers: le nombre de processus simulant les écoles en parallèle, 1 pour une simulation séquentielle.
+        :param seed: le germe pseudo-aléatoire de la simulation, pour des simulations reproductibles.
+        :param start_year: l'année de début de la simulation, à laquelle l'âge des personnes générées est établi.
         """
         logger.debug("Simulation, instantiating simulation engine")
+        self.workers = workers
+        self.streams = RandomStreams(seed)
         self.staff_pool = []
         self.student_pool = []
         self.state = None
-        self.registry = SimulatorRegistry()
+        self.registry = SimulatorRegistry(self.streams, start_year)
         self.system = SchoolSystem()
+        self.catalog = TopicCatalog()
+        self.results = ResultStore()
+        self.pipeline = []  # Simulation phases of each css
+        self.checkpoint_handler = None  # Called after each completed phase, see Simulator.checkpoint
 
-    def simulate(self, **kwargs):
+    def simulate(self, snapshot=None, **kwargs):
         """Démarre la simulation et produit un système scolaire complet.
 
+        :param snapshot: l'instantané d'une simulation interrompue (voir SimulationSnapshot); les phases qui y sont
+            complétées sont restaurées plutôt que simulées.
         :param kwargs: les paramètres de la simulation.
         :return: le système scolaire.
         """
         logger.debug("Simulation, starting simulation")
-        random.seed()
+        if snapshot is not None:
+            snapshot.restore_engine(self)
+        self.results.reserve(len(self.results) + SimulatorEngine.estimate_results(**kwargs))
+        self.catalog = TopicCatalog(kwargs.get("topic_catalog", []))
+        if self.workers > 1 and snapshot is None:
+            return self.__simulate_sharded(**kwargs)
         for css_parameters in kwargs.get("css_list", []):
             self.__setup_infrastructure(**dict(css_parameters, start_year=kwargs.get("start_year"),
                                                duration=kwargs.get("duration")))
-            self.__simulate_staff()
-            self.__simulate_enrolment()
-            self.__simulate_evaluations()
+            if snapshot is not None:
+                snapshot.restore_css(self, self.pipeline[-1])
+                if self.workers > 1 and self.pipeline[-1].get_pending():
+                    logger.warning("Simulation, resuming pending phases of css {} sequentially".format(
+                        self.pipeline[-1].css.id))
+            self.__run_pipeline()
             # TODO build assiduity fact table w/r to grades
             # print(self.system)  # Prints to file from main
         return self.system
 
+    def iter_batches(self, release=True, state=None, **kwargs):
+        """Simule le système scolaire une année scolaire d'une école à la fois et produit un lot de résultats par
+        (école, année scolaire). Les écoles ne sont pas conservées dans le système scolaire; une fois le lot consommé,
+        ses résultats et les références des élèves vers ceux-ci sont libérés, et les registres d'une école sont vidés
+        lorsque sa dernière année est produite. La mémoire requise dépend ainsi de la plus grande école.
+
+        :param release: vrai pour libérer chaque lot une fois consommé, faux si le consommateur libère lui-même les
+            lots (ex. écriture dans un autre fil d'exécution).
+        :param state: l'état des registres d'une simulation sauvegardée (voir RegistryState); les années scolaires
+            déjà simulées sont alors ignorées et les suivantes reprennent le personnel, les élèves et les bassins.
+        :param kwargs: les paramètres de la simulation.
+        :return: un itérateur de lots de résultats.
+        """
+        logger.debug("Simulation, starting streaming simulation")
+        self.catalog = TopicCatalog(kwargs.get("topic_catalog", []))
+        if state is not None:
+            self.registry.restore(state)
+        for css_parameters in kwargs.get("css_list", []):
+            css_parameters = dict(css_parameters, start_year=kwargs.get("start_year"), duration=kwargs.get("duration"))
+            self.__setup_infrastructure(**dict(css_parameters, school_list=[]))
+            css = self.system.get_csss()[-1]
+            for school_parameters in css_parameters.get("school_list", []):
+                school = School(**dict(school_parameters, catalog=self.catalog))
+                self.registry.set_pool_demand(css.id, school.id, *SimulatorEngine.estimate_demand(school))
+                idx_yr = 0
+                for school_year in sorted(school.get_schoolyears(), key=lambda d: d.school_year):
+                    if state is not None and state.is_simulated(css.id, school.id, school_year.school_year):
+                        continue
+                    results = ResultStore()
+                    self.__staff_school_year(css, school, school_year)
+                    self.__enrol_school_year(css, school, school_year)
+                    self.__evaluate_school_year(css, school, school_year, idx_yr, results)
+                    batch = ResultBatch(css, school, school_year, results,
+                                        self.registry.get_state(css.id, school.id, school_year.school_year))
+                    yield batch
+                    if release:
+                        batch.release()
+                self.registry.release(css.id, school.id)
+            for css_phases in self.pipeline:
+                for phase in css_phases.get_pending():
+                    css_phases.complete(phase)  # Simulated by batches
+
+    def __run_pipeline(self):
+        """Exécute les phases de simulation en attente de chaque centre de services scolaires, de sorte que chaque
+        phase ne traite qu'une fois l'infrastructure ajoutée depuis sa dernière exécution.
+
+        :return:
+        """
+        phase_methods = {PHASE_STAFF: self.__simulate_staff,
+                         PHASE_ENROLMENT: self.__simulate_enrolment,
+                         PHASE_EVALUATIONS: self.__simulate_evaluations}
+        for css_phases in self.pipeline:
+            for phase in css_phases.get_pending():
+                phase_methods[phase](css_phases.css)
+                css_phases.complete(phase)
+                if self.checkpoint_handler is not None:
+                    self.checkpoint_handler()
+
+    def __simulate_sharded(self, **kwargs):
+        """Simule les écoles en parallèle dans un bassin de processus, puis fusionne les écoles et leurs résultats
+        dans le système scolaire. Les écoles d'un centre de services scolaires sont indépendantes une fois les
+        calendriers établis; chaque processus dispose de ses propres registres et bassins de personnes.
+
+        :param kwargs: les paramètres de la simulation.
+        :return: le système scolaire.
+        """
+        logger.debug("Simulation, simulating schools with {} workers".format(self.workers))
+        start_time = time.time()
+        shards = []
+        for css_parameters in kwargs.get("css_list", []):
+            css_parameters = dict(css_parameters, start_year=kwargs.get("start_year"), duration=kwargs.get("duration"))
+            self.__setup_infrastructure(**dict(css_parameters, school_list=[]))
+            css = self.system.get_csss()[-1]
+            for school_parameters in css_parameters.get("school_list", []):
+                shards.append((css, dict(css_parameters, school_list=[school_parameters])))
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            simulated = executor.map(simulate_school, [shard_parameters for (css, shard_parameters) in shards],
+                                     [self.streams.seed] * len(shards),
+                                     [kwargs.get("topic_catalog", [])] * len(shards),
+                                     [get_calendar_registry().cache_dir] * len(shards))
+            for ((css, shard_parameters), (school, results, registry)) in zip(shards, simulated):
+                self.__merge_school(css, school, results, registry)
+        for css_phases in self.pipeline:
+            for phase in css_phases.get_pending():
+                css_phases.complete(phase)  # Simulated by the workers
+        if self.checkpoint_handler is not None:
+            self.checkpoint_handler()
+        logger.debug("Simulation, {} schools simulated in {} sec.".format(len(shards), time.time() - start_time))
+        return self.system
+
+    def __merge_school(self, css, school, results, registry):
+        offset = self.results.extend(results)
+        self.registry.merge(registry)
+        students = {}
+        for school_year in school.get_schoolyears():
+            for group in school_year.get_groups():
+                if group.results:
+                    group.results = (group.results[0] + offset, group.results[1] + offset)
+                for student in group.get_students():
+                    students[id(student)] = student
+        for student in students.values():
+            student.results = {school_year: (start + offset, stop + offset) for (school_year, (start, stop)) in
+                               student.results.items()}
+        css.schools.append(school)
+
+    @staticmethod
+    def estimate_results(**kwargs):
+        """Estime à partir de la configuration le nombre maximal de résultats d'évaluation de la simulation.
+
+        :param kwargs: les paramètres de la simulation.
+        :return: le nombre maximal de résultats d'évaluation.
+        """
+        capacity = 0
+        for css_parameters in kwargs.get("css_list", []):
+            for school_parameters in css_parameters.get("school_list", []):
+                for school_year_parameters in school_parameters.get("school_year_list", []):
+                    for group_parameters in school_year_parameters.get("group_list", []):
+                        capacity += group_parameters.get("size", 0) * sum(
+                            EVALUATIONS_BY_TOPIC[topic["id"] - 1] + 3 for topic in
+                            group_parameters.get("topic_list", []))
+        return capacity
+
+    @staticmethod
+    def estimate_demand(school):
+        """Estime le nombre de personnes enseignantes et d'élèves à générer pour une école, en tenant compte de la
+        reconduction du personnel et de la promotion des cohortes d'une année à l'autre.
+
+        :param school: l'école.
+        :return: le nombre de personnes enseignantes et le nombre d'élèves à générer.
+        """
+        staff = 0
+        students = 0
+        specialities = set()
+        previous_groups = 0
+        previous_seats = {}
+        for school_year in sorted(school.get_schoolyears(), key=lambda d: d.school_year):
+            seats = {}
+            for group in school_year.get_groups():
+                seats[group.grade] = seats.get(group.grade, 0) + group.size
+                specialities.update(topic.name for topic in group.get_topics() if topic.isSpeciality)
+            staff += max(0, len(school_year.get_groups()) - previous_groups)
+            students += sum(max(0, size - previous_seats.get(grade - 1, 0)) for (grade, size) in seats.items())
+            previous_groups = len(school_year.get_groups())
+            previous_seats = seats
+        return staff + len(specialities), students
+
     def __setup_infrastructure(self, **kwargs):
         logger.debug("Simulation, generating infrastructure")
         start_time = time.time()
-        self.system.add_css(**kwargs)  # Refer to Configurator for dict structure
+        self.system.add_css(**dict(kwargs, catalog=self.catalog))  # Refer to Configurator for dict structure
+        css = self.system.get_csss()[-1]
+        for school in css.get_schools():
+            self.registry.set_pool_demand(css.id, school.id, *SimulatorEngine.estimate_demand(school))
+        self.pipeline.append(SimulationPhases(css))
         logger.debug("Simulation, infrastructure simulated in {} sec.".format(time.time() - start_time))
 
-    def __simulate_enrolment(self):
+    def __simulate_enrolment(self, css):
         logger.debug("Simulation, simulating student enrolment")
         student_cnt = 0
         start_time = time.time()
-        for css in self.system.get_csss():
-            css_id = css.id
-            for school in css.get_schools():
-                school_id = school.id
-                for school_year in school.get_schoolyears():
-                    school_year_name = school_year.school_year
-                    for group in school_year.get_groups():
-                        logger.debug(
-                            "Simulation, enrolling students to group for css {}, school {} school year {}".format(
-                                css_id, school_id, school_year_name))
-                        while (group.size - group.enrolment) >= 1:
-                            student = self.registry.get_student(css_id, school_id, group, school_year_name)
-                            group.add_student(student)
-                            student_cnt += 1
+        for school in css.get_schools():
+            for school_year in sorted(school.get_schoolyears(), key=lambda d: d.school_year):
+                student_cnt += self.__enrol_school_year(css, school, school_year)
         logger.debug("Simulation, {} students simulated in {} sec.".format(student_cnt, time.time() - start_time))
 
-    def __simulate_staff(self):
+    def __enrol_school_year(self, css, school, school_year):
+        student_cnt = 0
+        school_year_name = school_year.school_year
+        for grade in sorted({group.grade for group in school_year.get_groups()}):
+            self.registry.promote_cohort(css.id, school.id, school_year_name, grade)
+        for group in school_year.get_groups():
+            logger.debug(
+                "Simulation, enrolling students to group for css {}, school {} school year {}".format(
+                    css.id, school.id, school_year_name))
+            while (group.size - group.enrolment) >= 1:
+                student = self.registry.get_student(css.id, school.id, group, school_year_name)
+                group.add_student(student)
+                student_cnt += 1
+        self.registry.save_pool_position(css.id, school.id, school_year_name, POOL_STUDENTS)
+        return student_cnt
+
+    def __simulate_staff(self, css):
         logger.debug("Simulation, simulating course staff")
         start_time = time.time()
         staff_cnt = 0
-        for css in self.system.get_csss():
-            css_id = css.id
-            for school in css.get_schools():
-                school_id = school.id
-                logger.debug("School Year list size is {}".format(len(school.get_schoolyears())))
-                for school_year in school.get_schoolyears():
-                    # logger.warning("School Year: {}".format(school_year))
-                    school_year_name = school_year.school_year
-                    for group in school_year.get_groups():
-                        titulaire = self.registry.get_titulaire(css_id, school_id, school_year_name, group.grade)
-                        group.set_staff(titulaire)
-                        logger.debug("Simulation, staffing group {} with titulaire {}".format(group.id, titulaire.uid))
-                        for topic in group.get_topics():
-                            logger.debug("Simulation, staffing topics with teachers")
-                            if topic.isSpeciality is False:
-                                teacher = titulaire
-                            else:
-                                teacher = self.registry.get_specialist(css_id, school_id, school_year_name, topic)
-                            topic.set_staff(teacher)
-                            staff_cnt += 1
+        for school in css.get_schools():
+            logger.debug("School Year list size is {}".format(len(school.get_schoolyears())))
+            for school_year in school.get_schoolyears():
+                staff_cnt += self.__staff_school_year(css, school, school_year)
         logger.debug("Simulation, {} staff members simulated in {} sec.".format(staff_cnt, time.time() - start_time))
 
-    def __simulate_evaluations(self):
+    def __staff_school_year(self, css, school, school_year):
+        staff_cnt = 0
+        school_year_name = school_year.school_year
+        for group in school_year.get_groups():
+            titulaire = self.registry.get_titulaire(css.id, school.id, school_year_name, group.grade)
+            group.set_staff(titulaire)
+            logger.debug("Simulation, staffing group {} with titulaire {}".format(group.id, titulaire.uid))
+            for topic in group.get_topics():
+                logger.debug("Simulation, staffing topics with teachers")
+                if topic.isSpeciality is False:
+                    teacher = titulaire
+                else:
+                    teacher = self.registry.get_specialist(css.id, school.id, school_year_name, topic)
+                topic.set_staff(teacher)
+                staff_cnt += 1
+        self.registry.save_pool_position(css.id, school.id, school_year_name, POOL_STAFF)
+        SimulatorEngine.schedule_school_year(school, school_year)
+        return staff_cnt
+
+    @staticmethod
+    def schedule_school_year(school, school_year):
+        """Construit l'horaire de l'année scolaire d'une école une fois le personnel affecté aux groupes.
+
+        :param school: l'école.
+        :param school_year: l'année scolaire.
+        :return: l'horaire de l'année scolaire.
+        """
+        schedule = SchoolSchedule(school.schedule_days or SCHEDULE_DAYS)
+        schedule.build(school_year.get_groups())
+        school_year.set_schedule(schedule)
+        return schedule
+
+    def __simulate_evaluations(self, css):
         logger.debug("Simulation, simulating evaluations for topics and students")
         start_time = time.time()
         evaluation_cnt = 0
         student_cnt = 0
-        student_trend_male = -0.03 / 7.0  # minus 3% over 5 years
-        student_trend_female = 0.07 / 7.0  # plus 2% over 5 years
-        # TODO scheduling: currently a naïve representation, replace with a real school day schedule
-        for css in self.system.get_csss():
-            css_sf = css.success_factor
-            css_sv = css.success_variability
-            logger.debug(css.calendars.keys())
-            for school in css.get_schools():
-                school_sf = school.success_factor
-                school_sv = school.success_variability
-                idx_yr = 0
-                for school_year in sorted(school.get_schoolyears(), key=lambda d: d.school_year):
-                    logger.debug("Processing school year: {}".format(school_year.school_year))
-                    calendar = css.calendars[school_year.school_year]
-                    for group in school_year.get_groups():
-                        # TODO evaluation : currently a bonified randomized evaluation scheme,
-                        #  replace with a real school day evaluation schedule
-                        # TODO scheduling: currently a random school day schedule based on
-                        #  number of hours by topic and 10 day schedule, replace with a real school day schedule
-                        # if topic_number in (1, 2):
-                        #     schedule_days = list(range(1, 11))
-                        # elif topic_number in (3, 5, 8, 9):
-                        #     schedule_days = sorted(random.sample(range(1, 11), 4))
-                        # else:
-                        #     schedule_days = sorted(random.sample(range(1, 11), 2))
-
-                        # Randomize the number of evaluation from one group to another : prof variability
-                        group_sf = group.success_factor
-                        group_sv = group.success_variability
-                        for topic in group.get_topics():
-                            # TODO manage calendar for evaluation dates
-                            topic_id = topic.id
-                            topic_sf = topic.success_factor
-                            topic_sv = topic.success_variability
-                            teacher_sf = topic.teacher.success_factor
-                            teacher_sv = topic.teacher.success_variability
-
-                            number_evaluation_topic = [25, 25, 10, 15, 12, 12, 12, 15, 15]
-                            number_evaluations = random.randint(number_evaluation_topic[topic_id - 1] - 1,
-                                                                number_evaluation_topic[topic_id - 1] + 3)
-                            css_id_list = [css.id] * number_evaluations
-                            school_id_list = [school.id] * number_evaluations
-                            topic_id_list = [topic.id] * number_evaluations
-                            topic_teacher_list = [topic.teacher.uid] * number_evaluations
-                            evaluation_id_list = range(1, number_evaluations + 1)
-                            evaluation_types = []
-                            evaluation_dates = []
-                            evaluation_durations = []
-                            evaluation_totals = []
-                            evaluation_is_retake = [False] * number_evaluations  # Not currently used
-                            for evaluation_period in [10, 70, 130]:
-                                # These blocks correspond to evaluation period with respectif end at
-                                #  end of november, end of january and end of june base on calendar of 180 days
-                                if evaluation_period in (10, 70):
-                                    number_evaluation_period = number_evaluations // 3
-                                else:
-                                    number_evaluation_period = number_evaluations - (2 * (number_evaluations // 3))
-                                evaluation_types_temp = random.choices(('exercices', 'devoir', 'quiz'),
-                                                                       weights=(10, 10, 2),
-                                                                       k=(number_evaluation_period - 2))
-                                evaluation_types_temp.extend(('quiz', 'examen'))
-                                evaluation_types.extend(evaluation_types_temp)
-                                dates = sorted(random.sample(
-                                    calendar.schooldays[evaluation_period:evaluation_period + 48],
-                                    number_evaluation_period - 2), key=attrgetter('date'))
-                                dates.append(calendar.schooldays[evaluation_period + 48])  # Should be quiz
-                                dates.append(calendar.schooldays[evaluation_period + 49])  # Should be exam
-                                evaluation_dates.extend([item_date.date for item_date in dates])  # Keep only the date
-                                # TODO Move date to prior schedule date and sort dates, currently randomized
-                                for item in evaluation_types_temp:
-                                    if item in ('exercices', 'quiz'):
-                                        evaluation_durations.extend(random.sample(range(8, 25), 1))
-                                        evaluation_totals.extend(random.sample(range(15, 25), 1))
-                                    elif item in ('examen'):
-                                        evaluation_durations.extend(random.sample(range(15, 45), 1))
-                                        evaluation_totals.extend(random.sample(range(25, 75), 1))
-                                    else:
-                                        evaluation_durations.append(0)
-                                        evaluation_totals.extend(random.sample(range(10, 25), 1))
-                                    evaluation_is_retake.append(False)
-                            for student in group.get_students():
-                                # Trending can be inserted in config (success factor, success variability)
-                                # or be parametrized here as an ad hoc situation
-                                student_cnt += 1
-                                student_sf = student.success_factor
-                                student_sv = student.success_variability
-                                trend = student_trend_male if student.gender == 'm' else student_trend_female
-                                # Generating results based on :
-                                # Student performance, group effect, teacher effect, topic effect, general trend
-                                evaluation_results = np.random.normal(student_sf, student_sv,
-                                                                      number_evaluations) * \
-                                                     (1.0 + np.random.normal(group_sf, group_sv, 1)[0]) * \
-                                                     (1.0 + np.random.normal(teacher_sf, teacher_sv, 1)[0]) * \
-                                                     (1.0 + np.random.normal(topic_sf, topic_sv, 1)[0]) * (
-                                                             1.0 + student.success_year_trend) ** idx_yr * (
-                                                             (1 + trend) ** idx_yr)
-                                evaluation_cnt += number_evaluations
-                                evaluation_results = [
-                                    round(result, 3) if result <= 1.0 else round(result - 2 * (result - 1), 3) for
-                                    result in evaluation_results]
-                                evaluation_scores = [round(pct * total, 1) for (pct, total) in
-                                                     zip(evaluation_results, evaluation_totals)]
-                                evaluation_pct = [round(score / total, 2) for (score, total) in
-                                                  zip(evaluation_scores, evaluation_totals)]
-                                evaluation_weights = [round(total * 0.01, 2) for total in
-                                                      evaluation_totals]  # TODO improve weights
-
-                                # Generate evaluation tuples for the year
-                                try:
-                                    evaluation_scheme = zip(topic_id_list, topic_teacher_list, evaluation_id_list,
-                                                            evaluation_types, evaluation_dates, evaluation_scores,
-                                                            evaluation_totals, evaluation_pct, evaluation_weights,
-                                                            evaluation_durations, evaluation_is_retake)
-                                    student.results.extend(evaluation_scheme)
-
-                                except:
-                                    traceback.print_exc()
-                                    logger.warning(
-                                        "Simulation, failed to add evaluation")
-                idx_yr += 1  # For trending
+        logger.debug(css.calendars.keys())
+        for school in css.get_schools():
+            idx_yr = 0
+            for school_year in sorted(school.get_schoolyears(), key=lambda d: d.school_year):
+                (school_year_evaluation_cnt, school_year_student_cnt) = self.__evaluate_school_year(
+                    css, school, school_year, idx_yr, self.results)
+                evaluation_cnt += school_year_evaluation_cnt
+                student_cnt += school_year_student_cnt
+            idx_yr += 1  # For trending
         logger.debug(
             "Simulation, {} evaluations for {} students simulated in {} sec.".format(evaluation_cnt, student_cnt,
                                                                                      time.time() - start_time))
 
+    def __evaluate_school_year(self, css, school, school_year, idx_yr, results):
+        evaluation_cnt = 0
+        student_cnt = 0
+        logger.debug("Processing school year: {}".format(school_year.school_year))
+        calendar = css.calendars[school_year.school_year]
+        for group in school_year.get_groups():
+            # TODO evaluation : currently a bonified randomized evaluation scheme,
+            #  replace with a real school day evaluation schedule
+            # Randomize the number of evaluation from one group to another : prof variability
+            group_streams = self.streams.sequence(css.id, school.id, STREAM_GROUPS,
+                                                  int(school_year.school_year[0:4]), group.id)
+            generators = [np.random.default_rng(stream) for stream in
+                          group_streams.spawn(len(group.get_topics()))]
+            evaluation_schemes = [
+                self.__simulate_evaluation_scheme(
+                    calendar, topic, school_year.schedule.get_calendar_days(group.id, topic.id), rng)
+                for (topic, rng) in zip(group.get_topics(), generators)]
+            students = group.get_students()
+            student_uids = [student.uid for student in students]
+            # Rows are laid out student-major so that each student holds a contiguous range
+            number_rows = sum(len(scheme[0]) for scheme in evaluation_schemes)
+            start = results.allocate(len(students) * number_rows)
+            student_offsets = start + np.arange(len(students))[:, None] * number_rows
+            offset = 0
+            for (topic, evaluation_scheme, rng) in zip(group.get_topics(), evaluation_schemes, generators):
+                evaluation_scores, evaluation_pct = self.__simulate_evaluation_block(
+                    group, topic, students, evaluation_scheme, idx_yr, rng)
+                (evaluation_id_list, evaluation_types, evaluation_dates, evaluation_totals,
+                 evaluation_weights, evaluation_durations, evaluation_is_retake) = evaluation_scheme
+                number_evaluations = len(evaluation_id_list)
+                index = student_offsets + offset + np.arange(number_evaluations)
+                # Rows are already reserved and counted in the group and student ranges, a failure must not be skipped
+                results.write_block(index, student_uids, topic.id, topic.teacher.uid, evaluation_id_list,
+                                    evaluation_types, evaluation_dates, evaluation_scores, evaluation_totals,
+                                    evaluation_pct, evaluation_weights, evaluation_durations, evaluation_is_retake)
+                offset += number_evaluations
+                evaluation_cnt += evaluation_scores.size
+            student_cnt += len(students)
+            for idx, student in enumerate(students):
+                student_start = start + idx * number_rows
+                student.results[school_year.school_year] = (student_start, student_start + number_rows)
+            group.results = (start, start + len(students) * number_rows)
+        return evaluation_cnt, student_cnt
+
+    @staticmethod
+    def __simulate_evaluation_scheme(calendar, topic, schedule_days, rng):
+        """Produit le plan d'évaluation d'une matière pour un groupe, commun à tous les élèves du groupe. Les
+        évaluations ont lieu les jours où la matière est à l'horaire du groupe.
+
+        :param calendar: le calendrier scolaire.
+        :param topic: la matière scolaire.
+        :param schedule_days: les jours du cycle de l'horaire où la matière est enseignée au groupe.
+        :param rng: le générateur pseudo-aléatoire du bloc (groupe, matière).
+        :return: les colonnes du plan d'évaluation (identifiants, types, dates en ordinaux, totaux, pondérations,
+            durées, reprises).
+        """
+        number_evaluations = int(rng.integers(EVALUATIONS_BY_TOPIC[topic.id - 1] - 1,
+                                              EVALUATIONS_BY_TOPIC[topic.id - 1] + 3, endpoint=True))
+        evaluation_id_list = list(range(1, number_evaluations + 1))
+        evaluation_types = []
+        evaluation_dates = []
+        evaluation_durations = []
+        evaluation_totals = []
+        evaluation_is_retake = [False] * number_evaluations  # Not currently used
+        for (term, (term_days, taught_days)) in enumerate(zip(calendar.get_term_index(),
+                                                              calendar.get_term_index(schedule_days))):
+            # These blocks correspond to evaluation period with respectif end at
+            #  end of november, end of january and end of june base on calendar of 180 days
+            if term < 2:
+                number_evaluation_period = number_evaluations // 3
+            else:
+                number_evaluation_period = number_evaluations - (2 * (number_evaluations // 3))
+            evaluation_types_temp = rng.choice(('exercices', 'devoir', 'quiz'), p=(10 / 22, 10 / 22, 2 / 22),
+                                               size=(number_evaluation_period - 2)).tolist()
+            evaluation_types_temp.extend(('quiz', 'examen'))
+            evaluation_types.extend(evaluation_types_temp)
+            # Evaluations take place on the days the topic is taught, quiz and exam on the last two of them
+            days = taught_days if len(taught_days) >= number_evaluation_period else term_days
+            picks = np.sort(rng.choice(len(days) - 2, number_evaluation_period - 2, replace=False))
+            evaluation_dates.append(calendar.schoolday_ordinals[days[picks]])
+            evaluation_dates.append(calendar.schoolday_ordinals[days[-2:]])  # Should be quiz and exam
+            for item in evaluation_types_temp:
+                if item in ('exercices', 'quiz'):
+                    evaluation_durations.append(int(rng.integers(8, 25)))
+                    evaluation_totals.append(int(rng.integers(15, 25)))
+                elif item in ('examen'):
+                    evaluation_durations.append(int(rng.integers(15, 45)))
+                    evaluation_totals.append(int(rng.integers(25, 75)))
+                else:
+                    evaluation_durations.append(0)
+                    evaluation_totals.append(int(rng.integers(10, 25)))
+        evaluation_weights = [round(total * 0.01, 2) for total in evaluation_totals]  # TODO improve weights
+        return (evaluation_id_list, evaluation_types, np.concatenate(evaluation_dates), evaluation_totals, evaluation_weights,
+                evaluation_durations, evaluation_is_retake)
+
+    @staticmethod
+    def __simulate_evaluation_block(group, topic, students, evaluation_scheme, idx_yr, rng):
+        """Produit en une seule opération la matrice élèves × évaluations des résultats d'un bloc (groupe, matière).
+
+        :param group: le groupe scolaire.
+        :param topic: la matière scolaire.
+        :param students: la liste des élèves du groupe.
+        :param evaluation_scheme: le plan d'évaluation de la matière pour le groupe.
+        :param idx_yr: le rang de l'année scolaire dans la simulation, pour les tendances.
+        :param rng: le générateur pseudo-aléatoire du bloc (groupe, matière).
+        :return: les matrices des notes et des pourcentages (élèves × évaluations).
+        """
+        evaluation_totals = np.asarray(evaluation_scheme[3], dtype=float)
+        number_students = len(students)
+        shape = (number_students, 1)
+        student_sf = np.fromiter((student.success_factor for student in students), float, number_students)
+        student_sv = np.fromiter((student.success_variability for student in students), float, number_students)
+        student_yt = np.fromiter((student.success_year_trend for student in students), float, number_students)
+        # Trending can be inserted in config (success factor, success variability)
+        # or be parametrized here as an ad hoc situation
+        gender_trend = np.where([student.gender == 'm' for student in students], STUDENT_TREND_MALE,
+                                STUDENT_TREND_FEMALE) if number_students else np.zeros(0)
+        trend = ((1.0 + student_yt) ** idx_yr) * ((1.0 + gender_trend) ** idx_yr)
+        # Generating results based on :
+        # Student performance, group effect, teacher effect, topic effect, general trend
+        # Block effects are drawn once per student and broadcast over the evaluations
+        evaluation_results = rng.normal(student_sf[:, None], student_sv[:, None],
+                                        (number_students, evaluation_totals.size)) * \
+                             (1.0 + rng.normal(group.success_factor, group.success_variability, shape)) * \
+                             (1.0 + rng.normal(topic.teacher.success_factor, topic.teacher.success_variability,
+                                               shape)) * \
+                             (1.0 + rng.normal(topic.success_factor, topic.success_variability, shape)) * \
+                             trend[:, None]
+        # Results above 100% are reflected below 100%
+        evaluation_results = np.where(evaluation_results <= 1.0, evaluation_results,
+                                      2.0 - evaluation_results).round(3)
+        evaluation_scores = (evaluation_results * evaluation_totals).round(1)
+        evaluation_pct = (evaluation_scores / evaluation_totals).round(2)
+        return evaluation_scores, evaluation_pct
+
+
+def simulate_school(css_parameters, seed, topic_catalog=(), calendar_cache=None):
+    """Simule une école dans un moteur de simulation indépendant; sert de tâche au bassin de processus.
+
+    :param css_parameters: les paramètres du centre de services scolaires restreints à une seule école.
+    :param seed: le germe pseudo-aléatoire de la simulation.
+    :param topic_catalog: le catalogue des définitions des matières scolaires.
+    :param calendar_cache: le répertoire du cache sur disque des calendriers scolaires du processus parent.
+    :return: l'école simulée, le registre de ses résultats d'évaluation et les registres de ses personnes.
+    """
+    if calendar_cache:
+        get_calendar_registry().cache_dir = calendar_cache
+    engine = SimulatorEngine(seed=seed, start_year=css_parameters.get("start_year"))
+    system = engine.simulate(css_list=[css_parameters], start_year=css_parameters.get("start_year"),
+                             duration=css_parameters.get("duration"), topic_catalog=topic_catalog)
+    return system.get_csss()[0].get_schools()[0], engine.results, engine.registry
+
+
+def write_shard(filepath, parameters, seed, key_offset, load_mode=LOAD_BULK, schema=SCHEMA_STANDARD,
+                calendar_cache=None):
+    """Simule les écoles d'un fragment dans un moteur de simulation indépendant et les écrit au fil de l'eau dans la
+    base de données du fragment; sert de tâche au bassin de processus et permet de régénérer un seul fragment.
+
+    :param filepath: le chemin vers la base de données du fragment.
+    :param parameters: les paramètres de la simulation restreints aux écoles du fragment.
+    :param seed: le germe pseudo-aléatoire de la simulation.
+    :param key_offset: le décalage des clés de substitution du fragment, voir ShardCatalog.
+    :param load_mode: le mode de chargement de la base de données, voir DatabaseWriter.
+    :param schema: la variante du schéma de la base de données, voir SqliteScripter.
+    :param calendar_cache: le répertoire du cache sur disque des calendriers scolaires du processus parent.
+    :return: le chemin vers la base de données du fragment.
+    """
+    if calendar_cache:
+        get_calendar_registry().cache_dir = calendar_cache
+    engine = SimulatorEngine(seed=seed, start_year=parameters.get("start_year"))
+    DatabaseWriter(filepath, None, model_type='olap', load_mode=load_mode, schema=schema,
+                   batches=engine.iter_batches(**parameters), key_offset=key_offset)
+    return filepath
+
+
+class SimulationPhases(object):
+    """Définit l'avancement des phases de simulation (personnel, inscriptions, évaluations) d'un centre de services
+    scolaires.
+
+    """
+
+    def __init__(self, css, phases=SIMULATION_PHASES):
+        """Initialise l'avancement des phases de simulation d'un centre de services scolaires.
+
+        :param css: le centre de services scolaires.
+        :param phases: les phases de simulation, dans l'ordre d'exécution.
+        """
+        self.css = css
+        self.phases = phases
+        self.completed = []
+
+    def get_pending(self):
+        """Retourne les phases de simulation qui restent à exécuter.
+
+        :return: la liste des phases en attente, dans l'ordre d'exécution.
+        """
+        return [phase for phase in self.phases if phase not in self.completed]
+
+    def complete(self, phase):
+        """Marque une phase de simulation comme exécutée.
+
+        :param phase: la phase de simulation.
+        :return:
+        """
+        logger.debug("Simulation, css {} completed phase {}".format(self.css.id, phase))
+        self.completed.append(phase)
+
+
+class SimulationSnapshot(object):
+    """Définit l'instantané binaire d'une simulation : un répertoire contenant un manifeste JSON (paramètres, germe,
+    phases complétées de chaque centre de services scolaires, avancement des bassins) et des colonnes NumPy (.npz)
+    pour les personnes, les affectations des groupes, les registres et les résultats d'évaluation. La structure du
+    système scolaire est reconstruite à partir des paramètres; seules les phases complétées y sont restaurées.
+
+    """
+
+    def __init__(self, manifest, arrays):
+        """Initialise l'instantané.
+
+        :param manifest: le manifeste de l'instantané.
+        :param arrays: les colonnes de l'instantané, par fichier.
+        """
+        self.manifest = manifest
+        self.arrays = arrays
+        self.teachers = []
+        self.students = []
+        self.system = {}
+
+    @staticmethod
+    def write(simulator, path):
+        """Écrit l'instantané d'une simulation; l'instantané précédent n'est remplacé qu'une fois le nouveau écrit.
+
+        :param simulator: le simulateur.
+        :param path: le chemin vers le répertoire de l'instantané.
+        :return:
+        """
+        start_time = time.time()
+        engine = simulator.engine
+        teachers = {}  # Position of each teacher by object identity, people are shared by groups and registries
+        students = {}
+
+        def position(person, people):
+            if person is None:
+                return -1
+            return people.setdefault(id(person), (len(people), person))[0]
+
+        completed = {css_phases.css.id: list(css_phases.completed) for css_phases in engine.pipeline}
+        css_entries = []
+        system = {"group_titulaire": [], "group_results_start": [], "group_results_stop": [],
+                  "group_students_offset": [0], "group_students": [], "topic_teacher": []}
+        for css in engine.system.get_csss():
+            entry = {"id": css.id, "phases": completed.get(css.id, []), "groups": len(system["group_titulaire"]),
+                     "topics": len(system["topic_teacher"])}
+            for school in css.get_schools():
+                for school_year in school.get_schoolyears():
+                    for group in school_year.get_groups():
+                        (start, stop) = group.results or (-1, -1)
+                        system["group_titulaire"].append(position(group.titulaire, teachers))
+                        system["group_results_start"].append(start)
+                        system["group_results_stop"].append(stop)
+                        system["group_students"].extend(position(student, students)
+                                                        for student in group.get_students())
+                        system["group_students_offset"].append(len(system["group_students"]))
+                        system["topic_teacher"].extend(position(topic.teacher, teachers)
+                                                       for topic in group.get_topics())
+            css_entries.append(entry)
+
+        registry = engine.registry
+        staff = registry.staff_registry
+        student_index = [(key, student) for (key, index_students) in registry.student_index.items()
+                         for student in index_students]
+        registry_arrays = {
+            "staff_css_id": [assignment.css_id for assignment in staff],
+            "staff_school_id": [assignment.school_id for assignment in staff],
+            "staff_school_year": np.asarray([assignment.school_year for assignment in staff], dtype=str),
+            "staff_role": np.asarray([assignment.role for assignment in staff], dtype=str),
+            "staff_grade": [-1 if assignment.grade is None else assignment.grade for assignment in staff],
+            "staff_topic_name": np.asarray([assignment.topic_name or "" for assignment in staff], dtype=str),
+            "staff_workload": np.asarray([assignment.workload for assignment in staff], dtype=np.float64),
+            "staff_teacher": [position(assignment.teacher, teachers) for assignment in staff],
+            "student_css_id": [key[0] for (key, student) in student_index],
+            "student_school_id": [key[1] for (key, student) in student_index],
+            "student_school_year": np.asarray([key[2] for (key, student) in student_index], dtype=str),
+            "student_grade": [key[3] for (key, student) in student_index],
+            "student": [position(student, students) for (key, student) in student_index]}
+
+        teacher_list = [teacher for (idx, teacher) in sorted(teachers.values(), key=lambda item: item[0])]
+        student_list = [student for (idx, student) in sorted(students.values(), key=lambda item: item[0])]
+        student_results = [(idx, school_year, start, stop) for (idx, student) in enumerate(student_list)
+                           for (school_year, (start, stop)) in student.results.items()]
+        people = {"teacher_uid": np.asarray([teacher.uid for teacher in teacher_list], dtype=str),
+                  "teacher_firstname": np.asarray([teacher.firstname for teacher in teacher_list], dtype=str),
+                  "teacher_lastname": np.asarray([teacher.lastname for teacher in teacher_list], dtype=str),
+                  "teacher_gender": np.asarray([teacher.gender for teacher in teacher_list], dtype=str),
+                  "teacher_dob": np.asarray([teacher._dob for teacher in teacher_list], dtype=np.int32),
+                  "teacher_experience": np.asarray([teacher.experience for teacher in teacher_list], dtype=np.int32),
+                  "teacher_success_factor": np.asarray([teacher.success_factor for teacher in teacher_list],
+                                                       dtype=np.float64),
+                  "student_uid": np.asarray([student.uid for student in student_list], dtype=str),
+                  "student_firstname": np.asarray([student.firstname for student in student_list], dtype=str),
+                  "student_lastname": np.asarray([student.lastname for student in student_list], dtype=str),
+                  "student_gender": np.asarray([student.gender for student in student_list], dtype=str),
+                  "student_dob": np.asarray([student._dob for student in student_list], dtype=np.int32),
+                  "student_caseweight": np.asarray([student.caseweight for student in student_list], dtype=np.int32),
+                  "student_success_factor": np.asarray([student.success_factor for student in student_list],
+                                                       dtype=np.float64),
+                  "student_success_variability": np.asarray([student.success_variability for student in student_list],
+                                                            dtype=np.float64),
+                  "student_success_year_trend": np.asarray([student.success_year_trend for student in student_list],
+                                                           dtype=np.float64),
+                  "results_student": [idx for (idx, school_year, start, stop) in student_results],
+                  "results_school_year": np.asarray([school_year for (idx, school_year, start, stop) in
+                                                     student_results], dtype=str),
+                  "results_start": [start for (idx, school_year, start, stop) in student_results],
+                  "results_stop": [stop for (idx, school_year, start, stop) in student_results]}
+
+        results = {name: engine.results.column(name) for name in engine.results.columns.keys()}
+        results.update({"codebook_" + name: np.asarray(codebook.values, dtype=str) for (name, codebook) in
+                        (("students", engine.results.students), ("teachers", engine.results.teachers),
+                         ("evaluation_types", engine.results.evaluation_types))})
+
+        manifest = {"version": SNAPSHOT_VERSION,
+                    "simulator": {"sim_type": simulator.type, "sim_name": simulator.name,
+                                  "sim_description": simulator.description, "sim_author": simulator.author,
+                                  "sim_scenario": simulator.scenario, "sim_year_start": simulator.start_year,
+                                  "sim_year_duration": simulator.duration, "workers": simulator.workers,
+                                  "seed": simulator.seed, "system_parameters": simulator.parameters},
+                    "id": str(simulator.id),
+                    "ts": simulator.ts,
+                    "css": css_entries,
+                    "pools": registry.get_pools(),
+                    "pool_positions": [key + (popped,) for (key, popped) in registry.pool_positions.items()]}
+
+        # Written next to the previous snapshot, then swapped, so that an interruption leaves a usable snapshot
+        path = Path(path)
+        staging = path.with_name(path.name + ".tmp")
+        previous = path.with_name(path.name + ".old")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        for (name, arrays) in (("people", people), ("system", system), ("registry", registry_arrays),
+                               ("results", results)):
+            np.savez(staging.joinpath(name + ".npz"), **{key: np.asarray(value) for (key, value) in arrays.items()})
+        with open(staging.joinpath(SNAPSHOT_MANIFEST), "w", encoding='utf8') as fh:
+            json.dump(manifest, fh, ensure_ascii=False)
+        shutil.rmtree(previous, ignore_errors=True)
+        if path.exists():
+            path.rename(previous)  # read() falls back to the previous snapshot until the swap is done
+        staging.rename(path)
+        shutil.rmtree(previous, ignore_errors=True)
+        logger.debug("Simulation, snapshot written to {} in {} sec.".format(path, time.time() - start_time))
+
+    @staticmethod
+    def read(path):
+        """Lit l'instantané d'une simulation, ou l'instantané précédent si l'écriture du répertoire a été interrompue
+        pendant leur permutation.
+
+        :param path: le chemin vers le répertoire de l'instantané.
+        :return: l'instantané.
+        """
+        path = Path(path)
+        previous = path.with_name(path.name + ".old")
+        if not path.joinpath(SNAPSHOT_MANIFEST).exists() and previous.joinpath(SNAPSHOT_MANIFEST).exists():
+            logger.warning("Simulation, reading previous snapshot {}".format(previous))
+            path = previous
+        with open(path.joinpath(SNAPSHOT_MANIFEST), encoding='utf8') as fh:
+            manifest = json.load(fh)
+        if manifest.get("version") != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported snapshot version {}".format(manifest.get("version")))
+        arrays = {name: np.load(path.joinpath(name + ".npz"), allow_pickle=False) for name in SNAPSHOT_FILES}
+        return SimulationSnapshot(manifest, arrays)
+
+    def restore_engine(self, engine):
+        """Restaure dans le moteur de simulation les personnes, les registres et les résultats d'évaluation.
+
+        :param engine: le moteur de simulation, sans résultats.
+        :return:
+        """
+        people = self.arrays["people"]
+        self.teachers = [Teacher(firstname, lastname, datetime.date.fromordinal(dob), gender, uid=uid,
+                                 experience=experience, success_factor=success_factor)
+                         for (uid, firstname, lastname, gender, dob, experience, success_factor) in
+                         zip(*(people["teacher_" + name].tolist() for name in
+                               ("uid", "firstname", "lastname", "gender", "dob", "experience", "success_factor")))]
+        self.students = [Student(firstname, lastname, datetime.date.fromordinal(dob), gender, caseweight, uid=uid,
+                                 success_factor=success_factor, success_variability=success_variability,
+                                 success_year_trend=success_year_trend)
+                         for (uid, firstname, lastname, gender, dob, caseweight, success_factor, success_variability,
+                              success_year_trend) in
+                         zip(*(people["student_" + name].tolist() for name in
+                               ("uid", "firstname", "lastname", "gender", "dob", "caseweight", "success_factor",
+                                "success_variability", "success_year_trend")))]
+        for (idx, school_year, start, stop) in zip(*(people["results_" + name].tolist() for name in
+                                                     ("student", "school_year", "start", "stop"))):
+            self.students[idx].results[school_year] = (start, stop)
+        self.system = {name: column.tolist() for (name, column) in self.arrays["system"].items()}
+
+        results = self.arrays["results"]
+        store = engine.results
+        store.students = Codebook(results["codebook_students"].tolist())
+        store.teachers = Codebook(results["codebook_teachers"].tolist())
+        store.evaluation_types = Codebook(results["codebook_evaluation_types"].tolist())
+        start = store.allocate(len(results["student"]))
+        for (name, column) in store.columns.items():
+            column[start:store.size] = results[name]
+
+        registry = self.arrays["registry"]
+        seed = self.manifest["simulator"]["seed"]
+        for (css_id, school_id, pool_name, pool_size, popped) in self.manifest["pools"]:
+            engine.registry.set_pool(css_id, school_id, pool_name, seed, pool_size, popped)
+        engine.registry.pool_positions.update({tuple(position[:-1]): position[-1] for position in
+                                               self.manifest.get("pool_positions", [])})
+        for (css_id, school_id, school_year, role, grade, topic_name, workload, teacher) in \
+                zip(*(registry["staff_" + name].tolist() for name in
+                      ("css_id", "school_id", "school_year", "role", "grade", "topic_name", "workload", "teacher"))):
+            engine.registry.add_staff(css_id, school_id, school_year, role, None if grade < 0 else grade,
+                                      topic_name or None, self.teachers[teacher], workload)
+        for (css_id, school_id, school_year, grade, student) in \
+                zip(*(registry["student_" + name].tolist() for name in
+                      ("css_id", "school_id", "school_year", "grade")), registry["student"].tolist()):
+            engine.registry.add_student(css_id, school_id, school_year, grade, self.students[student])
+        logger.debug("Simulation, restored {} teachers, {} students and {} results from snapshot".format(
+            len(self.teachers), len(self.students), len(store)))
+
+    def restore_css(self, engine, css_phases):
+        """Restaure les phases complétées d'un centre de services scolaires dont l'infrastructure vient d'être
+        reconstruite : personnel et horaires, inscriptions des élèves, intervalles des résultats d'évaluation.
+
+        :param engine: le moteur de simulation.
+        :param css_phases: l'avancement des phases de simulation du centre de services scolaires.
+        :return:
+        """
+        css = css_phases.css
+        entry = next((entry for entry in self.manifest["css"] if entry["id"] == css.id), None)
+        if entry is None:
+            return  # css not reached before the snapshot
+        system = self.system
+        completed = entry["phases"]
+        group_idx = entry["groups"]
+        topic_idx = entry["topics"]
+        for school in css.get_schools():
+            for school_year in school.get_schoolyears():
+                for group in school_year.get_groups():
+                    if PHASE_STAFF in completed and system["group_titulaire"][group_idx] >= 0:
+                        group.set_staff(self.teachers[system["group_titulaire"][group_idx]])
+                        for (topic, teacher) in zip(group.get_topics(), system["topic_teacher"][topic_idx:]):
+                            topic.set_staff(self.teachers[teacher])
+                    if PHASE_ENROLMENT in completed:
+                        for student in system["group_students"][system["group_students_offset"][group_idx]:
+                                                                system["group_students_offset"][group_idx + 1]]:
+                            group.add_student(self.students[student])
+                    if PHASE_EVALUATIONS in completed and system["group_results_start"][group_idx] >= 0:
+                        group.results = (system["group_results_start"][group_idx],
+                                         system["group_results_stop"][group_idx])
+                    group_idx += 1
+                    topic_idx += len(group.get_topics())
+                if PHASE_STAFF in completed:
+                    engine.schedule_school_year(school, school_year)
+        for phase in completed:
+            css_phases.complete(phase)
+
 
 class SimulatorRegistry(object):
     """Définit les registres des personnes dans la simulation. Les registres assurent la cohérence temporelle des
@@ -348,16 +1043,231 @@ class SimulatorRegistry(object):
 
     """
     # TODO move registry as subclass
-    def __init__(self):
+    def __init__(self, streams=None, start_year=None):
         """Initialise les registres des personnes dans la simulation.
 
+        :param streams: l'arbre des flux pseudo-aléatoires de la simulation.
+        :param start_year: l'année de début de la simulation, à laquelle l'âge des personnes générées est établi.
         """
-        self.staff_pool = TeacherPool()
-        self.staff_registry = []  # All staff
-        self.student_pool = StudentPool()
+        self.streams = streams if streams is not None else RandomStreams()
+        # Ages are reached at the start of the first school year rather than today, for reproducible people
+        self.reference_date = datetime.date(start_year, 9, 30) if start_year else None
+        self.staff_pools = {}  # Teacher pool by (css, school)
+        self.staff_registry = []  # All staff assignments
+        self.staff_index = {}  # Staff assignments by (css, school, school year, role, grade or topic)
+        self.staff_uids = {}  # Staffed teacher uids by (css, school, school year)
+        self.student_pools = {}  # Student pool by (css, school)
+        self.pool_demand = {}  # Number of teachers and students to generate by (css, school)
+        self.pool_positions = {}  # People returned by each pool by (css, school, school year, pool)
         self.student_registry = []
+        self.student_index = {}  # Enrolled students by (css, school, school year, grade)
+        self.student_uids = {}  # Enrolled student uids by (css, school, school year, grade)
+        self.student_cohorts = {}  # Promoted students awaiting a group by (css, school, school year, grade)
         self.evaluation_registry = []
 
+    def release(self, css_id, school_id):
+        """Vide les bassins et les registres d'une école dont la simulation est terminée.
+
+        :param css_id: l'identifiant unique du centre de services scolaires.
+        :param school_id: l'identifiant unique de l'école.
+        :return:
+        """
+        key = (css_id, school_id)
+        for registry in (self.staff_pools, self.student_pools, self.pool_demand, self.pool_positions, self.staff_index,
+                         self.staff_uids, self.student_index, self.student_uids, self.student_cohorts):
+            for registry_key in [registry_key for registry_key in registry if registry_key[0:2] == key]:
+                del registry[registry_key]
+        self.staff_registry = [assignment for assignment in self.staff_registry if
+                               (assignment.css_id, assignment.school_id) != key]
+        self.student_registry = [registration for registration in self.student_registry if
+                                 registration[0:2] != key]
+
+    def get_state(self, css_id, school_id, school_year):
+        """Retourne l'état des registres d'une école pour une année scolaire : l'avancement des bassins, les
+        affectations du personnel et les élèves inscrits, avec les attributs de simulation des personnes.
+
+        :param css_id: l'identifiant unique du centre de services scolaires.
+        :param school_id: l'identifiant unique de l'école.
+        :param school_year: l'année scolaire.
+        :return: les lignes d'état des bassins, du personnel et des élèves (pools, staff, students).
+        """
+        key = (css_id, school_id, school_year)
+        pools = [(css_id, school_id, school_year, pool_name, str(self.streams.seed), pool_size,
+                  self.pool_positions.get(key + (pool_name,), popped))
+                 for (pool_css_id, pool_school_id, pool_name, pool_size, popped) in self.get_pools()
+                 if (pool_css_id, pool_school_id) == (css_id, school_id)]
+        staff = [(css_id, school_id, school_year, assignment.role, assignment.grade, assignment.topic_name,
+                  assignment.workload, assignment.teacher.uid, assignment.teacher.firstname,
+                  assignment.teacher.lastname, assignment.teacher.dob, assignment.teacher.gender,
+                  assignment.teacher.experience, assignment.teacher.success_factor)
+                 for (index_key, assignments) in self.staff_index.items() if index_key[0:3] == key
+                 for assignment in assignments]
+        students = [(css_id, school_id, school_year, index_key[3], student.uid, student.firstname, student.lastname,
+                     student.dob, student.gender, student.caseweight, student.success_factor,
+                     student.success_variability, student.success_year_trend)
+                    for (index_key, index_students) in self.student_index.items() if index_key[0:3] == key
+                    for student in index_students]
+        return {"pools": pools, "staff": staff, "students": students}
+
+    def merge(self, registry):
+        """Ajoute les bassins et les registres des écoles d'une autre simulation (ex. écoles simulées par un autre
+        processus); les écoles des deux simulations sont distinctes.
+
+        :param registry: les registres de l'autre simulation.
+        :return:
+        """
+        for (index, other) in ((self.staff_pools, registry.staff_pools), (self.student_pools, registry.student_pools),
+                               (self.pool_demand, registry.pool_demand),
+                               (self.pool_positions, registry.pool_positions), (self.staff_index, registry.staff_index),
+                               (self.staff_uids, registry.staff_uids), (self.student_index, registry.student_index),
+                               (self.student_uids, registry.student_uids),
+                               (self.student_cohorts, registry.student_cohorts)):
+            index.update(other)
+        self.staff_registry.extend(registry.staff_registry)
+        self.student_registry.extend(registry.student_registry)
+        self.evaluation_registry.extend(registry.evaluation_registry)
+
+    def get_pools(self):
+        """Retourne l'avancement des bassins de personnes de chaque école.
+
+        :return: la liste des tuples (centre de services scolaires, école, bassin, taille, personnes retournées).
+        """
+        return [key + (pool_name, pool.pool_size, pool.popped)
+                for (pool_name, pools) in ((POOL_STAFF, self.staff_pools), (POOL_STUDENTS, self.student_pools))
+                for (key, pool) in pools.items()]
+
+    def restore(self, state):
+        """Restaure les registres à partir de l'état sauvegardé de la dernière année scolaire de chaque école : les
+        bassins reprennent là où ils s'étaient arrêtés, et le personnel et les cohortes d'élèves sont reconduits à
+        l'année scolaire suivante.
+
+        :param state: l'état des registres, voir RegistryState.
+        :return:
+        """
+        for (css_id, school_id, school_year, pool_name, seed, pool_size, popped) in state.pools:
+            self.set_pool(css_id, school_id, pool_name, int(seed), pool_size, popped)
+        teachers = {}
+        for (css_id, school_id, school_year, role, grade, topic_name, workload, uid, firstname, lastname, dob, gender,
+             experience, success_factor) in state.staff:
+            if uid not in teachers:
+                teachers[uid] = Teacher(firstname, lastname, datetime.date.fromisoformat(dob), gender, uid=uid,
+                                        experience=experience, success_factor=success_factor)
+            self.add_staff(css_id, school_id, school_year, role, grade, topic_name, teachers[uid], workload)
+        for (css_id, school_id, school_year, grade, uid, firstname, lastname, dob, gender, caseweight, success_factor,
+             success_variability, success_year_trend) in state.students:
+            self.add_student(css_id, school_id, school_year, grade,
+                             Student(firstname, lastname, datetime.date.fromisoformat(dob), gender, caseweight, uid=uid,
+                                     success_factor=success_factor, success_variability=success_variability,
+                                     success_year_trend=success_year_trend))
+        logger.debug("Simulation, restored {} staff assignments and {} students".format(len(state.staff),
+                                                                                       len(state.students)))
+
+    def set_pool(self, css_id, school_id, pool_name, seed, pool_size, popped):
+        """Recrée le bassin d'une école à partir du germe de la simulation et l'avance jusqu'à sa position
+        sauvegardée.
+
+        :param css_id: l'identifiant unique du centre de services scolaires.
+        :param school_id: l'identifiant unique de l'école.
+        :param pool_name: le bassin, POOL_STAFF ou POOL_STUDENTS.
+        :param seed: le germe pseudo-aléatoire de la simulation d'origine.
+        :param pool_size: le nombre de personnes générées à chaque réapprovisionnement.
+        :param popped: le nombre de personnes déjà retournées par le bassin.
+        :return: le bassin.
+        """
+        if pool_name == POOL_STAFF:
+            pool = TeacherPool(spawn(np.random.SeedSequence(seed), css_id, school_id, STREAM_STAFF),
+                               pool_size=pool_size, reference_date=self.reference_date)
+            self.staff_pools[(css_id, school_id)] = pool
+        else:
+            pool = StudentPool(spawn(np.random.SeedSequence(seed), css_id, school_id, STREAM_STUDENTS),
+                               pool_size=pool_size)
+            self.student_pools[(css_id, school_id)] = pool
+        pool.skip(popped)
+        return pool
+
+    def save_pool_position(self, css_id, school_id, school_year, pool_name):
+        """Conserve l'avancement du bassin d'une école à la fin d'une année scolaire, les phases de simulation en
+        mémoire pouvant avoir avancé le bassin pour les années suivantes avant que l'état ne soit sauvegardé.
+
+        :param css_id: l'identifiant unique du centre de services scolaires.
+        :param school_id: l'identifiant unique de l'école.
+        :param school_year: l'année scolaire.
+        :param pool_name: le bassin, POOL_STAFF ou POOL_STUDENTS.
+        :return:
+        """
+        pool = (self.staff_pools if pool_name == POOL_STAFF else self.student_pools).get((css_id, school_id))
+        if pool is not None:
+            self.pool_positions[(css_id, school_id, school_year, pool_name)] = pool.popped
+
+    def add_staff(self, css_id, school_id, school_year, role, grade, topic_name, teacher, workload):
+        """Inscrit une affectation du personnel déjà simulée (ex. reprise d'une simulation).
+
+        :param css_id: l'identifiant unique du centre de services scolaires.
+        :param school_id: l'identifiant unique de l'école.
+        :param school_year: l'année scolaire.
+        :param role: le rôle, ROLE_TITULAIRE ou ROLE_SPECIALIST.
+        :param grade: le niveau (année) scolaire du titulaire, None pour un spécialiste.
+        :param topic_name: le nom de la matière du spécialiste, None pour un titulaire.
+        :param teacher: la personne enseignante.
+        :param workload: la charge de travail affectée.
+        :return: l'affectation.
+        """
+        return self.__register_staff(css_id, school_id, school_year, role, grade, topic_name, teacher, workload)
+
+    def add_student(self, css_id, school_id, school_year, grade, student):
+        """Inscrit un élève déjà simulé au niveau d'une année scolaire (ex. reprise d'une simulation).
+
+        :param css_id: l'identifiant unique du centre de services scolaires.
+        :param school_id: l'identifiant unique de l'école.
+        :param school_year: l'année scolaire.
+        :param grade: le niveau (année) scolaire.
+        :param student: l'élève.
+        :return:
+        """
+        key = (css_id, school_id, school_year, grade)
+        self.student_index.setdefault(key, []).append(student)
+        self.student_uids.setdefault(key, set()).add(student.uid)
+
+    def set_pool_demand(self, css_id, school_id, staff, students):
+        """Définit le nombre de personnes à générer d'un seul coup dans les bassins d'une école.
+
+        :param css_id: l'identifiant unique du centre de services scolaires.
+        :param school_id: l'identifiant unique de l'école.
+        :param staff: le nombre de personnes enseignantes prévu.
+        :param students: le nombre d'élèves prévu.
+        :return:
+        """
+        self.pool_demand[(css_id, school_id)] = (staff, students)
+
+    def get_staff_pool(self, css_id, school_id):
+        """Retourne le bassin de personnes enseignantes d'une école, alimenté par le flux pseudo-aléatoire de l'école.
+
+        :param css_id: l'identifiant unique du centre de services scolaires.
+        :param school_id: l'identifiant unique de l'école.
+        :return: le bassin de personnes enseignantes de l'école.
+        """
+        pool = self.staff_pools.get((css_id, school_id))
+        if pool is None:
+            (staff, students) = self.pool_demand.get((css_id, school_id), (30, 50))
+            pool = TeacherPool(self.streams.sequence(css_id, school_id, STREAM_STAFF), pool_size=staff,
+                               reference_date=self.reference_date)
+            self.staff_pools[(css_id, school_id)] = pool
+        return pool
+
+    def get_student_pool(self, css_id, school_id):
+        """Retourne le bassin d'élèves d'une école, alimenté par le flux pseudo-aléatoire de l'école.
+
+        :param css_id: l'identifiant unique du centre de services scolaires.
+        :param school_id: l'identifiant unique de l'école.
+        :return: le bassin d'élèves de l'école.
+        """
+        pool = self.student_pools.get((css_id, school_id))
+        if pool is None:
+            (staff, students) = self.pool_demand.get((css_id, school_id), (30, 50))
+            pool = StudentPool(self.streams.sequence(css_id, school_id, STREAM_STUDENTS), pool_size=students)
+            self.student_pools[(css_id, school_id)] = pool
+        return pool
+
     def get_student(self, css_id, school_id, group, school_year):
         """Produit un élève à partir de paramètres en prenant compte de l'année scolaire précédente.
 
@@ -370,23 +1280,16 @@ class SimulatorRegistry(object):
         logger.debug(
             "Simulating a student to css {}, school {}, group {}, school year {}".format(css_id, school_id, group.id,
                                                                                          school_year))
-        student_uids = []
-        previous_year = str(int(school_year[0:4]) - 1) + "-" + str(int(school_year[5:9]) - 1)
-        for registrant in self.student_registry:
-            # creating a registry of enrolled student
-            (student_css, student_school, student_school_year, student_group, student) = registrant
-            if student_css == css_id and student_school == school_id and student_school_year == school_year and \
-                    student_group.grade == group.grade and student_group.id == group.id:
-                student_uids.append(student.uid)
-
-        for registrant in self.student_registry:
-            (student_css, student_school, student_school_year, student_group, student) = registrant
-            if student_css == css_id and student_school == school_id and student_school_year == previous_year and \
-                    (student_group.grade - 1) == group.grade and student.uid not in student_uids and (
-                    group.size - group.enrolment) < student.caseweight:
-                self.student_registry.append((css_id, school_id, school_year, group, student))
+        key = (css_id, school_id, school_year, group.grade)
+        if key not in self.student_cohorts:
+            self.promote_cohort(css_id, school_id, school_year, group.grade)
+        cohort = self.student_cohorts[key]
+        while cohort:
+            student = cohort.popleft()
+            if student.uid not in self.student_uids[key] and student.caseweight <= (group.size - group.enrolment):
+                self.__register_student(css_id, school_id, school_year, group, student)
                 return student
-        student = self.student_pool.pop()
+        student = self.get_student_pool(css_id, school_id).pop()
         # Correct year for age (1st year, 6 years old on sept 30)
         dob = student.dob
         ref_year = int(school_year[0:4]) - (5 + group.grade)
@@ -396,9 +1299,36 @@ class SimulatorRegistry(object):
             yob = ref_year + 1
         dob = dob.replace(year=yob)
         student.dob = dob
-        self.student_registry.append((css_id, school_id, school_year, group, student))
+        self.__register_student(css_id, school_id, school_year, group, student)
         return student
 
+    def promote_cohort(self, css_id, school_id, school_year, grade):
+        """Promeut en un seul passage la cohorte d'élèves de l'année scolaire précédente au niveau inférieur vers le
+        niveau désigné. Les élèves promus sont placés en priorité dans les groupes du niveau.
+
+        :param css_id: l'identifiant unique du centre de services scolaires.
+        :param school_id: l'identifiant unique de l'école.
+        :param school_year: l'année scolaire.
+        :param grade: le niveau (année) scolaire des élèves promus.
+        :return: le nombre d'élèves promus.
+        """
+        previous_year = str(int(school_year[0:4]) - 1) + "-" + str(int(school_year[5:9]) - 1)
+        key = (css_id, school_id, school_year, grade)
+        placed_uids = self.student_uids.setdefault(key, set())
+        self.student_index.setdefault(key, [])
+        cohort = self.student_cohorts.setdefault(key, deque())
+        cohort.extend(student for student in self.student_index.get((css_id, school_id, previous_year, grade - 1), [])
+                      if student.uid not in placed_uids)
+        logger.debug("Promoting {} students to css {}, school {}, school year {}, grade {}".format(
+            len(cohort), css_id, school_id, school_year, grade))
+        return len(cohort)
+
+    def __register_student(self, css_id, school_id, school_year, group, student):
+        key = (css_id, school_id, school_year, group.grade)
+        self.student_registry.append((css_id, school_id, school_year, group, student))
+        self.student_index[key].append(student)
+        self.student_uids[key].add(student.uid)
+
     def get_titulaire(self, css_id, school_id, school_year, grade):
         """Produit une personne enseigante titulaire à partir de paramètres en prenant compte de l'année scolaire précédente.
 
@@ -409,29 +1339,21 @@ class SimulatorRegistry(object):
         :return: une personne enseignante titulaire d'un groupe.
         """
         logger.debug("Staffing a titulaire")
-        staffed_uids = []
         previous_year = str(int(school_year[0:4]) - 1) + "-" + str(int(school_year[5:9]) - 1)
-        for registrant in self.staff_registry:
-            # Create registry of staffed teacher
-            (staff_css, staff_school, staff_school_year, staff_role, staff_grade, staff_topic, teacher,
-             workload) = registrant
-            if staff_css == css_id and staff_school == school_id and staff_school_year == school_year \
-                    and staff_grade == grade and staff_role == 'titulaire':
-                staffed_uids.append(teacher.uid)
-        for registrant in self.staff_registry:
+        staffed_uids = self.staff_uids.setdefault((css_id, school_id, school_year), set())
+        for assignment in self.staff_index.get((css_id, school_id, previous_year, ROLE_TITULAIRE, grade), []):
             # Look for previous year staff teacher
-            (staff_css, staff_school, staff_school_year, staff_role, staff_grade, staff_topic, teacher,
-             workload) = registrant
-            if staff_css == css_id and staff_school == school_id and staff_school_year == previous_year \
-                    and staff_grade == grade and staff_role == 'titulaire' and teacher.uid not in staffed_uids:
-                self.staff_registry.append((css_id, school_id, school_year, 'titulaire', grade, None, teacher, 1))
-                return teacher
-        teacher = self.staff_pool.pop()
-        self.staff_registry.append((css_id, school_id, school_year, 'titulaire', grade, None, teacher, 1))
-        return teacher
+            if assignment.teacher.uid not in staffed_uids:
+                return self.__register_staff(css_id, school_id, school_year, ROLE_TITULAIRE, grade, None,
+                                             assignment.teacher, 1).teacher
+        teacher = self.get_staff_pool(css_id, school_id).pop()
+        return self.__register_staff(css_id, school_id, school_year, ROLE_TITULAIRE, grade, None, teacher, 1).teacher
 
     def get_specialist(self, css_id, school_id, school_year, topic):
         """Produit une personne enseigante spécialiste à partir de paramètres en prenant compte de l'année scolaire précédente.
+        La charge de la matière est attribuée selon la stratégie du meilleur ajustement (best-fit) parmi les
+        spécialistes de la matière déjà affectés dans l'année, sinon à un spécialiste de l'année précédente, sinon à
+        une nouvelle personne enseignante.
 
                 :param css_id: l'identifiant unique du centre de services scolaires.
                 :param school_id: l'identifiant unique de l'école.
@@ -441,23 +1363,64 @@ class SimulatorRegistry(object):
         """
         logger.debug("Staffing a specialist")
         previous_year = str(int(school_year[0:4]) - 1) + "-" + str(int(school_year[5:9]) - 1)
-        for registrant in self.staff_registry:
-            # Create registry of staffed teacher
-            (staff_css, staff_school, staff_school_year, staff_role, staff_grade, staff_topic, teacher,
-             workload) = registrant
-            if staff_css == css_id and staff_school == school_id and staff_school_year == school_year \
-                    and staff_topic == topic.name and staff_role == 'specialist' and (1 - workload) < topic.workload:
-                registrant[-1] += topic.workload  # Simple update of workload
-                return teacher
-        for registrant in self.staff_registry:
+        best_fit = None
+        for assignment in self.staff_index.get((css_id, school_id, school_year, ROLE_SPECIALIST, topic.name), []):
+            # Smallest remaining workload that still fits the topic
+            if assignment.fits(topic.workload) and (best_fit is None or assignment.workload > best_fit.workload):
+                best_fit = assignment
+        if best_fit is not None:
+            best_fit.workload += topic.workload
+            return best_fit.teacher
+        staffed_uids = self.staff_uids.setdefault((css_id, school_id, school_year), set())
+        for assignment in self.staff_index.get((css_id, school_id, previous_year, ROLE_SPECIALIST, topic.name), []):
             # Look for previous year staff teacher
-            (staff_css, staff_school, staff_school_year, staff_role, staff_grade, staff_topic, teacher,
-             workload) = registrant
-            if staff_css == css_id and staff_school == school_id and staff_school_year == previous_year \
-                    and staff_topic == topic.name and staff_role == 'specialist':
-                self.staff_registry.append(
-                    (css_id, school_id, school_year, 'specialist', None, topic, teacher, topic.workload))
-                return teacher
-        teacher = self.staff_pool.pop()
-        self.staff_registry.append((css_id, school_id, school_year, 'specialist', None, topic, teacher, topic.workload))
-        return teacher
+            if assignment.teacher.uid not in staffed_uids:
+                return self.__register_staff(css_id, school_id, school_year, ROLE_SPECIALIST, None, topic.name,
+                                             assignment.teacher, topic.workload).teacher
+        teacher = self.get_staff_pool(css_id, school_id).pop()
+        return self.__register_staff(css_id, school_id, school_year, ROLE_SPECIALIST, None, topic.name, teacher,
+                                     topic.workload).teacher
+
+    def __register_staff(self, css_id, school_id, school_year, role, grade, topic_name, teacher, workload):
+        assignment = StaffAssignment(css_id, school_id, school_year, role, grade, topic_name, teacher, workload)
+        key = grade if role == ROLE_TITULAIRE else topic_name
+        self.staff_registry.append(assignment)
+        self.staff_index.setdefault((css_id, school_id, school_year, role, key), []).append(assignment)
+        self.staff_uids.setdefault((css_id, school_id, school_year), set()).add(teacher.uid)
+        return assignment
+
+
+class StaffAssignment(object):
+    """Définit l'affectation d'une personne enseignante à une école pour une année scolaire, avec sa charge de
+    travail en équivalent temps complet.
+
+    """
+
+    def __init__(self, css_id, school_id, school_year, role, grade, topic_name, teacher, workload):
+        """Initialise l'affectation d'une personne enseignante.
+
+        :param css_id: l'identifiant unique du centre de services scolaires.
+        :param school_id: l'identifiant unique de l'école.
+        :param school_year: l'année scolaire.
+        :param role: le rôle, prend la valeur 'titulaire' ou 'specialist'.
+        :param grade: le niveau (année) scolaire du titulaire.
+        :param topic_name: la matière scolaire du spécialiste.
+        :param teacher: la personne enseignante.
+        :param workload: la charge de travail affectée.
+        """
+        self.css_id = css_id
+        self.school_id = school_id
+        self.school_year = school_year
+        self.role = role
+        self.grade = grade
+        self.topic_name = topic_name
+        self.teacher = teacher
+        self.workload = workload
+
+    def fits(self, workload):
+        """Indique si une charge de travail supplémentaire respecte la charge d'une tâche à temps complet.
+
+        :param workload: la charge de travail supplémentaire.
+        :return: vrai si la charge peut être ajoutée.
+        """
+        return self.workload + workload <= FULL_WORKLOAD + 1e-9
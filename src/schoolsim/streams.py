@@ -0,0 +1,53 @@
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STREAM_STUDENTS = 0
+STREAM_STAFF = 1
+STREAM_GROUPS = 2
+
+
+def spawn(seed_sequence, *keys):
+    """Retourne la séquence enfant d'une séquence de germes, adressée par des clés plutôt que par l'ordre des appels.
+    Le résultat est identique à celui de SeedSequence.spawn pour le même rang d'enfant.
+
+    :param seed_sequence: la séquence de germes parente.
+    :param keys: les clés entières de l'enfant (ex. identifiants du centre de services, de l'école).
+    :return: la séquence de germes enfant.
+    """
+    return np.random.SeedSequence(seed_sequence.entropy, spawn_key=seed_sequence.spawn_key + tuple(keys),
+                                  pool_size=seed_sequence.pool_size)
+
+
+class RandomStreams(object):
+    """Définit l'arbre des flux pseudo-aléatoires de la simulation. Chaque entité (centre de services, école,
+    groupe, élève) dispose d'un flux indépendant dérivé du germe de la simulation, de sorte qu'une partie de la
+    simulation peut être recalculée à l'identique, dans n'importe quel ordre et dans n'importe quel processus.
+
+    """
+
+    def __init__(self, seed=None):
+        """Initialise l'arbre des flux pseudo-aléatoires.
+
+        :param seed: le germe de la simulation, un germe aléatoire est tiré si aucun n'est fourni.
+        """
+        self.root = np.random.SeedSequence(seed)
+        self.seed = self.root.entropy
+        logger.debug("Simulation, random streams seeded with {}".format(self.seed))
+
+    def sequence(self, *keys):
+        """Retourne la séquence de germes d'une entité.
+
+        :param keys: les clés entières de l'entité.
+        :return: la séquence de germes de l'entité.
+        """
+        return spawn(self.root, *keys)
+
+    def generator(self, *keys):
+        """Retourne le générateur pseudo-aléatoire d'une entité.
+
+        :param keys: les clés entières de l'entité.
+        :return: le générateur pseudo-aléatoire de l'entité.
+        """
+        return np.random.default_rng(self.sequence(*keys))